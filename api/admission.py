@@ -0,0 +1,200 @@
+"""
+Admission control for generations: who may start one, and whether this process can take it.
+
+Two checks run before any credit is reserved, in this order:
+
+- `JobBudget`: how many generations this process has admitted but not finished (queued plus
+  running; TRYON_MAX_PENDING_GENERATIONS) and roughly how much memory their images hold
+  (TRYON_MAX_PENDING_BYTES). The job queue is the bounded wait queue; once it is full, new
+  work is turned away instead of queueing behind minutes of backlog.
+- `RateLimiter`: a token bucket per user, refilled at TRYON_RATE_LIMIT_PER_MINUTE with room
+  for TRYON_RATE_LIMIT_BURST generations at once. A batch costs one token per garment; one
+  bigger than the burst is let through only on a full bucket and leaves it in deficit, so the
+  user waits it off at the same per-minute rate. TRYON_RATE_LIMIT_PER_MINUTE=0 turns it off. Tokens are taken last and given
+  back (`refund`) if the request fails before its job is queued, e.g. for lack of credits.
+
+Either one rejects with 429 and a Retry-After header: the time until the user's bucket has
+enough tokens, or an estimate from recent job durations of when a slot frees up.
+
+Buckets live in memory by default, which limits per instance. To share them across instances
+set TRYON_RATE_LIMIT_BACKEND=supabase (the take_rate_limit_tokens function from the
+rate_limits migration) or point it at a `module:Class` implementing `RateLimitBackend`.
+The job budget is always per process: it protects this worker's memory. /extract-images has
+a bucket of its own (TRYON_EXTRACT_RATE_LIMIT_PER_MINUTE / _BURST, one token per URL).
+"""
+import importlib
+import math
+import os
+import time
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("TRYON_RATE_LIMIT_PER_MINUTE", "10"))
+RATE_LIMIT_BURST = float(os.getenv("TRYON_RATE_LIMIT_BURST", "5"))
+# Product-page extraction: each URL is a page fetch plus image probes on someone else's site.
+EXTRACT_RATE_LIMIT_PER_MINUTE = float(os.getenv("TRYON_EXTRACT_RATE_LIMIT_PER_MINUTE", "60"))
+EXTRACT_RATE_LIMIT_BURST = float(os.getenv("TRYON_EXTRACT_RATE_LIMIT_BURST", "20"))
+MAX_PENDING_GENERATIONS = int(os.getenv("TRYON_MAX_PENDING_GENERATIONS", "64"))
+MAX_PENDING_BYTES = int(os.getenv("TRYON_MAX_PENDING_BYTES", str(1024 * 1024 * 1024)))
+
+# A garment given by URL is downloaded later; assume a large retailer image.
+GARMENT_URL_BYTES_ESTIMATE = 16 * 1024 * 1024
+# Buckets untouched this long are full again and can be forgotten.
+_IDLE_BUCKET_SECONDS = 3600
+
+
+def image_bytes_estimate(size: int | None, width: int, height: int) -> int:
+    """Memory an upload ties up until its job finishes: the file plus one decoded RGBA copy."""
+    return (size or 0) + width * height * 4
+
+
+def _too_many(detail: str, retry_after: float, reason: str) -> HTTPException:
+    metrics.increment("tryon_admission_rejected_total", "Requests turned away by admission control.", reason=reason)
+    seconds = max(1, math.ceil(retry_after))
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(seconds)})
+
+
+class RateLimitBackend:
+    """Token-bucket storage. Shared implementations make the limit hold across instances."""
+
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """
+        Take `cost` tokens from `key`'s bucket (refilled at `rate` per second up to `burst`).
+        Returns 0 when granted, otherwise the seconds until it would be; nothing is taken then.
+        A cost above `burst` is granted on a full bucket and leaves it negative. A negative
+        `cost` gives tokens back (never past `burst`).
+        """
+        raise NotImplementedError
+
+
+class InProcessRateLimitBackend(RateLimitBackend):
+    def __init__(self):
+        # key -> (tokens, monotonic time of last update)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._last_prune = time.monotonic()
+
+    async def take(self, key, cost, rate, burst):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        needed = min(cost, burst)
+        if tokens >= needed:
+            self._buckets[key] = (min(burst, tokens - cost), now)
+            wait = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            wait = (needed - tokens) / rate
+        self._prune(now)
+        return wait
+
+    def _prune(self, now: float) -> None:
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        idle = [k for k, (_, updated) in self._buckets.items() if now - updated > _IDLE_BUCKET_SECONDS]
+        for key in idle:
+            del self._buckets[key]
+
+
+class SupabaseRateLimitBackend(RateLimitBackend):
+    """Buckets in Postgres, updated atomically by the take_rate_limit_tokens RPC."""
+
+    def __init__(self, get_supabase):
+        self._get_supabase = get_supabase
+
+    async def take(self, key, cost, rate, burst):
+        query = self._get_supabase().rpc(
+            "take_rate_limit_tokens", {"p_key": key, "p_cost": cost, "p_rate": rate, "p_burst": burst}
+        )
+        return float((await run_in_threadpool(query.execute)).data)
+
+
+def load_rate_limit_backend(get_supabase) -> RateLimitBackend:
+    spec = os.getenv("TRYON_RATE_LIMIT_BACKEND", "")
+    if not spec or spec == "memory":
+        return InProcessRateLimitBackend()
+    if spec == "supabase":
+        return SupabaseRateLimitBackend(get_supabase)
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class RateLimiter:
+    """Per-user buckets for one kind of request (`name`), e.g. "generate" or "extract"."""
+
+    def __init__(self, backend: RateLimitBackend, per_minute: float = RATE_LIMIT_PER_MINUTE, burst: float = RATE_LIMIT_BURST,
+                 name: str = "generate", detail: str = "Too many generations. Please wait a moment and try again."):
+        self.backend = backend
+        self.rate = per_minute / 60
+        self.burst = max(1.0, burst)
+        self.name = name
+        self.detail = detail
+
+    async def check(self, user_id: str, cost: int = 1) -> None:
+        """Spend `cost` tokens from the user's bucket or raise 429."""
+        if self.rate <= 0:
+            return
+        try:
+            wait = await self.backend.take(f"{self.name}:{user_id}", cost, self.rate, self.burst)
+        except Exception as e:
+            # A limiter outage shouldn't take the endpoint down with it.
+            print(f"Rate limiter unavailable, admitting: {e}")
+            return
+        if wait > 0:
+            reason = "rate_limit" if self.name == "generate" else f"{self.name}_rate_limit"
+            raise _too_many(self.detail, wait, reason)
+
+    async def refund(self, user_id: str, cost: int = 1) -> None:
+        """Give back what `check` took when the request is turned away after it."""
+        if self.rate <= 0:
+            return
+        try:
+            await self.backend.take(f"{self.name}:{user_id}", -cost, self.rate, self.burst)
+        except Exception as e:
+            print(f"Rate limiter refund failed: {e}")
+
+
+class JobBudget:
+    """Generations (and their image bytes) admitted by this process and not yet finished."""
+
+    def __init__(self, max_generations: int = MAX_PENDING_GENERATIONS, max_bytes: int = MAX_PENDING_BYTES, workers: int = 8):
+        self.max_generations = max_generations
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self.generations = 0
+        self.bytes = 0
+        # Running estimate of how long one generation takes, for Retry-After.
+        self._seconds_per_generation = 10.0
+
+    def admit(self, generations: int, nbytes: int) -> None:
+        """Reserve room for a job or raise 429; pair with `release` once the job is done."""
+        if self.generations and self.generations + generations > self.max_generations:
+            backlog = self.generations + generations - self.max_generations
+            raise _too_many("The service is busy. Please try again shortly.", self._retry_after(backlog), "generations")
+        # One oversized job may still run alone; it just can't pile onto others.
+        if self.bytes and self.bytes + nbytes > self.max_bytes:
+            raise _too_many("The service is busy. Please try again shortly.", self._retry_after(generations), "memory")
+        self.generations += generations
+        self.bytes += nbytes
+
+    def release(self, generations: int, nbytes: int, run_seconds: float | None = None) -> None:
+        self.generations = max(0, self.generations - generations)
+        self.bytes = max(0, self.bytes - nbytes)
+        if run_seconds is not None and generations:
+            per_generation = run_seconds / generations
+            self._seconds_per_generation += 0.2 * (per_generation - self._seconds_per_generation)
+
+    def _retry_after(self, backlog: int) -> float:
+        return min(120.0, self._seconds_per_generation * max(1, backlog / self.workers))
+
+    def stats(self) -> dict:
+        return {
+            "generations": self.generations,
+            "max_generations": self.max_generations,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "seconds_per_generation": self._seconds_per_generation,
+        }
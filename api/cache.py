@@ -0,0 +1,185 @@
+"""
+Small key/value caches with TTL + LRU eviction and hit/miss counters.
+
+Each cache is configured from the environment under its own prefix, e.g. for
+`create_cache("TRYON_RESULT", ...)`:
+
+    TRYON_RESULT_CACHE=memory|sqlite|off
+    TRYON_RESULT_CACHE_PATH=.cache/tryon_result.sqlite3   (sqlite only)
+    TRYON_RESULT_CACHE_TTL=86400                          (seconds)
+    TRYON_RESULT_CACHE_MAX_ENTRIES=10000
+
+`memory` is per-process; `sqlite` survives restarts and is shared by processes on one host,
+which is what we want for local development. Values must be JSON-serializable.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_registry: dict[str, "Cache"] = {}
+
+
+class Cache:
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value, ttl_seconds: float | None = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._set(key, value, time.time() + ttl)
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def _get(self, key: str):
+        raise NotImplementedError
+
+    def _set(self, key: str, value, expires_at: float) -> None:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class NullCache(Cache):
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value, expires_at):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class MemoryCache(Cache):
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int):
+        super().__init__(name, ttl_seconds, max_entries)
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(Cache):
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int, path: str):
+        super().__init__(name, ttl_seconds, max_entries)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _set(self, key, value, expires_at):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            overflow = len(self) - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def create_cache(prefix: str, default_ttl: float, default_max_entries: int, default_backend: str = "memory") -> Cache:
+    backend = os.getenv(f"{prefix}_CACHE", default_backend).lower()
+    ttl = float(os.getenv(f"{prefix}_CACHE_TTL", str(default_ttl)))
+    max_entries = int(os.getenv(f"{prefix}_CACHE_MAX_ENTRIES", str(default_max_entries)))
+    name = prefix.lower()
+
+    if backend == "off":
+        cache = NullCache(name, ttl, max_entries)
+    elif backend == "sqlite":
+        path = os.getenv(f"{prefix}_CACHE_PATH", os.path.join(".cache", f"{name}.sqlite3"))
+        cache = SQLiteCache(name, ttl, max_entries, path)
+    else:
+        cache = MemoryCache(name, ttl, max_entries)
+
+    _registry[name] = cache
+    return cache
+
+
+def all_cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _registry.items()}
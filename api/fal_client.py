@@ -0,0 +1,257 @@
+"""
+Resilient client for Fal's synchronous REST endpoints.
+
+Wraps the pooled "fal" HTTP client with:
+- a concurrency semaphore so we stay inside our Fal rate limits (FAL_MAX_CONCURRENCY),
+- jittered exponential retries on 429/5xx and connection errors, honouring Retry-After (FAL_RETRIES),
+- optional hedging: if a call is still running after the observed p95 latency, fire a second
+  identical request and take whichever answers first (FAL_HEDGE; doubles cost for slow calls),
+- a circuit breaker that fails fast with 503 once FAL_CIRCUIT_THRESHOLD of the last 20 calls
+  failed, and lets a single probe through after FAL_CIRCUIT_RESET_SECONDS.
+
+`benchmarks/bench_fal_client.py` exercises all of this against the local stub Fal with
+injected latency and errors.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+import httpx
+from fastapi import HTTPException
+
+from . import http_client
+
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ReadError, httpx.RemoteProtocolError, httpx.PoolTimeout)
+
+
+class FalRequestError(RuntimeError):
+    def __init__(self, status_code: int, text: str, retry_after: float | None = None):
+        super().__init__(f"Fal request failed ({status_code}): {text}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens when `failure_threshold` of the last `window` calls failed, rejects calls for
+    `reset_seconds`, then lets one probe through (half-open) to decide whether to close again.
+    A rolling window rather than a consecutive count, because under load fast failures
+    finish before slow successes and would trip a consecutive counter on a mostly healthy Fal.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, window: int = 20):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: deque[bool] = deque(maxlen=max(window, failure_threshold))
+        self._probe_in_flight = False
+
+    @property
+    def failures(self) -> int:
+        return self._outcomes.count(False)
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """End a call without judging Fal's health either way."""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            self._outcomes.clear()
+        self._outcomes.append(True)
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._outcomes.append(False)
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            if self.state == self.CLOSED:
+                print(f"Fal circuit breaker open: {self.failures} of the last {len(self._outcomes)} calls failed")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class FalClient:
+    def __init__(
+        self,
+        base_url: str,
+        key: str | None,
+        max_concurrency: int = int(os.getenv("FAL_MAX_CONCURRENCY", "16")),
+        retries: int = int(os.getenv("FAL_RETRIES", "2")),
+        hedge: bool = os.getenv("FAL_HEDGE", "false").lower() in ("1", "true", "yes"),
+        failure_threshold: int = int(os.getenv("FAL_CIRCUIT_THRESHOLD", "10")),
+        reset_seconds: float = float(os.getenv("FAL_CIRCUIT_RESET_SECONDS", "30")),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.key = key
+        self.retries = retries
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self._max_concurrency = max_concurrency
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._latencies: deque[float] = deque(maxlen=200)
+        self.calls = 0
+        self.attempts = 0
+        self.retried = 0
+        self.hedged = 0
+        self.rejected = 0
+        self.status_codes: dict[int, int] = {}
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def p95_latency(self) -> float | None:
+        # Too few samples to hedge on yet.
+        if len(self._latencies) < 20:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "rejected": self.rejected,
+            "circuit": self.breaker.state,
+            "p95_latency": self.p95_latency(),
+            "status_codes": dict(self.status_codes),
+        }
+
+    async def run(self, model_path: str, body: bytes) -> dict:
+        """POST a JSON-encoded `body` to `model_path` and return the decoded response."""
+        if not self.key:
+            raise RuntimeError("FAL_KEY is not set. Export FAL_KEY='<id>:<secret>' before running the server.")
+        self.calls += 1
+        url = f"{self.base_url}/{model_path.lstrip('/')}"
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="The image model is temporarily unavailable. Please try again shortly.")
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    resp = await self._attempt(url, body)
+            except FalRequestError as e:
+                if e.status_code == 429:
+                    # Too fast, not down: don't count it against the breaker.
+                    self.breaker.release()
+                else:
+                    self.breaker.record_failure()
+                retry_after = e.retry_after
+                if attempt >= self.retries:
+                    raise
+            except _RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                if attempt >= self.retries:
+                    raise
+            except httpx.TimeoutException:
+                # Retrying a 3-minute timeout only doubles the wait; hedging covers slow calls.
+                self.breaker.record_failure()
+                raise
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception:
+                # Fal answered (e.g. 4xx): it's up, the request itself was bad.
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return resp
+            attempt += 1
+            self.retried += 1
+            backoff = min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            await asyncio.sleep(max(backoff, retry_after or 0))
+
+    async def _attempt(self, url: str, body: bytes) -> dict:
+        p95 = self.p95_latency() if self.hedge else None
+        if p95 is None:
+            return await self._post(url, body)
+
+        first = asyncio.create_task(self._post(url, body))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=p95)
+            if done:
+                return first.result()
+            # The hedge takes a slot of its own so FAL_MAX_CONCURRENCY stays a cap on requests in
+            # flight; with none free, just keep waiting on the first request.
+            semaphore = self.semaphore
+            if semaphore.locked():
+                return await first
+            await semaphore.acquire()
+            self.hedged += 1
+            second = asyncio.create_task(self._post(url, body))
+            second.add_done_callback(lambda _t: semaphore.release())
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also reached when our caller is cancelled: don't leave a request running unowned.
+            for task in pending:
+                task.cancel()
+
+    async def _post(self, url: str, body: bytes) -> dict:
+        headers = {
+            # Fal docs commonly use "Key <FAL_KEY>"
+            "Authorization": f"Key {self.key}",
+            "Content-Type": "application/json",
+        }
+        self.attempts += 1
+        start = time.monotonic()
+        resp = await http_client.request("fal", "POST", url, headers=headers, content=body, retries=0)
+        self.status_codes[resp.status_code] = self.status_codes.get(resp.status_code, 0) + 1
+        if resp.status_code >= 400:
+            if resp.status_code == 401:
+                raise HTTPException(
+                    status_code=401,
+                    detail=(
+                        "Fal authentication failed (401). Your `FAL_KEY` is missing, revoked, or incorrect. "
+                        "Create a new key in the Fal dashboard, set it as `FAL_KEY`, restart the server, and retry."
+                    ),
+                )
+            if resp.status_code in _RETRYABLE_STATUSES:
+                retry_after = resp.headers.get("retry-after")
+                raise FalRequestError(
+                    resp.status_code,
+                    resp.text,
+                    float(retry_after) if retry_after and retry_after.isdigit() else None,
+                )
+            # Include response text for debugging (but never include secrets).
+            raise RuntimeError(f"Fal request failed ({resp.status_code}): {resp.text}")
+        self._latencies.append(time.monotonic() - start)
+        return resp.json()
@@ -0,0 +1,174 @@
+"""
+Shared on-disk cache for downloaded garment images.
+
+Popular products get tried on thousands of times, so garment URLs are fetched once and kept on
+disk keyed by the URL minus known tracking parameters (utm_*, gclid, fbclid, ...), so the same
+image shared through different campaign links is stored once. Everything else in the URL is
+part of the key, and the URL is fetched exactly as given: size parameters select a different
+rendition, signed CDN URLs need their query string, and a cleaned "hi-res" variant may not
+exist. Entries older than
+`revalidate_after` seconds are revalidated with a conditional GET (ETag / Last-Modified), the
+directory is kept under a byte budget by evicting least-recently-used entries, and concurrent
+requests for the same URL share one in-flight download.
+
+The directory can be shared by all workers on a host; files are written atomically.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from . import http_client
+
+_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+# Query parameters that only say where a link was shared; they never change the image.
+_TRACKING_PARAMS = ("gclid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid", "_ga", "igshid")
+# Entries used this recently are never evicted, so concurrent readers of a hot entry don't race a delete.
+_EVICTION_GRACE_SECONDS = 60
+
+
+def cache_url(url: str) -> str:
+    """`url` without tracking parameters: the part of it that decides which image comes back."""
+    parts = urlsplit(url)
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query), fragment=""))
+
+
+class GarmentCache:
+    def __init__(self, directory: str, max_bytes: int, revalidate_after: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        os.makedirs(directory, exist_ok=True)
+
+    async def fetch(self, url: str) -> bytes:
+        """Return the image bytes at `url`, downloading or revalidating as needed."""
+        key = hashlib.sha256(cache_url(url).encode("utf-8")).hexdigest()
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        # Shield so one cancelled caller doesn't cancel the download for everyone else.
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "inflight": len(self._inflight),
+        }
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, key)
+        return base + ".img", base + ".json"
+
+    def _read_meta(self, meta_path: str) -> dict | None:
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _read(self, data_path: str) -> bytes:
+        with open(data_path, "rb") as f:
+            return f.read()
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp_")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    async def _fetch(self, key: str, url: str) -> bytes:
+        data_path, meta_path = self._paths(key)
+        meta = self._read_meta(meta_path) if os.path.exists(data_path) else None
+
+        if meta and time.time() - meta.get("validated_at", 0) < self.revalidate_after:
+            self.hits += 1
+            os.utime(meta_path)
+            return await asyncio.to_thread(self._read, data_path)
+
+        headers = {"User-Agent": "Mozilla/5.0"}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            resp = await http_client.request("retail", "GET", url, headers=headers)
+        except Exception as e:
+            if meta is None:
+                raise
+            # The retailer CDN is flaky right now; a slightly stale garment beats a failed generation.
+            print(f"Garment revalidation failed for {url}, serving cached copy: {e}")
+            self.hits += 1
+            return await asyncio.to_thread(self._read, data_path)
+        if resp.status_code == 304 and meta:
+            self.revalidated += 1
+            meta["validated_at"] = time.time()
+            await asyncio.to_thread(self._write_atomic, meta_path, json.dumps(meta).encode("utf-8"))
+            return await asyncio.to_thread(self._read, data_path)
+
+        resp.raise_for_status()
+        content_type = (resp.headers.get("content-type") or "").lower()
+        if "image" not in content_type and not url.lower().split("?")[0].endswith(_IMAGE_EXTENSIONS):
+            raise ValueError(f"URL did not look like an image (content-type={content_type!r})")
+
+        self.misses += 1
+        meta = {
+            "url": url,
+            "etag": resp.headers.get("etag"),
+            "last_modified": resp.headers.get("last-modified"),
+            "content_type": content_type,
+            "size": len(resp.content),
+            "validated_at": time.time(),
+        }
+        await asyncio.to_thread(self._store, data_path, meta_path, resp.content, meta)
+        return resp.content
+
+    def _store(self, data_path: str, meta_path: str, content: bytes, meta: dict) -> None:
+        self._write_atomic(data_path, content)
+        self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            data_path = meta_path[: -len(".json")] + ".img"
+            try:
+                size = os.path.getsize(data_path)
+                last_used = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            entries.append((last_used, size, data_path, meta_path))
+            total += size
+
+        now = time.time()
+        for last_used, size, data_path, meta_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if now - last_used < _EVICTION_GRACE_SECONDS:
+                continue
+            for p in (meta_path, data_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
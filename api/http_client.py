@@ -0,0 +1,184 @@
+"""
+Shared, pooled HTTP clients for everything we call: Fal, retailer pages and image CDNs.
+
+Each named pool is one long-lived `httpx.AsyncClient`, so TCP+TLS connections are kept alive
+and reused (HTTP/2 when the `h2` package is installed and the server supports it). Pools are
+configured from the environment, e.g. for the "retail" pool:
+
+    HTTP_RETAIL_TIMEOUT=30            total seconds per request
+    HTTP_RETAIL_MAX_CONNECTIONS=100   open connections across all hosts
+    HTTP_RETAIL_MAX_PER_HOST=8        concurrent requests to one host
+    HTTP_RETAIL_RETRIES=2             retries for idempotent requests on connect errors / 502-504
+
+`pool_stats()` reports per-pool request counts, in-flight requests and open connections.
+"""
+import asyncio
+import contextlib
+import os
+import random
+from urllib.parse import urlparse
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_RETRY_STATUSES = (502, 503, 504)
+_IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_POOL_DEFAULTS = {
+    # One Fal host, long-running requests; concurrency is bounded by the Fal client itself.
+    "fal": {"timeout": float(os.getenv("FAL_TIMEOUT", "180")), "max_connections": 64, "max_per_host": 64, "retries": 0},
+    # Our own object storage (Supabase Storage / S3).
+    "storage": {"timeout": 60.0, "max_connections": 32, "max_per_host": 32, "retries": 2},
+    # Many retailer hosts; be polite per host.
+    "retail": {"timeout": 30.0, "max_connections": 100, "max_per_host": 8, "retries": 2},
+}
+
+
+def _pool_config(name: str) -> dict:
+    defaults = _POOL_DEFAULTS.get(name, _POOL_DEFAULTS["retail"])
+    prefix = f"HTTP_{name.upper()}_"
+    return {
+        "timeout": float(os.getenv(prefix + "TIMEOUT", str(defaults["timeout"]))),
+        "max_connections": int(os.getenv(prefix + "MAX_CONNECTIONS", str(defaults["max_connections"]))),
+        "max_per_host": int(os.getenv(prefix + "MAX_PER_HOST", str(defaults["max_per_host"]))),
+        "retries": int(os.getenv(prefix + "RETRIES", str(defaults["retries"]))),
+    }
+
+
+class _Pool:
+    def __init__(self, name: str):
+        self.name = name
+        self.config = _pool_config(name)
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.in_flight = 0
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Clients are bound to the loop that first used them (benchmarks and tests run several).
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            limits = httpx.Limits(
+                max_connections=self.config["max_connections"],
+                max_keepalive_connections=self.config["max_connections"],
+                keepalive_expiry=60,
+            )
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=self.config["timeout"],
+                # Transport-level retries only cover failed connection attempts.
+                transport=httpx.AsyncHTTPTransport(http2=_HTTP2, limits=limits, retries=1),
+            )
+            self._loop = loop
+            self._host_limits = {}
+        return self._client
+
+    def host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        sem = self._host_limits.get(host)
+        if sem is None:
+            sem = self._host_limits[host] = asyncio.Semaphore(self.config["max_per_host"])
+        return sem
+
+    def stats(self) -> dict:
+        data = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "http2": _HTTP2,
+            "connections": 0,
+            "idle_connections": 0,
+        }
+        # httpx doesn't expose its pool publicly; best-effort peek at the httpcore pool.
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        for conn in getattr(pool, "connections", []):
+            data["connections"] += 1
+            if conn.is_idle():
+                data["idle_connections"] += 1
+        return data
+
+
+_pools: dict[str, _Pool] = {}
+
+
+def _get_pool(name: str) -> _Pool:
+    pool = _pools.get(name)
+    if pool is None:
+        pool = _pools[name] = _Pool(name)
+    return pool
+
+
+def get_client(pool: str) -> httpx.AsyncClient:
+    return _get_pool(pool).client
+
+
+async def request(pool: str, method: str, url: str, retries: int | None = None, **kwargs) -> httpx.Response:
+    """
+    Send a request through the named pool, honouring its per-host limit and retry policy.
+    Non-idempotent methods are only retried when `retries` is passed explicitly.
+    """
+    p = _get_pool(pool)
+    if retries is None:
+        retries = p.config["retries"] if method.upper() in _IDEMPOTENT_METHODS else 0
+
+    attempt = 0
+    while True:
+        p.requests += 1
+        p.in_flight += 1
+        try:
+            async with p.host_limit(url):
+                resp = await p.client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ReadError, httpx.RemoteProtocolError):
+            p.errors += 1
+            if attempt >= retries:
+                raise
+        else:
+            if resp.status_code not in _RETRY_STATUSES or attempt >= retries:
+                return resp
+            p.errors += 1
+        finally:
+            p.in_flight -= 1
+        attempt += 1
+        p.retries += 1
+        await asyncio.sleep(min(2.0, 0.2 * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+@contextlib.asynccontextmanager
+async def stream(pool: str, method: str, url: str, **kwargs):
+    """
+    Streaming variant of `request` (`async with stream(...) as resp`), holding the per-host slot
+    until the body has been consumed or abandoned. Not retried: a partly read body can't be.
+    """
+    p = _get_pool(pool)
+    p.requests += 1
+    p.in_flight += 1
+    try:
+        async with p.host_limit(url):
+            async with p.client.stream(method, url, **kwargs) as resp:
+                yield resp
+    except httpx.HTTPError:
+        p.errors += 1
+        raise
+    finally:
+        p.in_flight -= 1
+
+
+def pool_stats() -> dict:
+    return {name: pool.stats() for name, pool in _pools.items()}
+
+
+async def close_all() -> None:
+    for pool in _pools.values():
+        if pool._client is not None:
+            await pool._client.aclose()
+            pool._client = None
@@ -0,0 +1,72 @@
+"""
+Image format and dimensions from the first bytes of a file, without decoding it.
+
+Enough to rank remote images from a ranged GET, or to vet an upload before it's accepted.
+Covers JPEG, PNG, GIF and WebP; AVIF/HEIC are recognised but their dimensions aren't read.
+"""
+
+
+def read_image_header(data: bytes) -> tuple[str, int | None, int | None] | None:
+    """
+    Return (format, width, height) for a recognised image, with None dimensions if they lie
+    beyond `data` (e.g. a JPEG with a large EXIF block), or None if it isn't an image we know.
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        if len(data) >= 24 and data[12:16] == b"IHDR":
+            return "png", int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+        return "png", None, None
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        if len(data) >= 10:
+            return "gif", int.from_bytes(data[6:8], "little"), int.from_bytes(data[8:10], "little")
+        return "gif", None, None
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ("webp",) + _webp_size(data)
+    if data.startswith(b"\xff\xd8\xff"):
+        return ("jpeg",) + _jpeg_size(data)
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"avif", b"avis"):
+            return "avif", None, None
+        if brand in (b"heic", b"heix", b"mif1", b"msf1"):
+            return "heic", None, None
+    return None
+
+
+def _webp_size(data: bytes) -> tuple[int | None, int | None]:
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        # Lossy: 14-bit sizes after the key-frame start code.
+        return int.from_bytes(data[26:28], "little") & 0x3FFF, int.from_bytes(data[28:30], "little") & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None, None
+
+
+# Start-of-frame markers carry the dimensions; C4 (DHT), C8 (JPG) and CC (DAC) don't.
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(data: bytes) -> tuple[int | None, int | None]:
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None, None  # Not at a marker: corrupt or not really a JPEG.
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1  # Fill byte.
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2  # Markers without a length.
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if marker in _JPEG_SOF:
+            if i + 9 > len(data):
+                break
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + length
+    return None, None
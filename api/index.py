@@ -2,24 +2,50 @@ from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Header, Requ
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
 from fastapi.responses import Response
-import uvicorn
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import shutil
 import os
 import uuid
 import time
-import stripe
-from jose import jwt
-from supabase import create_client, Client
-
-from .scraper import extract_images_from_url
-from .tryon import generate_tryon_image
+import json
+import base64
+import hashlib
+import asyncio
+from dotenv import load_dotenv
+
+from . import metrics
+from .admission import (
+    EXTRACT_RATE_LIMIT_BURST,
+    EXTRACT_RATE_LIMIT_PER_MINUTE,
+    GARMENT_URL_BYTES_ESTIMATE,
+    JobBudget,
+    RateLimiter,
+    image_bytes_estimate,
+    load_rate_limit_backend,
+)
+from .cache import all_cache_stats, create_cache
+from .jobs import INLINE_MAX_SECONDS, Job, JobQueue
+from .storage import SIGNED_URL_TTL, LocalStorage, copy_from_url, storage
+from .uploads import UploadLimitMiddleware, max_body_bytes, validate_image_upload
+from .webhooks import StripeEventProcessor, verify_stripe_signature
+
+# Every serverless cold start imports this module, so the heavy SDKs (stripe, supabase, jose,
+# Pillow via .tryon, lxml via .scraper, httpx) are imported by the routes that need
+# them rather than here. `python -m benchmarks.bench_cold_start` tracks the cost.
+
+load_dotenv()
 
 app = FastAPI()
 
 # Stripe Config
 STRIPE_API_KEY = os.environ.get("STRIPE_API_KEY")
 STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
-stripe.api_key = STRIPE_API_KEY
+
+def get_stripe():
+    import stripe
+    stripe.api_key = STRIPE_API_KEY
+    return stripe
 
 # Pricing Plans (Stripe Price IDs)
 PLANS = {
@@ -27,15 +53,42 @@ PLANS = {
     "pro": {"credits": 100, "price": 2499}, # $24.99
 }
 
+# Identical requests served from the result cache are free unless this is turned off.
+FREE_CACHED_GENERATIONS = os.environ.get("FREE_CACHED_GENERATIONS", "true").lower() in ("1", "true", "yes")
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Batch try-on limits
+BATCH_MAX_GARMENTS = int(os.environ.get("BATCH_MAX_GARMENTS", "20"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+# Inline (serverless) batches must finish inside INLINE_MAX_SECONDS; plan each round of
+# BATCH_CONCURRENCY generations at this many seconds (a slow Fal call plus a retry).
+INLINE_SECONDS_PER_GENERATION = float(os.environ.get("TRYON_INLINE_SECONDS_PER_GENERATION", "60"))
+
+# Gallery page size
+GALLERY_PAGE_SIZE = int(os.environ.get("GALLERY_PAGE_SIZE", "24"))
+GALLERY_MAX_PAGE_SIZE = 100
+GALLERY_COLUMNS = "id,created_at,result_url,thumbnail_url"
+
 # Supabase Config
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET") # Found in Supabase Settings > API
 
-# Initialize Supabase Admin Client
-supabase: Client = None
-if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
-    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# Supabase Admin Client, created on first use
+supabase = None
+
+def get_supabase():
+    global supabase
+    if supabase is None and SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
+        from supabase import create_client
+        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    return supabase
+
+# Verified JWT claims keyed by token hash (never outliving the token's `exp`), and profiles for a
+# few seconds; credit changes made by this process update or drop the cached profile.
+_token_cache = create_cache("AUTH_TOKEN", 300, 10000)
+_profile_cache = create_cache("PROFILE", 30, 10000)
 
 # Use /tmp for uploads on Vercel, local 'uploads' otherwise
 if os.environ.get("VERCEL"):
@@ -45,6 +98,33 @@ else:
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Uploads up to this size are kept in memory; larger ones spill to a temp file in UPLOAD_DIR
+# that is removed when the generation finishes.
+UPLOAD_SPILL_BYTES = int(os.environ.get("UPLOAD_SPILL_BYTES", str(16 * 1024 * 1024)))
+
+# Oversized bodies are cut off while they stream in (see api/uploads.py); metrics wraps it so
+# those 413s are still counted.
+app.add_middleware(UploadLimitMiddleware, limits={
+    "/generate": max_body_bytes(2),
+    "/generate/batch": max_body_bytes(BATCH_MAX_GARMENTS + 1),
+})
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+async def _read_upload(upload: UploadFile, name: str) -> bytes | str:
+    if upload.size is not None:
+        metrics.record_bytes("upload", upload.size)
+    with metrics.span("upload_read"):
+        if upload.size is not None and upload.size > UPLOAD_SPILL_BYTES:
+            path = os.path.join(UPLOAD_DIR, name)
+
+            def spill():
+                with open(path, "wb") as buffer:
+                    shutil.copyfileobj(upload.file, buffer)
+
+            await run_in_threadpool(spill)
+            return path
+        return await upload.read()
+
 async def get_current_user(authorization: str = Header(None)):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
@@ -54,14 +134,95 @@ async def get_current_user(authorization: str = Header(None)):
         raise HTTPException(status_code=500, detail="Backend configuration error: JWT Secret missing")
 
     token = authorization.split(" ")[1]
+    token_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    payload = _token_cache.get(token_key)
+    if payload is not None and payload.get("exp", float("inf")) > time.time():
+        return payload
+    from jose import jwt
     try:
         # Verify the Supabase JWT
         payload = jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"], audience="authenticated")
+        ttl = _token_cache.ttl_seconds
+        if "exp" in payload:
+            ttl = min(ttl, payload["exp"] - time.time())
+        if ttl > 0:
+            _token_cache.set(token_key, payload, ttl_seconds=ttl)
         return payload
     except Exception as e:
         print(f"JWT Verification failed for token starting with {token[:10]}...: {e}")
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
 
+async def _rpc(fn: str, params: dict):
+    with metrics.span("supabase", rpc=fn):
+        return (await run_in_threadpool(get_supabase().rpc(fn, params).execute)).data
+
+def _cache_credits(user_id: str, credits: int | None):
+    """Keep a cached profile in step with a balance we just wrote (or drop it if unknown)."""
+    profile = _profile_cache.get(user_id)
+    if profile is None:
+        return
+    if credits is None:
+        _profile_cache.delete(user_id)
+    else:
+        _profile_cache.set(user_id, {**profile, "credits": credits})
+
+async def _admit_generation(user_id: str, uploads: list[UploadFile], garment_urls: int, generations: int) -> int:
+    """
+    Validate the files, take room in this process's job budget and rate-limit the user, all
+    before anything is reserved, stored or sent to Fal (see api/admission.py). The user's
+    tokens are spent last, so a request turned away here costs them nothing. Returns the bytes
+    admitted; hand everything back with _release_admission if the job is never submitted.
+    """
+    nbytes = garment_urls * GARMENT_URL_BYTES_ESTIMATE
+    for upload in uploads:
+        _, width, height = await validate_image_upload(upload)
+        nbytes += image_bytes_estimate(upload.size, width, height)
+    job_budget.admit(generations, nbytes)
+    try:
+        await rate_limiter.check(user_id, generations)
+    except HTTPException:
+        job_budget.release(generations, nbytes)
+        raise
+    return nbytes
+
+async def _release_admission(user_id: str, generations: int, nbytes: int):
+    """Undo _admit_generation for a request that failed before its job was queued."""
+    job_budget.release(generations, nbytes)
+    await rate_limiter.refund(user_id, generations)
+
+async def _reserve_credits(user: dict, amount: int) -> tuple[str, int]:
+    """
+    Take `amount` credits up front in one atomic statement (see the atomic_credits migration).
+    Returns (reservation id, remaining credits); settle it with _commit_credits or _refund_credits.
+    """
+    try:
+        rows = await _rpc("reserve_credits", {"p_user_id": user["sub"], "p_amount": amount, "p_email": user.get("email")})
+    except Exception as e:
+        print(f"Credit reservation failed: {e}")
+        raise HTTPException(status_code=500, detail="Error checking user credits")
+    if not rows:
+        if amount == 1:
+            raise HTTPException(status_code=402, detail="Insufficient credits. Please top up.")
+        raise HTTPException(status_code=402, detail=f"This needs {amount} credits. Please top up.")
+    _cache_credits(user["sub"], rows[0]["credits"])
+    return rows[0]["reservation_id"], rows[0]["credits"]
+
+async def _commit_credits(user_id: str, reservation_id: str, used: int | None = None) -> int:
+    """Keep `used` credits of the reservation (all by default) and refund the rest; returns the balance."""
+    credits = await _rpc("commit_credits", {"p_reservation_id": reservation_id, "p_used": used})
+    _cache_credits(user_id, credits)
+    return credits
+
+async def _refund_credits(user_id: str, reservation_id: str) -> int | None:
+    try:
+        credits = await _rpc("refund_credits", {"p_reservation_id": reservation_id})
+    except Exception as e:
+        # The reservation stays open and is swept by refund_stale_credit_reservations().
+        print(f"Credit refund failed for reservation {reservation_id}: {e}")
+        credits = None
+    _cache_credits(user_id, credits)
+    return credits
+
 @app.post("/generate")
 async def generate(
     base_image: UploadFile = File(...),
@@ -78,83 +239,474 @@ async def generate(
     user = await get_current_user(authorization)
     user_id = user["sub"]
     
-    if not supabase:
+    if not get_supabase():
         raise HTTPException(status_code=500, detail="Supabase not configured")
 
-    # Fetch user profile
+    if not garment_image and not garment_url:
+        raise HTTPException(status_code=400, detail="No garment image provided")
+    # Only remote URLs; a bare string would otherwise be treated as a server-side path.
+    if not garment_image and not garment_url.lower().startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="garment_url must be an http(s) URL")
+    admitted_bytes = await _admit_generation(
+        user_id, [base_image] + ([garment_image] if garment_image else []), int(not garment_image and bool(garment_url)), 1
+    )
     try:
-        profile = supabase.table("profiles").select("credits").eq("id", user_id).single().execute()
-        if not profile.data:
-            # Create profile if it doesn't exist (safety fallback)
-            profile_data = {"id": user_id, "email": user.get("email"), "credits": 3}
-            supabase.table("profiles").insert(profile_data).execute()
-            credits = 3
-        else:
-            credits = profile.data["credits"]
-    except Exception as e:
-        print(f"Profile check failed: {e}")
-        raise HTTPException(status_code=500, detail="Error checking user credits")
+        reservation_id, _ = await _reserve_credits(user, 1)
+    except HTTPException:
+        await _release_admission(user_id, 1, admitted_bytes)
+        raise
 
-    if credits < 1:
-        raise HTTPException(status_code=402, detail="Insufficient credits. Please top up.")
+    request_id = metrics.current_request_id() or str(uuid.uuid4())
 
-    request_id = str(uuid.uuid4())
-    # ... (rest of the logic remains similar but with credit deduction)
-    
     try:
-        # 2. Save base image
-        base_path = os.path.join(UPLOAD_DIR, f"{request_id}_base_{base_image.filename}")
-        with open(base_path, "wb") as buffer:
-            shutil.copyfileobj(base_image.file, buffer)
+        # 2. Read base image
+        base_name = f"{request_id}_base_{base_image.filename}"
+        base_data = await _read_upload(base_image, base_name)
 
         # 3. Get garment image
-        garment_path_or_url = ""
         if garment_image:
-            garment_path = os.path.join(UPLOAD_DIR, f"{request_id}_garment_{garment_image.filename}")
-            with open(garment_path, "wb") as buffer:
-                shutil.copyfileobj(garment_image.file, buffer)
-            garment_path_or_url = garment_path
-        elif garment_url:
-            garment_path_or_url = garment_url
+            garment_name = f"{request_id}_garment_{garment_image.filename}"
+            garment_data = await _read_upload(garment_image, garment_name)
         else:
-            raise HTTPException(status_code=400, detail="No garment image provided")
-
-        # 4. Generate
-        result_url = generate_tryon_image(
-            base_path, 
-            garment_path_or_url, 
-            garment_category=garment_category
+            garment_name = garment_url
+            garment_data = garment_url
+
+        # 4. Queue the generation; the client polls /jobs/{job_id} for the result (or, inline on
+        # serverless, gets it in this response).
+        payload = {
+            "request_id": request_id,
+            "base_image": base_data,
+            "base_name": base_name,
+            "garment_image": garment_data,
+            "garment_name": garment_name,
+            "spilled_paths": [p for p in (base_data, garment_data) if isinstance(p, str) and p != garment_url],
+            "garment_category": garment_category,
+            "reservation_id": reservation_id,
+            "admitted": [1, admitted_bytes],
+        }
+        if job_queue.inline:
+            return await _run_inline(user_id, payload)
+        job = await job_queue.submit(user_id, payload)
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"},
         )
 
-        # 5. Save to Gallery
-        try:
-            # Note: We should ideally upload images to Supabase Storage first if they are local /tmp files
-            # For now, we store the result_url from Fal directly.
-            gen_data = {
-                "user_id": user_id,
-                "base_url": base_path, # This might break on serverless if not uploaded
-                "garment_url": garment_path_or_url,
-                "result_url": result_url
-            }
-            supabase.table("generations").insert(gen_data).execute()
-        except Exception as e:
-            print(f"Gallery save failed: {e}")
-
-        # 6. Deduct Credit
-        supabase.table("profiles").update({"credits": credits - 1}).eq("id", user_id).execute()
-
-        return {"result_url": result_url, "remaining_credits": credits - 1}
-
     except HTTPException as e:
+        await _refund_credits(user_id, reservation_id)
+        await _release_admission(user_id, 1, admitted_bytes)
         return JSONResponse(status_code=e.status_code, content={"detail": e.detail})
     except Exception as e:
+        await _refund_credits(user_id, reservation_id)
+        await _release_admission(user_id, 1, admitted_bytes)
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
+async def _run_inline(user_id: str, payload: dict):
+    """
+    Serverless (see api/jobs.py): run the job in this request and answer with its result, the
+    way /jobs/{id} would report it once finished. Credits and admission are settled by _run_job.
+    """
+    job = await job_queue.run(user_id, payload)
+    if job.error is not None:
+        return JSONResponse(status_code=job.error["status_code"], content={"detail": job.error["detail"]})
+    return job.result
+
+_background_tasks: set[asyncio.Task] = set()
+
+def _spawn_background(coro):
+    # Keep a reference so the task isn't garbage-collected before it finishes.
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def _store_image(user_id: str, image: bytes | str, kind: str) -> str | None:
+    """Persist a base or garment image (bytes, spilled path or garment URL); returns its URL."""
+    try:
+        if isinstance(image, str) and image.lower().startswith(("http://", "https://")):
+            from .tryon import fetch_garment_image
+            data = await fetch_garment_image(image)
+        elif isinstance(image, str):
+            data = await run_in_threadpool(lambda: open(image, "rb").read())
+        else:
+            data = image
+        # Garments are shared across users; base photos stay under the user's prefix.
+        prefix = "garments" if kind == "garment" else f"users/{user_id}/bases"
+        with metrics.span("storage_upload"):
+            return await storage.put_content_addressed(prefix, data)
+    except Exception as e:
+        print(f"Storing {kind} image failed: {e}")
+        return None
+
+async def _persist_result(generation_id: str, user_id: str, result_url: str, cache_key: str | None):
+    # Fal's URL is ephemeral: copy the result (and a thumbnail) into our storage after responding.
+    try:
+        with metrics.span("persist_result"):
+            stored_url, thumbnail_url = await copy_from_url(result_url, f"users/{user_id}/results/{generation_id}")
+        with metrics.span("supabase"):
+            await run_in_threadpool(
+                get_supabase().table("generations").update({"result_url": stored_url, "thumbnail_url": thumbnail_url}).eq("id", generation_id).execute
+            )
+        if cache_key:
+            # Later cache hits get the stored copy, which outlives Fal's URL.
+            from .tryon import remember_stored_result
+            await remember_stored_result(cache_key, stored_url, thumbnail_url)
+    except Exception as e:
+        print(f"Persisting result {generation_id} failed: {e}")
+
+async def _save_generation(user_id: str, base_url: str, garment_url: str, result_url: str, tryon_stats: dict):
+    """Insert the gallery row now and move the result into our storage in the background."""
+    generation_id = str(uuid.uuid4())
+    # A result cache hit may already point at our stored copy; then there's nothing to move.
+    stored = storage.key_of(result_url) is not None
+    try:
+        with metrics.span("supabase"):
+            await run_in_threadpool(get_supabase().table("generations").insert({
+                "id": generation_id,
+                "user_id": user_id,
+                "base_url": base_url,
+                "garment_url": garment_url,
+                "result_url": result_url,
+                **({"thumbnail_url": tryon_stats.get("thumbnail_url")} if stored else {}),
+            }).execute)
+    except Exception as e:
+        print(f"Gallery save failed: {e}")
+        return
+    if stored:
+        return
+    persist = _persist_result(generation_id, user_id, result_url, tryon_stats.get("result_cache_key"))
+    if job_queue.inline:
+        # Nothing is guaranteed to run after a serverless response; Fal's URL would expire.
+        await persist
+    else:
+        _spawn_background(persist)
+
+async def _viewable_url(url: str) -> str:
+    """What to hand the browser for a result: stored copies are private and need signing."""
+    with metrics.span("storage_sign"):
+        (viewable,) = await storage.viewable_urls([url])
+    return viewable or url
+
+async def _run_generation_job(job: Job, report_stage):
+    from .tryon import generate_tryon_image
+    user_id = job.user_id
+    params = job.payload
+
+    await report_stage("generating")
+    # Upload the inputs while Fal is busy so storage adds no latency.
+    inputs_task = asyncio.gather(
+        _store_image(user_id, params["base_image"], "base"),
+        _store_image(user_id, params["garment_image"], "garment"),
+    )
+    tryon_stats = {}
+    try:
+        result_url = await generate_tryon_image(
+            params["base_image"],
+            params["garment_image"],
+            garment_category=params["garment_category"],
+            stats=tryon_stats
+        )
+    finally:
+        stored_base_url, stored_garment_url = await inputs_task
+        # Drop the image data as soon as it's been sent; the job record outlives the generation.
+        for key in ("base_image", "garment_image"):
+            params.pop(key, None)
+        for path in params["spilled_paths"]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # 5. Save to Gallery
+    await report_stage("saving")
+    await _save_generation(
+        user_id,
+        stored_base_url or params["base_name"],
+        stored_garment_url or params["garment_name"],
+        result_url,
+        tryon_stats
+    )
+
+    # 6. Settle the credit reserved at submit time
+    cached = tryon_stats["cache_hit"]
+    remaining_credits = await _commit_credits(
+        user_id, params["reservation_id"], 0 if cached and FREE_CACHED_GENERATIONS else 1
+    )
+
+    return {"result_url": await _viewable_url(result_url), "remaining_credits": remaining_credits, "cached": cached}
+
+@app.post("/generate/batch")
+async def generate_batch(
+    base_image: UploadFile = File(...),
+    garment_images: list[UploadFile] = File(None),
+    garment_urls: list[str] = Form(None),
+    garment_category: str = Form("tops"),
+    authorization: str = Header(None)
+):
+    """
+    Try one base photo against many garments. Reserves one credit per garment up front, runs
+    the generations with bounded concurrency and publishes each item on the job as it finishes
+    (poll /jobs/{id} or follow /jobs/{id}/events). Failed items are refunded; the batch job
+    itself succeeds as long as it ran, with per-item `status` in `items`.
+    """
+    user = await get_current_user(authorization)
+    user_id = user["sub"]
+
+    if not get_supabase():
+        raise HTTPException(status_code=500, detail="Supabase not configured")
+
+    garment_images = garment_images or []
+    garment_urls = garment_urls or []
+    count = len(garment_images) + len(garment_urls)
+    if count == 0:
+        raise HTTPException(status_code=400, detail="No garment images provided")
+    if count > BATCH_MAX_GARMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_GARMENTS} garments per batch")
+    if job_queue.inline and count > _inline_batch_limit():
+        # It would be cut off part-way; turn it away before anything is reserved.
+        raise HTTPException(status_code=400, detail=f"At most {_inline_batch_limit()} garments per batch")
+    if any(not u.lower().startswith(("http://", "https://")) for u in garment_urls):
+        raise HTTPException(status_code=400, detail="garment_urls must be http(s) URLs")
+    admitted_bytes = await _admit_generation(user_id, [base_image] + garment_images, len(garment_urls), count)
+    try:
+        reservation_id, _ = await _reserve_credits(user, count)
+    except HTTPException:
+        await _release_admission(user_id, count, admitted_bytes)
+        raise
+
+    request_id = metrics.current_request_id() or str(uuid.uuid4())
+    try:
+        base_name = f"{request_id}_base_{base_image.filename}"
+        base_data = await _read_upload(base_image, base_name)
+        garments = []
+        for i, upload in enumerate(garment_images):
+            name = f"{request_id}_garment{i}_{upload.filename}"
+            garments.append({"name": name, "image": await _read_upload(upload, name)})
+        garments.extend({"name": url, "image": url} for url in garment_urls)
+    except Exception:
+        await _refund_credits(user_id, reservation_id)
+        await _release_admission(user_id, count, admitted_bytes)
+        raise
+
+    spilled = [p for p in [base_data] + [g["image"] for g in garments[:len(garment_images)]] if isinstance(p, str)]
+    payload = {
+        "kind": "batch",
+        "request_id": request_id,
+        "base_image": base_data,
+        "base_name": base_name,
+        "garments": garments,
+        "spilled_paths": spilled,
+        "garment_category": garment_category,
+        "reserved_credits": count,
+        "reservation_id": reservation_id,
+        "admitted": [count, admitted_bytes],
+    }
+    if job_queue.inline:
+        return await _run_inline(user_id, payload)
+    job = await job_queue.submit(user_id, payload)
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}", "reserved_credits": count},
+    )
+
+def _inline_batch_limit() -> int:
+    """Largest batch that fits in one inline run at the planned time per generation."""
+    rounds = max(1, int(INLINE_MAX_SECONDS // INLINE_SECONDS_PER_GENERATION))
+    return min(BATCH_MAX_GARMENTS, rounds * BATCH_CONCURRENCY)
+
+async def _run_batch_job(job: Job, report_stage):
+    from .tryon import generate_tryon_image, prepare_tryon_image
+    user_id = job.user_id
+    params = job.payload
+    garments = params["garments"]
+    items = [{"index": i, "garment": g["name"], "status": "queued"} for i, g in enumerate(garments)]
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_item(i: int, base_prepared: dict):
+        async with semaphore:
+            items[i]["status"] = "running"
+            store_task = asyncio.create_task(_store_image(user_id, garments[i]["image"], "garment"))
+            tryon_stats = {}
+            try:
+                result_url = await generate_tryon_image(
+                    base_prepared,
+                    garments[i]["image"],
+                    garment_category=params["garment_category"],
+                    stats=tryon_stats
+                )
+                viewable_url = await _viewable_url(result_url)
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                items[i].update(status="failed", error=detail)
+            else:
+                items[i].update(status="succeeded", result_url=viewable_url, cached=tryon_stats["cache_hit"])
+                garment_url = await store_task
+                await _save_generation(user_id, stored_base_url, garment_url or garments[i]["name"], result_url, tryon_stats)
+            finally:
+                if not store_task.done():
+                    store_task.cancel()
+                garments[i]["image"] = None
+            done = sum(item["status"] in ("succeeded", "failed") for item in items)
+            await report_stage(f"generated {done}/{len(items)}", {"items": items})
+
+    try:
+        await report_stage("preparing")
+        # Normalize (and store) the base photo once for the whole batch.
+        base_data = params.pop("base_image")
+        stored_base_url, base_prepared = await asyncio.gather(
+            _store_image(user_id, base_data, "base"),
+            prepare_tryon_image(base_data),
+            return_exceptions=True
+        )
+        stored_base_url = stored_base_url or params["base_name"]
+        if isinstance(base_prepared, Exception):
+            for item in items:
+                item.update(status="failed", error=f"Base image could not be processed: {base_prepared}")
+        else:
+            await asyncio.gather(*(run_item(i, base_prepared) for i in range(len(garments))))
+    finally:
+        for path in params["spilled_paths"]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Refund what we didn't deliver (and cache hits, when those are free).
+    failed = sum(item["status"] != "succeeded" for item in items)
+    free = sum(bool(item.get("cached")) for item in items) if FREE_CACHED_GENERATIONS else 0
+    refund = failed + free
+    remaining_credits = await _commit_credits(user_id, params["reservation_id"], len(items) - refund)
+
+    return {
+        "items": items,
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "refunded_credits": refund,
+        "remaining_credits": remaining_credits,
+    }
+
+async def _run_job(job: Job, report_stage):
+    # Workers outlive requests: pick up the submitting request's id for logs, traces and spans.
+    metrics.bind_request(job.payload.get("request_id"))
+    kind = job.payload.get("kind", "single")
+    status = "failed"
+    started = time.monotonic()
+    try:
+        if kind == "batch":
+            result = await _run_batch_job(job, report_stage)
+        else:
+            result = await _run_generation_job(job, report_stage)
+        status = "succeeded"
+        return result
+    except BaseException:
+        # Nothing was delivered; a no-op if the reservation was already settled.
+        await _refund_credits(job.user_id, job.payload["reservation_id"])
+        raise
+    finally:
+        generations, admitted_bytes = job.payload.get("admitted", (0, 0))
+        job_budget.release(generations, admitted_bytes, time.monotonic() - started)
+        metrics.increment("tryon_jobs_total", "Finished generation jobs.", kind=kind, status=status)
+        metrics.log_timings("job_finished", job_id=job.id, kind=kind, status=status)
+
+job_queue = JobQueue(_run_job)
+
+# Per-user token buckets and this process's budget of queued + running generations.
+_rate_limit_backend = load_rate_limit_backend(get_supabase)
+rate_limiter = RateLimiter(_rate_limit_backend)
+extract_limiter = RateLimiter(
+    _rate_limit_backend, EXTRACT_RATE_LIMIT_PER_MINUTE, EXTRACT_RATE_LIMIT_BURST,
+    name="extract", detail="Too many product pages. Please wait a moment and try again.",
+)
+job_budget = JobBudget(workers=job_queue.concurrency)
+
+async def _get_owned_job(job_id: str, authorization: str) -> Job:
+    user = await get_current_user(authorization)
+    job = await job_queue.get(job_id)
+    # Someone else's job is reported as missing rather than forbidden.
+    if job is None or job.user_id != user["sub"]:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, authorization: str = Header(None)):
+    job = await _get_owned_job(job_id, authorization)
+    return job.to_public()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, authorization: str = Header(None)):
+    await _get_owned_job(job_id, authorization)
+
+    async def stream():
+        async for job in job_queue.watch(job_id):
+            yield f"event: {job.status}\ndata: {json.dumps(job.to_public())}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _encode_gallery_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_gallery_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, generation_id = json.loads(raw)
+        # Both end up inside a PostgREST filter; only accept what they can legitimately be.
+        uuid.UUID(generation_id)
+        if not isinstance(created_at, str) or any(c in created_at for c in '",()\\'):
+            raise ValueError(created_at)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid gallery cursor")
+    return created_at, generation_id
+
 @app.get("/gallery")
-async def get_gallery(authorization: str = Header(None)):
+async def get_gallery(
+    request: Request,
+    cursor: str = None,
+    limit: int = GALLERY_PAGE_SIZE,
+    authorization: str = Header(None)
+):
+    """
+    One page of the user's generations, newest first. Keyset-paginated on (created_at, id)
+    so every page costs the same index range scan however long the history is; pass the
+    returned `next_cursor` back as `cursor` for the next page (null on the last one).
+    """
     user = await get_current_user(authorization)
-    gens = supabase.table("generations").select("*").eq("user_id", user["sub"]).order("created_at", desc=True).execute()
-    return gens.data
+    limit = max(1, min(limit, GALLERY_MAX_PAGE_SIZE))
+
+    query = (
+        get_supabase().table("generations")
+        .select(GALLERY_COLUMNS)
+        .eq("user_id", user["sub"])
+    )
+    if cursor:
+        created_at, generation_id = _decode_gallery_cursor(cursor)
+        query = query.or_(
+            f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{generation_id})'
+        )
+    # One extra row tells us whether there is another page without a count query.
+    gens = await run_in_threadpool(
+        query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute
+    )
+    items = gens.data[:limit]
+    next_cursor = _encode_gallery_cursor(items[-1]) if len(gens.data) > limit else None
+    page = json.dumps({"items": items, "next_cursor": next_cursor}).encode("utf-8")
+
+    # Thumbnails get filled in after the row is written, so the ETag covers the whole page. It
+    # also changes every half signed-URL lifetime, so a cached page's URLs are never near expiry.
+    window = int(time.time() // max(1, SIGNED_URL_TTL // 2))
+    etag = '"' + hashlib.sha256(page + str(window).encode()).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if etag in (request.headers.get("if-none-match") or ""):
+        return Response(status_code=304, headers=headers)
+
+    # Images are private; sign them only for pages actually sent.
+    urls = [item.get(column) for item in items for column in ("result_url", "thumbnail_url")]
+    with metrics.span("storage_sign"):
+        signed = iter(await storage.viewable_urls(urls, SIGNED_URL_TTL))
+    for item in items:
+        item["result_url"], item["thumbnail_url"] = next(signed), next(signed)
+    body = json.dumps({"items": items, "next_cursor": next_cursor}).encode("utf-8")
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/checkout")
 async def create_checkout_session(plan: str, authorization: str = Header(None)):
@@ -163,7 +715,8 @@ async def create_checkout_session(plan: str, authorization: str = Header(None)):
         raise HTTPException(status_code=400, detail="Invalid plan")
     
     try:
-        session = stripe.checkout.Session.create(
+        session = await run_in_threadpool(
+            get_stripe().checkout.Session.create,
             payment_method_types=['card'],
             line_items=[{
                 'price_data': {
@@ -185,34 +738,40 @@ async def create_checkout_session(plan: str, authorization: str = Header(None)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Purchases are recorded by Stripe event id and credited exactly once (see api/webhooks.py).
+stripe_events = StripeEventProcessor(get_supabase, on_applied=_profile_cache.delete)
+
 @app.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     payload = await request.body()
     sig_header = request.headers.get('stripe-signature')
 
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, STRIPE_WEBHOOK_SECRET)
-    except Exception as e:
+        event = verify_stripe_signature(payload, sig_header, STRIPE_WEBHOOK_SECRET)
+    except ValueError as e:
         return JSONResponse(status_code=400, content={"detail": str(e)})
 
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        user_id = session['client_reference_id']
-        credits_to_add = int(session['metadata']['credits'])
-        
-        # Add credits to user profile
-        profile = supabase.table("profiles").select("credits").eq("id", user_id).single().execute()
-        if profile.data:
-            new_credits = profile.data["credits"] + credits_to_add
-            supabase.table("profiles").update({"credits": new_credits}).eq("id", user_id).execute()
+    # Acknowledge once the event is recorded; it's applied in the background (or by the sweep).
+    try:
+        await stripe_events.receive(event)
+    except Exception as e:
+        print(f"Failed to record Stripe event {event['id']}: {e}")
+        return JSONResponse(status_code=503, content={"detail": "Could not record event"})
 
     return {"status": "success"}
 
 @app.get("/user/profile")
 async def get_profile(authorization: str = Header(None)):
     user = await get_current_user(authorization)
-    profile = supabase.table("profiles").select("*").eq("id", user["sub"]).single().execute()
-    return profile.data
+    profile = _profile_cache.get(user["sub"])
+    if profile is None:
+        result = await run_in_threadpool(
+            get_supabase().table("profiles").select("*").eq("id", user["sub"]).single().execute
+        )
+        profile = result.data
+        if profile:
+            _profile_cache.set(user["sub"], profile)
+    return profile
 
 @app.get("/favicon.ico")
 async def favicon():
@@ -223,16 +782,97 @@ async def favicon():
 async def health():
     return {"status": "ok"}
 
+def _check_metrics_token(authorization: str | None):
+    # Monitoring endpoints are open unless METRICS_TOKEN is set.
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+@app.get("/stats")
+async def stats(authorization: str = Header(None)):
+    _check_metrics_token(authorization)
+    from . import http_client
+    from .tryon import fal_client
+    return {
+        "http_pools": http_client.pool_stats(),
+        "caches": all_cache_stats(),
+        "fal": fal_client.stats(),
+        "admission": job_budget.stats(),
+    }
+
+def _metric_families() -> list:
+    """Prometheus views of the counters other modules already keep for /stats."""
+    from . import http_client
+    from .tryon import _garment_cache, fal_client
+    caches = {**all_cache_stats(), "tryon_garment_files": _garment_cache.stats()}
+    fal = fal_client.stats()
+    pools = http_client.pool_stats()
+    budget = job_budget.stats()
+    return [
+        ("cache_hits_total", "counter", "Cache hits.", [({"cache": n}, s["hits"]) for n, s in caches.items()]),
+        ("cache_misses_total", "counter", "Cache misses.", [({"cache": n}, s["misses"]) for n, s in caches.items()]),
+        ("cache_hit_ratio", "gauge", "Cache hits over lookups since start.",
+         [({"cache": n}, s["hits"] / ((s["hits"] + s["misses"]) or 1)) for n, s in caches.items()]),
+        ("fal_responses_total", "counter", "Fal responses by HTTP status.",
+         [({"status": code}, count) for code, count in fal["status_codes"].items()]),
+        ("fal_calls_total", "counter", "Fal calls (before retries and hedges).", [({}, fal["calls"])]),
+        ("fal_retries_total", "counter", "Retried Fal attempts.", [({}, fal["retried"])]),
+        ("fal_hedged_total", "counter", "Hedged Fal attempts.", [({}, fal["hedged"])]),
+        ("fal_rejected_total", "counter", "Fal calls rejected by the circuit breaker.", [({}, fal["rejected"])]),
+        ("fal_circuit_open", "gauge", "1 while the Fal circuit breaker is open.", [({}, int(fal["circuit"] == "open"))]),
+        ("http_pool_requests_total", "counter", "Outbound requests per pool.", [({"pool": n}, s["requests"]) for n, s in pools.items()]),
+        ("http_pool_errors_total", "counter", "Outbound request errors per pool.", [({"pool": n}, s["errors"]) for n, s in pools.items()]),
+        ("http_pool_in_flight", "gauge", "Outbound requests in flight per pool.", [({"pool": n}, s["in_flight"]) for n, s in pools.items()]),
+        ("tryon_pending_generations", "gauge", "Generations admitted and not yet finished.", [({}, budget["generations"])]),
+        ("tryon_pending_bytes", "gauge", "Estimated image bytes held by pending generations.", [({}, budget["bytes"])]),
+    ]
+
+@app.get("/metrics")
+async def prometheus_metrics(authorization: str = Header(None)):
+    """Prometheus text exposition: per-stage timings, payload sizes, caches, Fal statuses."""
+    _check_metrics_token(authorization)
+    body = metrics.render(_metric_families())
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _client_ip(request: Request) -> str:
+    # Behind Vercel's proxy the socket peer is the proxy; it sets X-Real-IP (and nobody else can).
+    if os.environ.get("VERCEL") and request.headers.get("x-real-ip"):
+        return request.headers["x-real-ip"]
+    return request.client.host if request.client else "unknown"
+
 @app.post("/extract-image")
-async def extract_image(url: str = Form(...)):
+async def extract_image(request: Request, url: str = Form(...), authorization: str = Header(None)):
+    # Open to signed-out visitors, so limit by user when we know them and by address otherwise:
+    # each call is a page fetch plus image probes against someone else's site.
+    if authorization:
+        key = (await get_current_user(authorization))["sub"]
+    else:
+        key = f"ip:{_client_ip(request)}"
+    await extract_limiter.check(key)
     try:
-        images = extract_images_from_url(url)
-        if not images:
+        from .scraper import extract_image_candidates
+        candidates = await extract_image_candidates(url)
+        if not candidates:
             raise HTTPException(status_code=400, detail="Could not extract image from this URL")
-        return {"image_url": images[0]}
+        return {"image_url": candidates[0]["url"], "images": candidates}
     except Exception as e:
         return JSONResponse(status_code=500, content={"detail": str(e)})
 
+@app.post("/extract-images")
+async def extract_images(urls: list[str] = Form(...), authorization: str = Header(None)):
+    """Main product image for each of several product pages, fetched concurrently, in input order."""
+    user = await get_current_user(authorization)
+    if len(urls) > BATCH_MAX_GARMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_GARMENTS} URLs per request")
+    # Every URL is a fetch from a third-party site; don't let one caller fan out without limit.
+    await extract_limiter.check(user["sub"], len(urls))
+    from .scraper import extract_images_from_urls
+    results = await extract_images_from_urls(urls)
+    return {"results": [{"url": url, "image_url": images[0] if images else None} for url, images in zip(urls, results)]}
+
+# Serve locally stored images in development (STORAGE_BACKEND=local).
+if isinstance(storage, LocalStorage):
+    app.mount("/media", StaticFiles(directory=storage.root), name="media")
+
 # app.mount("/", StaticFiles(directory="static", html=True), name="static")
 
 if __name__ == "__main__":
@@ -0,0 +1,252 @@
+"""
+Submit/poll job queue for try-on generations.
+
+`POST /generate` submits a job and returns its id right away; a small pool of worker tasks
+drains the queue and runs the handler (which calls `generate_tryon_image`); clients poll
+`GET /jobs/{id}` or follow `GET /jobs/{id}/events` (SSE) until the job is terminal.
+
+The queue backend is pluggable. The default keeps everything in-process, which is right for a
+long-lived uvicorn worker; for multi-process deployments point `TRYON_QUEUE_BACKEND` at a
+`module:Class` implementing `QueueBackend` on shared storage.
+
+Serverless functions can't run workers: an instance may be frozen as soon as it has answered,
+and the next poll may land on another instance. With TRYON_JOBS_INLINE (on by default when
+VERCEL is set) `POST /generate` runs the job inside the request with `JobQueue.run` and answers
+with the finished result instead of a job id; nothing is queued or kept. An inline job gets
+TRYON_JOBS_INLINE_MAX_SECONDS (keep it under the platform's function timeout, `maxDuration` in
+vercel.json): past that it's cancelled and fails with 504, so its credits are refunded before
+the platform kills the function.
+"""
+import asyncio
+import importlib
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from fastapi import HTTPException
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+# How many jobs one process runs at once. Size this against Fal rate limits and worker memory.
+_WORKER_CONCURRENCY = int(os.getenv("TRYON_WORKER_CONCURRENCY", "8"))
+# Finished jobs are kept this long so late pollers still see the result.
+_JOB_TTL_SECONDS = float(os.getenv("TRYON_JOB_TTL_SECONDS", "3600"))
+# Run jobs within the submitting request (serverless); see the module docstring.
+_INLINE = os.getenv("TRYON_JOBS_INLINE", "true" if os.environ.get("VERCEL") else "false").lower() in ("1", "true", "yes")
+INLINE_MAX_SECONDS = float(os.getenv("TRYON_JOBS_INLINE_MAX_SECONDS", "270"))
+
+
+@dataclass
+class Job:
+    id: str
+    user_id: str
+    payload: dict
+    status: str = JOB_QUEUED
+    stage: str = JOB_QUEUED
+    result: dict | None = None
+    error: dict | None = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def to_public(self) -> dict:
+        # Never expose the payload: it holds server-side file paths.
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if self.result is not None:
+            data.update(self.result)
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class QueueBackend:
+    """
+    Storage for queued job ids and job state. Implementations must be safe to share between
+    all worker tasks of one process; shared backends (Redis, Postgres) also make `get` and
+    `load` work across processes.
+    """
+
+    async def put(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def get(self) -> Job:
+        """Block until a queued job is available and return it."""
+        raise NotImplementedError
+
+    async def save(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def load(self, job_id: str) -> Job | None:
+        raise NotImplementedError
+
+
+class InProcessQueueBackend(QueueBackend):
+    def __init__(self, ttl_seconds: float = _JOB_TTL_SECONDS):
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._jobs: dict[str, Job] = {}
+        self._ttl_seconds = ttl_seconds
+
+    async def put(self, job: Job) -> None:
+        self._prune()
+        self._jobs[job.id] = job
+        await self._queue.put(job.id)
+
+    async def get(self) -> Job:
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+
+    async def save(self, job: Job) -> None:
+        self._jobs[job.id] = job
+
+    async def load(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self._ttl_seconds
+        expired = [jid for jid, job in self._jobs.items() if job.done and job.updated_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+
+
+def _load_backend() -> QueueBackend:
+    spec = os.getenv("TRYON_QUEUE_BACKEND", "")
+    if not spec or spec == "memory":
+        return InProcessQueueBackend()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class JobQueue:
+    """
+    Runs `handler(job, report_stage)` for each submitted job on up to `concurrency` worker tasks.
+
+    The handler returns the result dict merged into the public job view; raising
+    `HTTPException` fails the job with that status code and detail. `report_stage(stage, partial)`
+    may publish a partial result while the job is still running (e.g. finished batch items).
+    """
+
+    def __init__(self, handler, backend: QueueBackend | None = None, concurrency: int = _WORKER_CONCURRENCY, inline: bool = _INLINE):
+        self._handler = handler
+        self._backend = backend
+        self._concurrency = max(1, concurrency)
+        self.inline = inline
+        self._workers: list[asyncio.Task] = []
+        self._changed: dict[str, asyncio.Event] = {}
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    @property
+    def backend(self) -> QueueBackend:
+        if self._backend is None:
+            self._backend = _load_backend()
+        return self._backend
+
+    def start(self) -> None:
+        # Workers are started lazily on first submit so the queue binds to the serving loop.
+        self._workers = [t for t in self._workers if not t.done()]
+        while len(self._workers) < self._concurrency:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, user_id: str, payload: dict) -> Job:
+        self.start()
+        job = Job(id=str(uuid.uuid4()), user_id=user_id, payload=payload)
+        await self.backend.put(job)
+        return job
+
+    async def run(self, user_id: str, payload: dict, timeout: float = INLINE_MAX_SECONDS) -> Job:
+        """
+        Run a job to completion in the caller's task instead of queueing it; returns it finished.
+        After `timeout` seconds the handler is cancelled (its cleanup still runs) and the job fails.
+        """
+        job = Job(id=str(uuid.uuid4()), user_id=user_id, payload=payload)
+        try:
+            await asyncio.wait_for(self._run(job), timeout)
+        except asyncio.TimeoutError:
+            print(f"Job {job.id} ran out of time after {timeout:g}s")
+            await self._update(job, status=JOB_FAILED, stage=JOB_FAILED,
+                               error={"status_code": 504, "detail": "Generation took too long. Please try again."})
+        return job
+
+    async def get(self, job_id: str) -> Job | None:
+        return await self.backend.load(job_id)
+
+    async def watch(self, job_id: str, poll_interval: float = 1.0):
+        """
+        Yield job snapshots whenever the job changes, ending after the terminal state.
+        Changes made in this process wake watchers immediately; otherwise we re-poll the backend.
+        """
+        last_seen = None
+        while True:
+            # Register before loading so an update between the two isn't missed.
+            event = self._changed.setdefault(job_id, asyncio.Event())
+            job = await self.backend.load(job_id)
+            if job is None:
+                return
+            if job.updated_at != last_seen:
+                last_seen = job.updated_at
+                yield job
+            if job.done:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _update(self, job: Job, **fields) -> None:
+        for key, value in fields.items():
+            setattr(job, key, value)
+        job.updated_at = time.time()
+        if self.inline:
+            # Nobody polls an inline job; don't keep it around.
+            return
+        await self.backend.save(job)
+        event = self._changed.pop(job.id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.backend.get()
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        async def report_stage(stage: str, partial: dict | None = None) -> None:
+            if partial is None:
+                await self._update(job, stage=stage)
+            else:
+                await self._update(job, stage=stage, result={**(job.result or {}), **partial})
+
+        await self._update(job, status=JOB_RUNNING, stage="starting")
+        try:
+            result = await self._handler(job, report_stage)
+            await self._update(job, status=JOB_SUCCEEDED, stage=JOB_SUCCEEDED, result=result or {})
+        except HTTPException as e:
+            await self._update(job, status=JOB_FAILED, stage=JOB_FAILED, error={"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            await self._update(job, status=JOB_FAILED, stage=JOB_FAILED, error={"status_code": 500, "detail": str(e)})
@@ -0,0 +1,232 @@
+"""
+Per-stage timings, payload sizes and counters, exported in the Prometheus text format.
+
+Code wraps each stage of a request in `span("stage")`:
+
+    with metrics.span("fal"):
+        result = await fal_client.run(...)
+
+That records the duration in the `tryon_stage_seconds{stage=...}` histogram, adds it to the
+current request's timing breakdown (logged as one JSON line when a job finishes), and, with
+TRYON_OTEL=true and the OpenTelemetry API installed, opens a trace span tagged with the
+request id. Request ids come from the `X-Request-ID` header (or are minted per request) and
+follow the work into queued jobs, so logs, traces and job payloads can be joined up.
+
+Stdlib only; it is imported on the cold-start path.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+_OTEL = os.getenv("TRYON_OTEL", "false").lower() in ("1", "true", "yes")
+
+_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+# Anything else in X-Request-ID is replaced: the id ends up in file names and log lines.
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_request_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+_timings: contextvars.ContextVar[dict | None] = contextvars.ContextVar("stage_timings", default=None)
+
+_lock = threading.Lock()
+# name -> (type, help); series are keyed by (name, sorted label pairs).
+_families: dict[str, tuple[str, str]] = {}
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}
+_tracer = None
+
+
+def new_request_id(incoming: str | None = None) -> str:
+    if incoming and _REQUEST_ID_RE.match(incoming):
+        return incoming
+    return str(uuid.uuid4())
+
+
+def current_request_id() -> str | None:
+    return _request_id.get()
+
+
+def bind_request(request_id: str | None) -> dict:
+    """
+    Make `request_id` current for this task (and tasks it starts) with a fresh timing
+    breakdown, which is returned.
+    """
+    timings = {}
+    _request_id.set(request_id)
+    _timings.set(timings)
+    return timings
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _family(name: str, kind: str, help_text: str) -> None:
+    if name not in _families:
+        _families[name] = (kind, help_text)
+
+
+def increment(name: str, help_text: str, amount: float = 1, **labels) -> None:
+    with _lock:
+        _family(name, "counter", help_text)
+        key = (name, _labels(labels))
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, help_text: str, value: float, buckets=_SECONDS_BUCKETS, **labels) -> None:
+    with _lock:
+        _family(name, "histogram", help_text)
+        key = (name, _labels(labels))
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[1][i] += 1
+        series[2] += value
+        series[3] += 1
+
+
+def record_stage(stage: str, seconds: float, outcome: str = "ok") -> None:
+    """Account for a stage timed elsewhere (e.g. inside a worker thread)."""
+    observe("tryon_stage_seconds", "Time spent per request stage.", seconds, stage=stage, outcome=outcome)
+    timings = _timings.get()
+    if timings is not None:
+        # Stages can repeat (batch items, retries); report the total.
+        timings[stage] = round(timings.get(stage, 0.0) + seconds, 4)
+
+
+def record_bytes(kind: str, size: int) -> None:
+    observe("tryon_payload_bytes", "Payload sizes by kind.", size, buckets=_BYTES_BUCKETS, kind=kind)
+
+
+def _get_tracer():
+    global _tracer
+    if _tracer is None:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            print("TRYON_OTEL is set but opentelemetry-api is not installed; tracing disabled")
+            _tracer = False
+        else:
+            _tracer = trace.get_tracer("tryon")
+    return _tracer
+
+
+@contextlib.contextmanager
+def span(stage: str, **attributes):
+    """Time the enclosed block as `stage` (see the module docstring)."""
+    tracer = _get_tracer() if _OTEL else None
+    outcome = "ok"
+    start = time.perf_counter()
+    try:
+        with contextlib.ExitStack() as stack:
+            if tracer:
+                stack.enter_context(tracer.start_as_current_span(
+                    f"tryon.{stage}", attributes={"request_id": _request_id.get() or "", **attributes}
+                ))
+            yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start, outcome)
+
+
+def log_timings(event: str, **fields) -> None:
+    """One structured log line with the current request id and stage breakdown."""
+    print(json.dumps({"event": event, "request_id": _request_id.get(), **fields, "stages": _timings.get() or {}}))
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware: binds the request id (echoed back as X-Request-ID) and records
+    `http_request_duration_seconds` per route template and status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        request_id = new_request_id(incoming)
+        bind_request(request_id)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # The route template, not the raw path, so job ids don't become label values.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            observe(
+                "http_request_duration_seconds", "HTTP request latency by route.",
+                time.perf_counter() - start, method=scope["method"], route=route, status=status,
+            )
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render(extra_families=()) -> str:
+    """
+    Everything recorded here plus `extra_families`, an iterable of
+    (name, type, help, [(labels dict, value), ...]) for state snapshotted from elsewhere.
+    """
+    lines = []
+    with _lock:
+        for name, (kind, help_text) in sorted(_families.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (series_name, labels), value in sorted(_counters.items()):
+                    if series_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            for (series_name, labels), (buckets, counts, total, count) in sorted(_histograms.items(), key=lambda i: i[0]):
+                if series_name != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    for name, kind, help_text, samples in extra_families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is not None:
+                lines.append(f"{name}{_format_labels(_labels(labels))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,74 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+"""
+Product image extraction for retailer pages.
+
+One streaming parse pass over the page: the HTML is fed to the parser chunk by chunk as it
+downloads, and every tag is scored as it goes by. Signals, strongest first:
+
+    100  JSON-LD Product/ProductGroup `image`, Amazon's main image (largest dynamic size)
+     90  Next `itemimages` sources
+     80  og:image
+     70  twitter:image
+     40  <img> whose src/id/class mentions product/main (first 3)
+     10  any other <img> (first 6)
+
+As soon as a 100 is seen the download and the parse stop, which on marketplace pages skips
+most of the document. Weaker tiers are only returned when nothing stronger was found.
+
+The parser is lxml's (libxml2, SAX-style target) when lxml is installed, otherwise the
+standard library's HTMLParser; both drive the same collector.
+
+The page order is then checked against the images themselves: the top
+SCRAPE_PROBE_MAX_CANDIDATES candidates are fetched in parallel with a ranged GET of their
+first 64 KB, which is enough to read format and dimensions from the header. Broken URLs and
+non-images are dropped (after retrying the URL as the page gave it, if cleaning changed it),
+and the rest are ordered by resolution (up to what the model can use) and how well the aspect
+ratio suits a garment photo, page order breaking ties. If no probe succeeds the page's own
+order is kept and only cached for SCRAPE_NEGATIVE_TTL.
+
+Results are cached per canonical product URL (SCRAPE_CACHE_*, see api/cache.py), failures
+for SCRAPE_NEGATIVE_TTL seconds, and concurrent lookups of one page share a single fetch.
+"""
+import asyncio
+import codecs
+import json
+import os
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
 import re
 
+from . import http_client, metrics
+from .cache import create_cache
+from .image_header import read_image_header
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+_HIGH_CONFIDENCE = 100
+_CHUNK_BYTES = 64 * 1024
+_MAX_PAGE_BYTES = int(os.getenv("SCRAPER_MAX_PAGE_BYTES", str(5 * 1024 * 1024)))
+_BATCH_CONCURRENCY = int(os.getenv("SCRAPER_BATCH_CONCURRENCY", "8"))
+_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/91.0.4472.124 Safari/537.36"
+)
+_PRODUCT_TYPES = ("Product", "ProductGroup")
+
+_scrape_cache = create_cache("SCRAPE", 6 * 3600, 5000)
+_NEGATIVE_TTL = float(os.getenv("SCRAPE_NEGATIVE_TTL", "300"))
+_inflight: dict[str, asyncio.Task] = {}
+
+_PROBE = os.getenv("SCRAPE_PROBE", "true").lower() in ("1", "true", "yes")
+_PROBE_MAX_CANDIDATES = int(os.getenv("SCRAPE_PROBE_MAX_CANDIDATES", "8"))
+_PROBE_BYTES = 64 * 1024
+_PROBE_TIMEOUT = 5
+# Beyond this the model gains nothing (images are downscaled to TRYON_MAX_EDGE anyway).
+_ENOUGH_PIXELS = 1536 * 1536
+# Query parameters that never change which product a page shows.
+_TRACKING_PARAMS = ("gclid", "fbclid", "msclkid", "igshid", "mc_cid", "mc_eid", "srsltid", "ref", "ref_", "_pos", "_sid", "_ss", "psc")
+_AMAZON_PRODUCT = re.compile(r"/(?:dp|gp/product)/([A-Z0-9]{10})", re.IGNORECASE)
+
 def is_image_url(url):
     image_extensions = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
     return url.lower().endswith(image_extensions) or 'image' in url.lower()
@@ -52,104 +118,388 @@ def clean_image_url(url):
 
     return url
 
-def extract_images_from_url(url):
+def canonical_product_url(url):
+    """
+    The cache key for a product page: lowercase scheme and host, no fragment, no tracking
+    parameters, remaining parameters sorted, and Amazon URLs reduced to /dp/<ASIN>.
+    """
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    amazon = _AMAZON_PRODUCT.search(parsed.path) if "amazon" in host else None
+    if amazon:
+        return f"https://{host}/dp/{amazon.group(1).upper()}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    )
+    path = parsed.path.rstrip("/") or "/"
+    return urlunparse((parsed.scheme.lower(), host, path, "", urlencode(query), ""))
+
+async def extract_image_candidates(url):
+    """
+    All image candidates for a product page, best first, as
+    [{"url", "width", "height", "format"}]; see rank_candidates for how they're ordered.
+    Cached, including empty results, and deduplicated across concurrent callers.
+    """
+    if is_image_url(url):
+        return [{"url": clean_image_url(url), "width": None, "height": None, "format": None}]
+
+    key = canonical_product_url(url)
+    cached = _scrape_cache.get(key)
+    if cached is not None:
+        return cached
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_scrape_and_cache(key, url))
+        _inflight[key] = task
+        task.add_done_callback(lambda _t: _inflight.pop(key, None))
+    # Shield so one cancelled caller doesn't cancel the fetch for everyone else.
+    return await asyncio.shield(task)
+
+async def extract_images_from_url(url):
     """
     Extracts clothing image(s) from a given URL.
     If it's a direct image URL, returns it in a list.
     If it's a shop URL, attempts to find the main product image.
     """
-    if is_image_url(url):
-        return [clean_image_url(url)]
+    return [candidate["url"] for candidate in await extract_image_candidates(url)]
 
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        images = []
-        
-        # 1. Specialized Amazon Logic (Dynamic Images)
-        if 'amazon' in url.lower():
-            # ... existing amazon logic ...
-            img = soup.find('img', {'id': 'landingImage'}) or soup.find('img', {'id': 'main-image'})
-            if img:
-                dynamic_data = img.get('data-a-dynamic-image')
-                if dynamic_data:
-                    import json
-                    try:
-                        # Format is {"url": [w,h], "url2": [w,h]}
-                        data = json.loads(dynamic_data)
-                        # Sort by width*height descending
-                        sorted_urls = sorted(data.items(), key=lambda x: x[1][0] * x[1][1], reverse=True)
-                        if sorted_urls:
-                            images.append(sorted_urls[0][0])
-                    except:
-                        pass
-                
-                if not images and img.get('data-old-hires'):
-                    images.append(img.get('data-old-hires'))
-                if not images and img.get('src'):
-                    images.append(img.get('src'))
-
-        # 2. Specialized Next.co.il Logic
-        if 'next.co.il' in url.lower() or 'next.co.uk' in url.lower():
-            # Look for picture sources or high-res looking URLs
-            for source in soup.find_all(['source', 'img']):
-                srcset = source.get('srcset')
-                if srcset:
-                    # srcset often looks like "url1 1x, url2 2x" or "url1 480w, url2 640w"
-                    parts = srcset.split(',')
-                    for part in parts:
-                        img_url = part.strip().split(' ')[0]
-                        if 'itemimages' in img_url.lower():
-                            images.append(img_url)
-                
-                src = source.get('src')
-                if src and 'itemimages' in src.lower():
-                    images.append(src)
-
-        # 3. OpenGraph / Twitter Meta Tags (Often high res)
-        for tag in ['og:image', 'twitter:image']:
-            meta = soup.find('meta', property=tag) or soup.find('meta', attrs={'name': tag})
-            if meta and meta.get('content'):
-                images.append(meta.get('content'))
-
-        # 3. Main Product Image Heuristics
-        if not images:
-            # Look for images with 'product' or 'main' in ID/Class/Src
-            potential_imgs = soup.find_all('img', src=True)
-            for img in potential_imgs:
-                src = img.get('src')
-                img_id = str(img.get('id', '')).lower()
-                img_class = str(img.get('class', [])).lower()
-                
-                if 'product' in src.lower() or 'main' in src.lower() or 'product' in img_id or 'product' in img_class:
-                    images.append(urljoin(url, src))
-                    if len(images) > 2: break
-
-        # 4. Fallback to any large images
-        if not images:
-            all_imgs = soup.find_all('img', src=True)
-            for img in all_imgs:
-                src = img.get('src')
-                images.append(urljoin(url, src))
-                if len(images) > 5: break
-
-        # Cleanup, Deduplicate, and Upgrade to High Res
-        unique_images = []
-        for img_url in images:
-            cleaned = clean_image_url(img_url)
-            if cleaned not in unique_images:
-                unique_images.append(cleaned)
-        
-        return unique_images
+async def _scrape_and_cache(key, url):
+    with metrics.span("scrape"):
+        candidates = await _scrape(url)
+    ttl = None if candidates else _NEGATIVE_TTL
+    if _PROBE and candidates:
+        with metrics.span("probe"):
+            ranked = await rank_candidates(candidates)
+        if not ranked:
+            # Every probe failed (a CDN blocking us, a flaky host), which says nothing about the
+            # page. Serve its images as it gave them, and probe again once this expires.
+            ranked = [_as_given(c) for c in candidates]
+            ttl = _NEGATIVE_TTL
+        candidates = ranked
+    candidates = [_public(c) for c in candidates]
+    _scrape_cache.set(key, candidates, ttl_seconds=ttl)
+    return candidates
+
+def _public(candidate):
+    return {k: v for k, v in candidate.items() if k != "page_url"}
 
+def _as_given(candidate):
+    return {**candidate, "url": candidate.get("page_url") or candidate["url"]}
+
+async def _scrape(url):
+    collector = _CandidateCollector(url)
+    parser = _make_parser(collector)
+    try:
+        async with http_client.stream(
+            "retail", "GET", url, headers={"User-Agent": _USER_AGENT}, timeout=10
+        ) as response:
+            response.raise_for_status()
+            decoder = _decoder(response.encoding)
+            received = 0
+            # Parse while downloading; stop reading as soon as the product image is known.
+            # Chunks are parsed inline: a 64 KB chunk is well under a millisecond with lxml.
+            async for chunk in response.aiter_bytes(_CHUNK_BYTES):
+                parser.feed(decoder.decode(chunk))
+                received += len(chunk)
+                if collector.done or received >= _MAX_PAGE_BYTES:
+                    break
+            metrics.record_bytes("scraped_page", received)
     except Exception as e:
         print(f"Error extracting images: {e}")
         return []
+    return collector.candidate_details()
+
+async def _probe_image(url):
+    """(format, width, height) from the first bytes of `url`, or None if it isn't an image."""
+    headers = {"User-Agent": _USER_AGENT, "Range": f"bytes=0-{_PROBE_BYTES - 1}"}
+    async with http_client.stream("retail", "GET", url, headers=headers, timeout=_PROBE_TIMEOUT) as resp:
+        if resp.status_code >= 400:
+            return None
+        head = b""
+        # Servers that ignore Range send the whole image; stop reading once the header is in.
+        async for chunk in resp.aiter_bytes():
+            head += chunk
+            info = read_image_header(head)
+            if (info and info[1]) or len(head) >= _PROBE_BYTES:
+                return info
+        return read_image_header(head)
+
+def _suitability(width, height):
+    pixels = min(width * height, _ENOUGH_PIXELS)
+    aspect = width / height if height else 0
+    # Garment shots are portrait or square; wide banners and strips are rarely the product.
+    if 0.5 <= aspect <= 1.1:
+        fit = 1.0
+    elif 0.33 <= aspect <= 1.6:
+        fit = 0.6
+    else:
+        fit = 0.2
+    return pixels * fit
+
+async def rank_candidates(candidates):
+    """
+    Probe the leading candidates in parallel and reorder them by what they really are: sized
+    images first (by suitability), then images whose header we couldn't size, then ones we
+    couldn't reach. A candidate that answers 4xx/5xx or isn't an image is retried at the URL
+    the page gave (if clean_image_url changed it) and dropped only if that fails too.
+
+    Returns [] when none of the probed candidates could be reached: the leading ones are the
+    page's main image (og:image, JSON-LD), and dropping them for the unprobed tail would be
+    worse than the caller's fallback to what the page gave.
+    """
+    probed, rest = list(candidates[:_PROBE_MAX_CANDIDATES]), candidates[_PROBE_MAX_CANDIDATES:]
+    results = await asyncio.gather(*(_probe_image(c["url"]) for c in probed), return_exceptions=True)
+
+    # The "upgraded" URL may not exist (or may need the size parameters we stripped).
+    retry = [i for i, (c, r) in enumerate(zip(probed, results)) if r is None and c.get("page_url")]
+    retried = await asyncio.gather(*(_probe_image(probed[i]["page_url"]) for i in retry), return_exceptions=True)
+    for i, result in zip(retry, retried):
+        if result is not None:
+            probed[i], results[i] = _as_given(probed[i]), result
+
+    ranked = []
+    for index, (candidate, result) in enumerate(zip(probed, results)):
+        if result is None:
+            continue
+        candidate = dict(candidate)
+        if isinstance(result, Exception):
+            tier, score = 2, 0
+        else:
+            fmt, width, height = result
+            candidate.update(format=fmt, width=width or candidate["width"], height=height or candidate["height"])
+            sized = candidate["width"] and candidate["height"]
+            tier, score = (0, _suitability(candidate["width"], candidate["height"])) if sized else (1, 0)
+        ranked.append((tier, -score, index, candidate))
+    if not ranked:
+        return []
+    ranked.sort(key=lambda item: item[:3])
+    return [item[3] for item in ranked] + rest
+
+async def extract_images_from_urls(urls, concurrency=_BATCH_CONCURRENCY):
+    """
+    Extract from many product URLs concurrently. Returns one list of image urls per input URL,
+    in input order (repeated URLs share one fetch); the retail HTTP pool still caps concurrent
+    requests per retailer host.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(url):
+        async with semaphore:
+            return await extract_images_from_url(url)
+
+    return await asyncio.gather(*(one(url) for url in urls))
+
+def extract_images_from_html(url, html):
+    """Extract from an already-downloaded page, with the same early exit as the streaming path."""
+    collector = _CandidateCollector(url)
+    parser = _make_parser(collector)
+    for i in range(0, len(html), _CHUNK_BYTES):
+        parser.feed(html[i:i + _CHUNK_BYTES])
+        if collector.done:
+            break
+    return collector.result()
+
+def _decoder(encoding):
+    try:
+        return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+def _make_parser(collector):
+    if etree is not None:
+        return etree.HTMLParser(target=collector, recover=True, no_network=True)
+    return _StdlibParser(collector)
+
+class _StdlibParser(HTMLParser):
+    """Adapts the standard library's event parser to the lxml target interface."""
+
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+def _srcset_urls(srcset):
+    # "url1 480w, url2 640w" / "url1 1x, url2 2x"
+    return [part.strip().split(" ")[0] for part in srcset.split(",") if part.strip()]
+
+def _jsonld_product_images(node):
+    """Yield image URLs of every Product found anywhere in a JSON-LD document."""
+    if isinstance(node, list):
+        for item in node:
+            yield from _jsonld_product_images(item)
+        return
+    if not isinstance(node, dict):
+        return
+    types = node.get("@type")
+    types = types if isinstance(types, list) else [types]
+    if any(t in _PRODUCT_TYPES for t in types):
+        yield from _jsonld_image_urls(node.get("image"))
+    for key, value in node.items():
+        if key != "image" and isinstance(value, (dict, list)):
+            yield from _jsonld_product_images(value)
+
+def _jsonld_image_urls(image):
+    """Yield (url, width, height) from a JSON-LD `image`: a URL, an ImageObject or a list of them."""
+    if isinstance(image, str):
+        yield image, None, None
+    elif isinstance(image, dict):
+        url = image.get("contentUrl") or image.get("url")
+        if isinstance(url, str):
+            yield url, _dimension(image.get("width")), _dimension(image.get("height"))
+    elif isinstance(image, list):
+        for item in image:
+            yield from _jsonld_image_urls(item)
+
+def _dimension(value):
+    # "800", 800, "800px" or a QuantitativeValue {"value": 800}
+    if isinstance(value, dict):
+        value = value.get("value")
+    match = re.match(r"\s*(\d+)", str(value)) if value is not None else None
+    return int(match.group(1)) if match else None
+
+class _CandidateCollector:
+    """Parser target that scores image candidates as tags stream past (see module docstring)."""
+
+    def __init__(self, page_url):
+        self.page_url = page_url
+        lowered = page_url.lower()
+        self.is_amazon = "amazon" in lowered
+        self.is_next = "next.co.il" in lowered or "next.co.uk" in lowered
+        # url -> (score, first-seen order); a dict keeps dedup O(1) per candidate.
+        self.candidates = {}
+        self.done = False
+        self._jsonld = None
+        self._heuristic_imgs = 0
+        self._fallback_imgs = 0
+        # url -> [width, height], only where the page states them for that exact URL.
+        self.sizes = {}
+        # cleaned url -> the URL as the page gave it, where clean_image_url changed it.
+        self.page_urls = {}
+        self._last_og_image = None
+
+    def add(self, url, score, width=None, height=None):
+        if not url or url.startswith("data:"):
+            return None
+        absolute = urljoin(self.page_url, url.strip())
+        url = clean_image_url(absolute)
+        # Stated sizes describe the URL as given; after clean_image_url upgrades it they don't.
+        if url == absolute and (width or height):
+            self.sizes[url] = [width, height]
+        elif url != absolute:
+            self.page_urls.setdefault(url, absolute)
+        seen = self.candidates.get(url)
+        if seen is None:
+            self.candidates[url] = (score, len(self.candidates))
+        elif score > seen[0]:
+            self.candidates[url] = (score, seen[1])
+        if score >= _HIGH_CONFIDENCE:
+            self.done = True
+        return url
+
+    def start(self, tag, attrib):
+        if self.done:
+            return
+        tag = tag.lower()
+        if tag == "meta":
+            prop = (attrib.get("property") or attrib.get("name") or "").lower()
+            if prop in ("og:image", "og:image:secure_url"):
+                self._last_og_image = self.add(attrib.get("content"), 80)
+            elif prop in ("og:image:width", "og:image:height") and self._last_og_image:
+                size = self.sizes.setdefault(self._last_og_image, [None, None])
+                size[prop.endswith("height")] = _dimension(attrib.get("content"))
+            elif prop in ("twitter:image", "twitter:image:src"):
+                self.add(attrib.get("content"), 70)
+        elif tag == "script":
+            if (attrib.get("type") or "").lower() == "application/ld+json":
+                self._jsonld = []
+        elif tag in ("img", "source"):
+            self._image_tag(tag, attrib)
+
+    def data(self, data):
+        if self._jsonld is not None:
+            self._jsonld.append(data)
+
+    def end(self, tag):
+        if self._jsonld is not None and tag.lower() == "script":
+            text, self._jsonld = "".join(self._jsonld), None
+            try:
+                document = json.loads(text)
+            except ValueError:
+                return
+            for image, width, height in _jsonld_product_images(document):
+                self.add(image, _HIGH_CONFIDENCE, width, height)
+
+    def close(self):
+        return self.result()
+
+    def _image_tag(self, tag, attrib):
+        src = attrib.get("src") or ""
+
+        if self.is_amazon and tag == "img" and attrib.get("id") in ("landingImage", "main-image"):
+            # {"url": [w, h], ...}: take the largest rendition.
+            try:
+                sizes = json.loads(attrib.get("data-a-dynamic-image") or "{}")
+                best, (width, height) = max(sizes.items(), key=lambda item: item[1][0] * item[1][1])
+            except (ValueError, TypeError, IndexError):
+                best = width = height = None
+            if best:
+                self.add(best, _HIGH_CONFIDENCE, width, height)
+            else:
+                self.add(attrib.get("data-old-hires") or src, _HIGH_CONFIDENCE)
+            return
+
+        if self.is_next:
+            for candidate in _srcset_urls(attrib.get("srcset") or "") + [src]:
+                if "itemimages" in candidate.lower():
+                    self.add(candidate, 90)
+
+        if tag != "img" or not src:
+            return
+        img_id = (attrib.get("id") or "").lower()
+        img_class = (attrib.get("class") or "").lower()
+        if "product" in src.lower() or "main" in src.lower() or "product" in img_id or "product" in img_class:
+            if self._heuristic_imgs < 3:
+                self._heuristic_imgs += 1
+                self.add(src, 40)
+        elif self._fallback_imgs < 6:
+            self._fallback_imgs += 1
+            self.add(src, 10)
+
+    def candidate_details(self):
+        """
+        Ranked candidates as [{"url", "width", "height", "format"}], plus "page_url" (the URL
+        before clean_image_url upgraded it) where that differs; see rank_candidates.
+        """
+        if not self.candidates:
+            return []
+        # Weaker tiers are noise once a page has told us its product image.
+        best = max(score for score, _ in self.candidates.values())
+        floor = 70 if best >= 70 else best
+        ranked = sorted(
+            (item for item in self.candidates.items() if item[1][0] >= floor),
+            key=lambda item: (-item[1][0], item[1][1]),
+        )
+        details = []
+        for url, _ in ranked:
+            width, height = self.sizes.get(url, (None, None))
+            detail = {"url": url, "width": width, "height": height, "format": None}
+            if url in self.page_urls:
+                detail["page_url"] = self.page_urls[url]
+            details.append(detail)
+        return details
+
+    def result(self):
+        return [candidate["url"] for candidate in self.candidate_details()]
 
 if __name__ == "__main__":
     # Test
@@ -159,5 +509,5 @@ if __name__ == "__main__":
     ]
     for test_url in urls:
         print(f"\nTesting: {test_url}")
-        print(extract_images_from_url(test_url))
+        print(asyncio.run(extract_images_from_url(test_url)))
 
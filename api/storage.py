@@ -0,0 +1,250 @@
+"""
+Durable storage for base, garment and result images.
+
+Fal result URLs are ephemeral and uploads never left the worker's disk, so the gallery could
+not rely on either. Images are persisted to one of:
+
+    STORAGE_BACKEND=supabase   Supabase Storage bucket STORAGE_BUCKET (default "tryon")
+    STORAGE_BACKEND=s3         any S3-compatible bucket (needs boto3; STORAGE_S3_* settings)
+    STORAGE_BACKEND=local      files under STORAGE_LOCAL_DIR, served at STORAGE_PUBLIC_BASE_URL
+
+The default is supabase when it's configured, otherwise local. Keys are content-addressed where
+that's safe to share: garments live under `garments/<sha256>` and are stored once no matter how
+many users try them on; base photos and results stay under the user's prefix.
+
+The bucket is private (people's photos live in it): stored URLs are kept in the database as
+identifiers, and `viewable_urls` turns them into signed URLs valid for STORAGE_SIGNED_URL_TTL
+seconds when they're handed to a browser. The local backend serves everything under /media
+unsigned; it's for development only.
+
+Pillow, httpx and boto3 are imported on first use: this module is loaded on every cold start.
+"""
+import asyncio
+import hashlib
+import io
+import os
+
+THUMBNAIL_EDGE = int(os.getenv("STORAGE_THUMBNAIL_EDGE", "400"))
+SIGNED_URL_TTL = int(os.getenv("STORAGE_SIGNED_URL_TTL", "3600"))
+# Results come from Fal; anything much bigger than an upload isn't an image we asked for.
+_MAX_COPY_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024))) * 2
+
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"GIF87a", "gif", "image/gif"),
+    (b"GIF89a", "gif", "image/gif"),
+)
+
+
+def sniff_image_type(data: bytes) -> tuple[str, str]:
+    """Return (extension, content type) from the leading magic bytes."""
+    for magic, ext, mime in _IMAGE_SIGNATURES:
+        if data.startswith(magic):
+            return ext, mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    return "bin", "application/octet-stream"
+
+
+class Storage:
+    async def put(self, key: str, data: bytes, content_type: str) -> str:
+        """Store `data` under `key` (overwriting) and return its URL."""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        """The stored object's URL: an identifier, not loadable by a browser (see `viewable_urls`)."""
+        raise NotImplementedError
+
+    async def signed_urls(self, keys: list[str], expires_in: int) -> list[str]:
+        """URLs a browser can load `keys` from for the next `expires_in` seconds."""
+        raise NotImplementedError
+
+    def key_of(self, url: str | None) -> str | None:
+        """The key behind one of our own URLs, or None for anything else (e.g. a Fal URL)."""
+        prefix = self.url("")
+        if url and url.startswith(prefix) and len(url) > len(prefix):
+            return url[len(prefix):]
+        return None
+
+    async def viewable_urls(self, urls: list[str | None], expires_in: int = SIGNED_URL_TTL) -> list[str | None]:
+        """`urls` with our own (private) ones replaced by signed URLs; others pass through unchanged."""
+        keys = [self.key_of(url) for url in urls]
+        wanted = [key for key in keys if key]
+        if not wanted:
+            return list(urls)
+        signed = iter(await self.signed_urls(wanted, expires_in))
+        return [next(signed) if key else url for url, key in zip(urls, keys)]
+
+    async def put_content_addressed(self, prefix: str, data: bytes) -> str:
+        """Store `data` under `<prefix>/<sha256>.<ext>`, skipping the upload if it's already there."""
+        ext, content_type = sniff_image_type(data)
+        key = f"{prefix}/{hashlib.sha256(data).hexdigest()}.{ext}"
+        if await self.exists(key):
+            return self.url(key)
+        return await self.put(key, data, content_type)
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid storage key: {key!r}")
+        return path
+
+    async def put(self, key, data, content_type):
+        path = self._path(key)
+
+        def write():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        await asyncio.to_thread(write)
+        return self.url(key)
+
+    async def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def url(self, key):
+        return f"{self.base_url}/{key}"
+
+    async def signed_urls(self, keys, expires_in):
+        return [self.url(key) for key in keys]
+
+
+class SupabaseStorage(Storage):
+    def __init__(self, supabase_url: str, service_key: str, bucket: str):
+        self.api = f"{supabase_url.rstrip('/')}/storage/v1"
+        self.bucket = bucket
+        self.headers = {"Authorization": f"Bearer {service_key}", "apikey": service_key}
+
+    async def put(self, key, data, content_type):
+        from . import http_client
+        resp = await http_client.request(
+            "storage",
+            "POST",
+            f"{self.api}/object/{self.bucket}/{key}",
+            headers={**self.headers, "Content-Type": content_type, "x-upsert": "true"},
+            content=data,
+        )
+        resp.raise_for_status()
+        return self.url(key)
+
+    async def exists(self, key):
+        from . import http_client
+        resp = await http_client.request("storage", "HEAD", f"{self.api}/object/{self.bucket}/{key}", headers=self.headers)
+        return resp.status_code == 200
+
+    def url(self, key):
+        return f"{self.api}/object/public/{self.bucket}/{key}"
+
+    async def signed_urls(self, keys, expires_in):
+        from . import http_client
+        # One round trip for the whole list (a gallery page is dozens of images).
+        resp = await http_client.request(
+            "storage",
+            "POST",
+            f"{self.api}/object/sign/{self.bucket}",
+            headers=self.headers,
+            json={"expiresIn": expires_in, "paths": keys},
+        )
+        resp.raise_for_status()
+        signed = {item["path"]: item.get("signedURL") for item in resp.json()}
+        # signedURL is relative to the storage API; a missing object gets none.
+        return [f"{self.api}{signed[key]}" if signed.get(key) else None for key in keys]
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, public_base_url: str | None = None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.public_base_url = (public_base_url or f"s3://{bucket}").rstrip("/")
+        # Standard AWS_* credentials; STORAGE_S3_ENDPOINT_URL points at R2/MinIO/Supabase S3.
+        self._s3 = boto3.client("s3", endpoint_url=os.getenv("STORAGE_S3_ENDPOINT_URL") or None)
+
+    async def put(self, key, data, content_type):
+        await asyncio.to_thread(self._s3.put_object, Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+        return self.url(key)
+
+    async def exists(self, key):
+        try:
+            await asyncio.to_thread(self._s3.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except Exception:
+            return False
+
+    def url(self, key):
+        return f"{self.public_base_url}/{key}"
+
+    async def signed_urls(self, keys, expires_in):
+        # Presigning is local computation; no request to the bucket.
+        return [
+            self._s3.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=expires_in)
+            for key in keys
+        ]
+
+
+def _create_storage() -> Storage:
+    supabase_url = os.getenv("SUPABASE_URL")
+    service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    backend = os.getenv("STORAGE_BACKEND") or ("supabase" if supabase_url and service_key else "local")
+    if backend == "supabase":
+        return SupabaseStorage(supabase_url, service_key, os.getenv("STORAGE_BUCKET", "tryon"))
+    if backend == "s3":
+        return S3Storage(os.environ["STORAGE_S3_BUCKET"], os.getenv("STORAGE_PUBLIC_BASE_URL"))
+    return LocalStorage(os.getenv("STORAGE_LOCAL_DIR", "media"), os.getenv("STORAGE_PUBLIC_BASE_URL", "/media"))
+
+
+storage = _create_storage()
+
+
+def make_thumbnail(data: bytes) -> bytes:
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as im:
+        im.draft("RGB", (THUMBNAIL_EDGE, THUMBNAIL_EDGE))
+        im = im.convert("RGB")
+        im.thumbnail((THUMBNAIL_EDGE, THUMBNAIL_EDGE), Image.LANCZOS)
+        out = io.BytesIO()
+        im.save(out, format="JPEG", quality=80, optimize=True)
+    return out.getvalue()
+
+
+async def copy_from_url(url: str, key_prefix: str) -> tuple[str, str]:
+    """
+    Copy a remote image (e.g. an ephemeral Fal result) into storage and thumbnail it.
+    Returns (image URL, thumbnail URL).
+
+    The download goes through the shared "retail" pool (per-host limit, pool stats) and is held
+    in memory whole, since the thumbnail needs the full image; it's refused past _MAX_COPY_BYTES.
+    """
+    from . import http_client
+    buffer = bytearray()
+    async with http_client.stream("retail", "GET", url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes(chunk_size=256 * 1024):
+            buffer += chunk
+            if len(buffer) > _MAX_COPY_BYTES:
+                raise ValueError(f"Image at {url} is larger than {_MAX_COPY_BYTES} bytes")
+    data = bytes(buffer)
+
+    ext, content_type = sniff_image_type(data)
+    thumbnail = await asyncio.to_thread(make_thumbnail, data)
+    image_url, thumbnail_url = await asyncio.gather(
+        storage.put(f"{key_prefix}.{ext}", data, content_type),
+        storage.put(f"{key_prefix}_thumb.jpg", thumbnail, "image/jpeg"),
+    )
+    return image_url, thumbnail_url
@@ -1,19 +1,83 @@
 import os
+import asyncio
 import base64
+import hashlib
+import io
+import json
 import tempfile
-import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
-import requests
 from dotenv import load_dotenv
-from fastapi import HTTPException
 from PIL import Image, ImageOps
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import metrics
+from .cache import create_cache
+from .fal_client import FalClient
+from .garment_cache import GarmentCache
+
 load_dotenv()
 
 _FAL_KEY = os.getenv("FAL_KEY") or os.getenv("FAL_API_KEY")
 _FAL_BASE_URL = os.getenv("FAL_BASE_URL", "https://fal.run")
 
+fal_client = FalClient(_FAL_BASE_URL, _FAL_KEY)
+
+# Pillow decode/encode and base64 are CPU-bound; keep them off the event loop but bounded,
+# so dozens of in-flight generations don't each hold a thread and full-res images at once.
+_IMAGE_WORKERS = int(os.getenv("TRYON_IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+_image_executor = ThreadPoolExecutor(max_workers=_IMAGE_WORKERS, thread_name_prefix="tryon-image")
+
+# Identical (base, garment, category, prompt) requests reuse the earlier result. An entry starts
+# as Fal's URL, which is not permanent (keep the TTL well under its retention), and is switched
+# to our stored copy by `remember_stored_result` once the result has been persisted.
+_result_cache = create_cache("TRYON_RESULT", default_ttl=24 * 3600, default_max_entries=10_000)
+
+# Preprocessing before upload: nano-banana-pro/edit works at ~2K, so larger inputs only cost
+# upload time and memory. TRYON_MAX_EDGE=0 keeps full resolution; TRYON_ENCODE_FORMAT=png is lossless.
+_MAX_EDGE = int(os.getenv("TRYON_MAX_EDGE", "2048"))
+_ENCODE_FORMAT = os.getenv("TRYON_ENCODE_FORMAT", "jpeg").lower()
+_ENCODE_QUALITY = int(os.getenv("TRYON_ENCODE_QUALITY", "92"))
+_PREPROCESS_SIGNATURE = f"{_MAX_EDGE}:{_ENCODE_FORMAT}:{_ENCODE_QUALITY}".encode("utf-8")
+
+# Garment trimming: retailer shots are often a small garment on a big plain canvas, or several
+# views side by side. Crop to the garment (the largest blob that differs from the border colour)
+# and pad back out to a standard aspect with that colour. Needs numpy; TRYON_GARMENT_TRIM=false
+# sends garments as they are.
+_GARMENT_TRIM = np is not None and os.getenv("TRYON_GARMENT_TRIM", "true").lower() in ("1", "true", "yes")
+_GARMENT_ASPECT = tuple(int(x) for x in os.getenv("TRYON_GARMENT_ASPECT", "3:4").split(":"))
+_TRIM_SIGNATURE = f"trim:{_GARMENT_ASPECT[0]}:{_GARMENT_ASPECT[1]}".encode("utf-8")
+# Detection runs on a copy this small; the crop is then applied at full size.
+_TRIM_ANALYSIS_EDGE = 512
+# Max per-channel distance from the border colour that still counts as background.
+_TRIM_TOLERANCE = 24
+
+# Normalized, base64-encoded images keyed by a hash of the raw upload, so a base photo reused
+# across garments (or a popular garment) is only decoded and re-encoded once. Entries are a few
+# MB each; keep the in-memory store small or use the sqlite backend.
+_normalized_cache = create_cache("TRYON_NORMALIZED", default_ttl=6 * 3600, default_max_entries=64)
+
+# On Vercel /tmp is 512 MB in total and also holds spilled uploads, so the cache only gets a slice.
+_GARMENT_CACHE_DEFAULT_BYTES = (64 if os.environ.get("VERCEL") else 512) * 1024 * 1024
+
+_garment_cache = GarmentCache(
+    directory=os.getenv("TRYON_GARMENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tryon_garments")),
+    max_bytes=int(os.getenv("TRYON_GARMENT_CACHE_MAX_BYTES", str(_GARMENT_CACHE_DEFAULT_BYTES))),
+    revalidate_after=float(os.getenv("TRYON_GARMENT_CACHE_REVALIDATE_SECONDS", "300")),
+)
+
+
+async def _run_in_image_executor(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_image_executor, fn, *args)
+
+
 def _is_probably_url(value: str) -> bool:
     try:
         parsed = urlparse(value)
@@ -22,69 +86,186 @@ def _is_probably_url(value: str) -> bool:
         return False
 
 
-def _download_image(url: str, out_path: str) -> str:
-    # Keep it simple but safe: require an image-ish content-type, stream to disk.
-    headers = {"User-Agent": "Mozilla/5.0"}
-    with requests.get(url, headers=headers, stream=True, timeout=30) as r:
-        r.raise_for_status()
-        content_type = (r.headers.get("content-type") or "").lower()
-        if "image" not in content_type and not any(url.lower().endswith(ext) for ext in (".png", ".jpg", ".jpeg", ".webp")):
-            raise ValueError(f"URL did not look like an image (content-type={content_type!r})")
+def _has_transparency(im: Image.Image) -> bool:
+    return im.mode == "RGBA" and im.getchannel("A").getextrema()[0] < 255
 
-        with open(out_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 256):
-                if chunk:
-                    f.write(chunk)
-    return out_path
 
+def _largest_run(profile) -> tuple[int, int] | None:
+    """[start, end) of the run of non-zero entries in `profile` holding the most mass."""
+    active = np.concatenate(([0], (profile > 0).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(active))
+    if not len(edges):
+        return None
+    starts, ends = edges[0::2], edges[1::2]
+    cumulative = np.concatenate(([0], np.cumsum(profile)))
+    best = int(np.argmax(cumulative[ends] - cumulative[starts]))
+    return int(starts[best]), int(ends[best])
 
-def _normalize_for_edit_api(input_path: str, out_path: str) -> str:
+
+def _garment_bbox(im: Image.Image) -> tuple[tuple[int, int, int, int], tuple] | None:
+    """
+    Bounding box of the garment and the background colour, or None when the image has no plain
+    border to trim (a lifestyle shot) or the garment already fills it.
     """
-    Normalize EXIF orientation and ensure a supported format for image editing.
-    We write PNG to preserve detail (and transparency if present).
+    # Box-filter reduction: far cheaper than a resampling thumbnail, and plenty for a mask.
+    small = im.reduce(max(1, -(-max(im.size) // _TRIM_ANALYSIS_EDGE)))
+    pixels = np.asarray(small, dtype=np.int16)
+    h, w = pixels.shape[:2]
+    if h < 8 or w < 8:
+        return None
+
+    if im.mode == "RGBA" and pixels[..., 3].min() < 255:
+        mask = pixels[..., 3] > 16
+        background = (255, 255, 255, 0)
+    else:
+        rgb = pixels[..., :3]
+        border = np.concatenate((rgb[0], rgb[-1], rgb[:, 0], rgb[:, -1]))
+        colour = np.median(border, axis=0)
+        # A busy border means a scene, not a canvas: leave it alone.
+        if (np.abs(border - colour).max(axis=1) <= _TRIM_TOLERANCE).mean() < 0.9:
+            return None
+        mask = np.abs(rgb - colour).max(axis=2) > _TRIM_TOLERANCE
+        background = tuple(int(c) for c in colour) + ((255,) if im.mode == "RGBA" else ())
+
+    # Ignore specks: a column/row needs a few garment pixels to count.
+    columns = mask.sum(axis=0) * (mask.sum(axis=0) > max(1, h // 200))
+    # Side-by-side views are separated by background columns; keep the largest view.
+    x_run = _largest_run(columns)
+    if x_run is None:
+        return None
+    view = mask[:, x_run[0]:x_run[1]]
+    rows = view.sum(axis=1) * (view.sum(axis=1) > max(1, (x_run[1] - x_run[0]) // 200))
+    y_run = _largest_run(rows)
+    if y_run is None:
+        return None
+
+    scale_x, scale_y = im.width / w, im.height / h
+    box_w, box_h = x_run[1] - x_run[0], y_run[1] - y_run[0]
+    # A little breathing room around the garment.
+    margin = max(box_w, box_h) * 0.03
+    left = max(0, int((x_run[0] - margin) * scale_x))
+    top = max(0, int((y_run[0] - margin) * scale_y))
+    right = min(im.width, int((x_run[1] + margin) * scale_x + 0.5))
+    bottom = min(im.height, int((y_run[1] + margin) * scale_y + 0.5))
+    if (right - left) * (bottom - top) > 0.95 * im.width * im.height:
+        return None
+    return (left, top, right, bottom), background
+
+
+def _trim_garment(im: Image.Image) -> Image.Image:
+    """Crop to the garment and pad to _GARMENT_ASPECT with the background colour."""
+    found = _garment_bbox(im)
+    if found is None:
+        return im
+    box, background = found
+    im = im.crop(box)
+    aspect_w, aspect_h = _GARMENT_ASPECT
+    width = max(im.width, -(-im.height * aspect_w // aspect_h))
+    height = max(im.height, -(-im.width * aspect_h // aspect_w))
+    canvas = Image.new(im.mode, (width, height), background)
+    canvas.paste(im, ((width - im.width) // 2, (height - im.height) // 2))
+    return canvas
+
+
+def _normalize_for_edit_api(raw: bytes, out: io.BytesIO, trim: bool = False) -> str:
     """
-    with Image.open(input_path) as im:
+    Normalize EXIF orientation, cap the long edge to what the edit model uses and encode compactly
+    into `out`: lossy JPEG/WebP for opaque images, optimized PNG when there is real transparency.
+    With `trim`, crop a garment shot to the garment first (see _trim_garment). Returns the mime type.
+    """
+    with Image.open(io.BytesIO(raw)) as im:
+        if _MAX_EDGE:
+            # Let the JPEG decoder downscale by a power of two while decoding; much cheaper than a full decode.
+            im.draft("RGB", (_MAX_EDGE, _MAX_EDGE))
         im = ImageOps.exif_transpose(im)
         # Ensure it's saveable consistently
         if im.mode not in ("RGB", "RGBA"):
             # Keep alpha if present-ish, otherwise RGB.
             im = im.convert("RGBA" if "A" in im.mode else "RGB")
-        im.save(out_path, format="PNG")
-    return out_path
+        if trim:
+            im = _trim_garment(im)
+        if _MAX_EDGE and max(im.size) > _MAX_EDGE:
+            im.thumbnail((_MAX_EDGE, _MAX_EDGE), Image.LANCZOS)
+
+        if _ENCODE_FORMAT == "png" or _has_transparency(im):
+            im.save(out, format="PNG", optimize=True)
+            mime = "image/png"
+        else:
+            im = im.convert("RGB")
+            if _ENCODE_FORMAT == "webp":
+                im.save(out, format="WEBP", quality=_ENCODE_QUALITY, method=4)
+                mime = "image/webp"
+            else:
+                im.save(out, format="JPEG", quality=_ENCODE_QUALITY, optimize=True)
+                mime = "image/jpeg"
+    return mime
+
+
+def _to_data_url(data, mime: str) -> str:
+    b64 = base64.b64encode(data).decode("ascii")
+    return f"data:{mime};base64,{b64}"
+
+
+def _prepare_image(source: bytes | str, trim: bool = False) -> dict:
+    """
+    Return the ready-to-send payload for an image given as bytes or a file path: `data_url`,
+    `sha256` of the encoded image, byte counts before/after preprocessing and the thread CPU time
+    it cost. Repeat uploads of the same raw bytes are served from the normalized-image store and
+    skip decoding, re-encoding and base64 (and garment trimming, which is keyed in too).
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            raw = f.read()
+    else:
+        raw = source
+    # Settings are part of the key so changing them never serves stale encodings.
+    h = hashlib.sha256(raw)
+    h.update(_PREPROCESS_SIGNATURE)
+    if trim:
+        h.update(_TRIM_SIGNATURE)
+    key = h.hexdigest()
+
+    cached = _normalized_cache.get(key)
+    if cached:
+        return {**cached, "cache_hit": True}
+
+    start = time.thread_time()
+    started = time.perf_counter()
+    out = io.BytesIO()
+    mime = _normalize_for_edit_api(raw, out, trim)
+    normalized = time.perf_counter()
+    # Hash and base64 straight from the encode buffer, without copying it out first.
+    with out.getbuffer() as encoded:
+        entry = {
+            "data_url": _to_data_url(encoded, mime),
+            "sha256": hashlib.sha256(encoded).hexdigest(),
+            "raw_bytes": len(raw),
+            "encoded_bytes": encoded.nbytes,
+        }
+    entry["cpu_seconds"] = time.thread_time() - start
+    _normalized_cache.set(key, entry)
+    # Timed here because the executor thread doesn't see the request's metrics context.
+    stage_seconds = {"normalize": normalized - started, "base64": time.perf_counter() - normalized}
+    return {**entry, "cache_hit": False, "stage_seconds": stage_seconds}
 
 
-def _to_data_url_png(path: str) -> str:
-    with open(path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-    return f"data:image/png;base64,{b64}"
+def _result_cache_key(base_sha256: str, garment_sha256: str, garment_category: str, edit_prompt: str) -> str:
+    h = hashlib.sha256()
+    for part in (base_sha256, garment_sha256, garment_category, edit_prompt):
+        h.update(part.encode("utf-8") + b"\0")
+    return h.hexdigest()
 
 
-def _fal_run(model_path: str, model_input: dict) -> dict:
+async def _fal_run(model_path: str, model_input: dict) -> dict:
     """
-    Minimal Fal REST call. Uses FAL_KEY (format typically like: '<id>:<secret>').
+    Fal REST call through the resilient client. Uses FAL_KEY (format typically like: '<id>:<secret>').
     """
-    if not _FAL_KEY:
-        raise RuntimeError("FAL_KEY is not set. Export FAL_KEY='<id>:<secret>' before running the server.")
-
-    url = f"{_FAL_BASE_URL.rstrip('/')}/{model_path.lstrip('/')}"
-    headers = {
-        # Fal docs commonly use "Key <FAL_KEY>"
-        "Authorization": f"Key {_FAL_KEY}",
-        "Content-Type": "application/json",
-    }
-    resp = requests.post(url, headers=headers, json=model_input, timeout=180)
-    if resp.status_code >= 400:
-        # Include response text for debugging (but never include secrets).
-        if resp.status_code == 401:
-            raise HTTPException(
-                status_code=401,
-                detail=(
-                    "Fal authentication failed (401). Your `FAL_KEY` is missing, revoked, or incorrect. "
-                    "Create a new key in the Fal dashboard, set it as `FAL_KEY`, restart the server, and retry."
-                ),
-            )
-        raise RuntimeError(f"Fal request failed ({resp.status_code}): {resp.text}")
-    return resp.json()
+    # The body carries two base64 images; serialize it off the event loop.
+    with metrics.span("serialize"):
+        body = await _run_in_image_executor(lambda: json.dumps(model_input).encode("utf-8"))
+    metrics.record_bytes("fal_request", len(body))
+    with metrics.span("fal", model=model_path):
+        return await fal_client.run(model_path, body)
 
 
 def _extract_first_image_url(result: dict) -> str:
@@ -117,82 +298,133 @@ def _extract_first_image_url(result: dict) -> str:
     raise RuntimeError(f"Could not find an image url in Fal response: keys={list(result.keys())}")
 
 
-def generate_tryon_image(base_path, garment_path_or_url, garment_category="tops", custom_prompt="", advanced_instructions=""):
+async def fetch_garment_image(url: str) -> bytes:
+    """Garment image bytes for `url`, via the shared garment cache."""
+    with metrics.span("download"):
+        data = await _garment_cache.fetch(url)
+    metrics.record_bytes("garment_download", len(data))
+    return data
+
+
+async def prepare_tryon_image(source: bytes | str, garment: bool = False) -> dict:
+    """
+    Normalize and encode an image once so it can be passed to several `generate_tryon_image`
+    calls (e.g. one base photo against many garments). Garments are also trimmed to the garment
+    unless TRYON_GARMENT_TRIM is off.
+    """
+    prepared = await _run_in_image_executor(_prepare_image, source, garment and _GARMENT_TRIM)
+    if not prepared["cache_hit"]:
+        for stage, seconds in prepared.pop("stage_seconds").items():
+            metrics.record_stage(stage, seconds)
+        metrics.record_bytes("encoded_image", prepared["encoded_bytes"])
+    return prepared
+
+
+async def remember_stored_result(cache_key: str, result_url: str, thumbnail_url: str) -> None:
+    """Point a result cache entry at the persisted copy of its result instead of Fal's URL."""
+    await asyncio.to_thread(_result_cache.set, cache_key, {"result_url": result_url, "thumbnail_url": thumbnail_url})
+
+
+def _record_preprocess_stats(stats: dict) -> None:
+    """Export what normalizing and re-encoding did for one generation (see api/metrics.py)."""
+    metrics.increment("tryon_normalize_cpu_seconds_total", "CPU seconds spent normalizing images.",
+                      stats["normalize_cpu_seconds"])
+    metrics.increment("tryon_normalize_cpu_saved_seconds_total",
+                      "CPU seconds of normalizing skipped by reusing an already normalized image.",
+                      stats["normalize_cpu_saved_seconds"])
+    help_text = "Image bytes going into preprocessing (raw) and sent to Fal (encoded)."
+    metrics.increment("tryon_preprocess_bytes_total", help_text, stats["upload_bytes_raw"], stage="raw")
+    metrics.increment("tryon_preprocess_bytes_total", help_text, stats["upload_bytes"], stage="encoded")
+
+
+async def generate_tryon_image(base_image, garment_image, garment_category="tops", custom_prompt="", advanced_instructions="", stats=None):
     """
     Identity-preserving virtual try-on:
     - Use Fal Nano Banana Pro Edit (Imagen 3 Pro).
     - Provide both base + garment images to the edit model (as image_urls list).
+
+    `base_image` is raw image bytes, a file path or the result of `prepare_tryon_image`;
+    `garment_image` may also be an image URL. Everything after that happens in memory.
+
+    If `stats` is a dict it is filled with details about this run (e.g. `cache_hit`,
+    `result_cache_key`, and `thumbnail_url` when a cached result is already in our storage).
     """
+    if stats is None:
+        stats = {}
+    stats["cache_hit"] = False
     
-    if not os.path.exists(base_path):
-        raise FileNotFoundError(f"Base image not found: {base_path}")
-
-    # Resolve garment to a local file path (download if URL).
-    garment_local_path = garment_path_or_url
-    temp_paths: list[str] = []
-    try:
-        if not os.path.exists(garment_local_path):
-            if not _is_probably_url(garment_path_or_url):
-                raise FileNotFoundError(f"Garment image not found and not a URL: {garment_path_or_url}")
-            tmp_download = os.path.join(tempfile.gettempdir(), f"tryon_{uuid.uuid4()}_garment")
-            garment_local_path = _download_image(garment_path_or_url, tmp_download)
-            temp_paths.append(garment_local_path)
-
-        # Normalize both images (EXIF orientation, supported format).
-        base_png = os.path.join(tempfile.gettempdir(), f"tryon_{uuid.uuid4()}_base.png")
-        garment_png = os.path.join(tempfile.gettempdir(), f"tryon_{uuid.uuid4()}_garment.png")
-        temp_paths.extend([base_png, garment_png])
-
-        _normalize_for_edit_api(base_path, base_png)
-        _normalize_for_edit_api(garment_local_path, garment_png)
-
-        # Construct the description for Nano Banana Pro Edit
-        cat_map = {
-            "tops": "upper body garment (top/shirt)",
-            "bottoms": "lower body garment (pants/skirt)",
-            "one-piece": "full body garment (dress/jumpsuit)"
-        }
-        category_text = cat_map.get(garment_category, "garment")
-        
-        prompt_parts = [
-            "You are given 2 images.",
-            "Image 1 is the BASE photo of a person.",
-            "Image 2 is the GARMENT reference photo.",
-            "",
-            f"TASK: Edit Image 1 by replacing ONLY the person's {category_text} with the exact same clothing shown in Image 2.",
-            "PRESERVE EXACTLY: the same person identity (face), hair/head covering, skin tone, pose, body shape, hands, background, camera angle, and lighting.",
-            "MATCH FROM Image 2: fabric texture, color, pattern, and silhouette.",
-            "Make the result photorealistic with natural folds and seams. Keep consistent shadows and perspective.",
-            "Do NOT change the face. Do NOT add text or watermarks.",
-        ]
-
-        if custom_prompt:
-            prompt_parts.append(f"ADDITIONAL REQUIREMENTS: {custom_prompt}")
-        if advanced_instructions:
-            prompt_parts.append(f"STYLE INSTRUCTIONS: {advanced_instructions}")
-
-        edit_prompt = "\n".join(prompt_parts)
-
-        print(f"Editing base image with Fal nano-banana-pro/edit (category: {garment_category})...")
-
-        base_data_url = _to_data_url_png(base_png)
-        garment_data_url = _to_data_url_png(garment_png)
-
-        fal_result = _fal_run(
-            "fal-ai/nano-banana-pro/edit",
-            {
-                "prompt": edit_prompt,
-                "image_urls": [base_data_url, garment_data_url],
-            },
+    if isinstance(base_image, str) and not os.path.exists(base_image):
+        raise FileNotFoundError(f"Base image not found: {base_image}")
+
+    # Resolve a garment URL to bytes (fetched through the shared garment cache).
+    if isinstance(garment_image, str) and not os.path.exists(garment_image):
+        if not _is_probably_url(garment_image):
+            raise FileNotFoundError(f"Garment image not found and not a URL: {garment_image}")
+        garment_image = await fetch_garment_image(garment_image)
+
+    # Normalize both images (EXIF orientation, supported format) and encode them for upload.
+    if isinstance(base_image, dict):
+        # Already prepared by the caller; it paid the CPU once for the whole batch.
+        base_prepared, garment_prepared = {**base_image, "cache_hit": True}, await prepare_tryon_image(garment_image, garment=True)
+    else:
+        base_prepared, garment_prepared = await asyncio.gather(
+            prepare_tryon_image(base_image),
+            prepare_tryon_image(garment_image, garment=True),
         )
-
-        return _extract_first_image_url(fal_result)
-    finally:
-        # Best-effort cleanup of temp files.
-        for p in temp_paths:
-            try:
-                if p and os.path.exists(p):
-                    os.remove(p)
-            except Exception:
-                pass
-
+    prepared = (base_prepared, garment_prepared)
+    stats["normalize_cpu_seconds"] = sum(p["cpu_seconds"] for p in prepared if not p["cache_hit"])
+    stats["normalize_cpu_saved_seconds"] = sum(p["cpu_seconds"] for p in prepared if p["cache_hit"])
+    stats["upload_bytes_raw"] = sum(p["raw_bytes"] for p in prepared)
+    stats["upload_bytes"] = sum(p["encoded_bytes"] for p in prepared)
+    _record_preprocess_stats(stats)
+
+    # Construct the description for Nano Banana Pro Edit
+    cat_map = {
+        "tops": "upper body garment (top/shirt)",
+        "bottoms": "lower body garment (pants/skirt)",
+        "one-piece": "full body garment (dress/jumpsuit)"
+    }
+    category_text = cat_map.get(garment_category, "garment")
+    
+    prompt_parts = [
+        "You are given 2 images.",
+        "Image 1 is the BASE photo of a person.",
+        "Image 2 is the GARMENT reference photo.",
+        "",
+        f"TASK: Edit Image 1 by replacing ONLY the person's {category_text} with the exact same clothing shown in Image 2.",
+        "PRESERVE EXACTLY: the same person identity (face), hair/head covering, skin tone, pose, body shape, hands, background, camera angle, and lighting.",
+        "MATCH FROM Image 2: fabric texture, color, pattern, and silhouette.",
+        "Make the result photorealistic with natural folds and seams. Keep consistent shadows and perspective.",
+        "Do NOT change the face. Do NOT add text or watermarks.",
+    ]
+
+    if custom_prompt:
+        prompt_parts.append(f"ADDITIONAL REQUIREMENTS: {custom_prompt}")
+    if advanced_instructions:
+        prompt_parts.append(f"STYLE INSTRUCTIONS: {advanced_instructions}")
+
+    edit_prompt = "\n".join(prompt_parts)
+
+    cache_key = _result_cache_key(base_prepared["sha256"], garment_prepared["sha256"], garment_category, edit_prompt)
+    stats["result_cache_key"] = cache_key
+    with metrics.span("result_cache"):
+        cached = await asyncio.to_thread(_result_cache.get, cache_key)
+    if cached:
+        print(f"Result cache hit ({cache_key[:12]}), skipping Fal call.")
+        stats["cache_hit"] = True
+        stats["thumbnail_url"] = cached.get("thumbnail_url")
+        return cached["result_url"]
+
+    print(f"Editing base image with Fal nano-banana-pro/edit (category: {garment_category})...")
+
+    fal_result = await _fal_run(
+        "fal-ai/nano-banana-pro/edit",
+        {
+            "prompt": edit_prompt,
+            "image_urls": [base_prepared["data_url"], garment_prepared["data_url"]],
+        },
+    )
+
+    result_url = _extract_first_image_url(fal_result)
+    await asyncio.to_thread(_result_cache.set, cache_key, {"result_url": result_url})
+    return result_url
@@ -0,0 +1,120 @@
+"""
+Upload limits and early validation for the generate endpoints.
+
+Two layers, both running before any credit is reserved or Fal is called:
+
+- `UploadLimitMiddleware` caps the request body per route while it is being received: a
+  declared Content-Length over the cap is refused straight away, and a chunked body is cut off
+  with 413 as soon as it crosses it, before multipart parsing has spooled the rest to disk.
+- `validate_image_upload` sniffs each file's magic bytes and reads its dimensions from the
+  header (api/image_header.py) without decoding, so non-images, formats Pillow can't read and
+  decompression bombs are rejected with a 4xx instead of failing later inside Pillow.
+
+    UPLOAD_MAX_BYTES=20971520     per image
+    UPLOAD_MAX_PIXELS=50000000    per image, width x height
+"""
+import os
+
+from fastapi import HTTPException, UploadFile
+
+from .image_header import read_image_header
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", "50000000"))
+# What the preprocessing stage can decode.
+UPLOAD_FORMATS = ("jpeg", "png", "webp", "gif")
+
+# Room for the multipart framing and the form fields around the files.
+_FORM_OVERHEAD_BYTES = 64 * 1024
+# Dimensions are usually in the first few hundred bytes; JPEGs with big EXIF blocks push the
+# frame header further out, so keep reading up to this much.
+_HEADER_CHUNK_BYTES = 16 * 1024
+_HEADER_MAX_BYTES = 512 * 1024
+
+
+def max_body_bytes(files: int) -> int:
+    """Body cap for a form carrying up to `files` images."""
+    return files * UPLOAD_MAX_BYTES + _FORM_OVERHEAD_BYTES
+
+
+def _too_large(limit: int) -> HTTPException:
+    size = f"{limit // (1024 * 1024)} MB" if limit >= 1024 * 1024 else f"{limit // 1024} KB"
+    return HTTPException(status_code=413, detail=f"Upload too large (limit {size})")
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware enforcing `limits` ({path: max body bytes}) while the body streams in."""
+
+    def __init__(self, app, limits: dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                return await _reject(send, limit)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing; FastAPI passes HTTPException through as the response.
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def _reject(send, limit: int) -> None:
+    body = ('{"detail": "%s"}' % _too_large(limit).detail).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii")), (b"connection", b"close")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def validate_image_upload(upload: UploadFile) -> tuple[str, int, int]:
+    """
+    Check an uploaded image from its first bytes and return (format, width, height), raising
+    413/415/400 for anything the generation would only fail on later. Leaves the file rewound.
+    """
+    if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+        raise _too_large(UPLOAD_MAX_BYTES)
+
+    head = b""
+    info = None
+    while len(head) < _HEADER_MAX_BYTES:
+        chunk = await upload.read(_HEADER_CHUNK_BYTES)
+        if not chunk:
+            break
+        head += chunk
+        info = read_image_header(head)
+        if info is None or info[1] is not None or info[0] not in UPLOAD_FORMATS:
+            break
+    await upload.seek(0)
+
+    if info is None or info[0] not in UPLOAD_FORMATS:
+        kind = info[0].upper() if info else "this file type"
+        raise HTTPException(
+            status_code=415,
+            detail=f"{upload.filename or 'Upload'}: {kind} is not supported. Use JPEG, PNG, WebP or GIF.",
+        )
+    fmt, width, height = info
+    if not width or not height:
+        raise HTTPException(status_code=400, detail=f"{upload.filename or 'Upload'}: could not read the image dimensions")
+    if width * height > UPLOAD_MAX_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{upload.filename or 'Upload'}: {width}x{height} is too large (max {UPLOAD_MAX_PIXELS // 1_000_000} MP)",
+        )
+    return fmt, width, height
@@ -0,0 +1,112 @@
+"""
+Stripe webhook events: recorded by their Stripe id and applied exactly once.
+
+`POST /webhook/stripe` verifies the signature, stores the event (`record_stripe_event`, from the
+stripe_events migration) and applies it with `apply_stripe_event`, which adds the credits and
+marks the event processed in one transaction. A retry or replay of an applied event finds it
+already processed and does nothing, so duplicate deliveries can't double-credit.
+
+The webhook answers as soon as the event is recorded, so its latency doesn't depend on how long
+crediting takes; the event is applied right after in a background task. Once recorded, an event
+can't be lost: if that task fails, or never runs (a serverless instance frozen after answering),
+`apply_pending_stripe_events`, scheduled every minute with pg_cron (stripe_event_sweep
+migration), applies whatever is still pending. Only a failure to record answers with an error,
+which makes Stripe redeliver.
+"""
+import asyncio
+import json
+
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics
+
+# Event types with an effect; anything else is acknowledged without being recorded.
+HANDLED_EVENT_TYPES = ("checkout.session.completed",)
+# Stripe's default: reject signatures older than this, so a captured request can't be replayed.
+SIGNATURE_TOLERANCE_SECONDS = 300
+
+_EVENTS_HELP = "Stripe webhook events by outcome."
+
+
+def verify_stripe_signature(payload: bytes, header: str | None, secret: str | None) -> dict:
+    """The event in `payload` if the Stripe-Signature `header` signs it with `secret`; raises ValueError otherwise."""
+    if not secret:
+        raise ValueError("Webhook secret is not configured")
+    # The SDK is heavy; only the webhook needs it (see the cold-start note in index.py).
+    from stripe import SignatureVerificationError, WebhookSignature
+
+    try:
+        WebhookSignature.verify_header(payload, header, secret, SIGNATURE_TOLERANCE_SECONDS)
+    except SignatureVerificationError as e:
+        raise ValueError(str(e))
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        raise ValueError("Invalid payload")
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        raise ValueError("Invalid payload")
+    return event
+
+
+class StripeEventProcessor:
+    """
+    Records verified events and applies them. `on_applied(user_id)` runs after an event changed
+    a user's credits (e.g. to drop caches).
+    """
+
+    def __init__(self, get_supabase, on_applied=None):
+        self._get_supabase = get_supabase
+        self._on_applied = on_applied
+        # Keep references so apply tasks aren't garbage-collected before they finish.
+        self._tasks: set[asyncio.Task] = set()
+
+    async def receive(self, event: dict) -> str:
+        """
+        Record `event` and start applying it in the background. Returns its status when
+        recorded: "pending" (new, being applied), "processed"/"ignored" (a duplicate of one
+        already done) or "skipped" (unhandled type). Raises if it couldn't be recorded.
+        """
+        if event.get("type") not in HANDLED_EVENT_TYPES:
+            metrics.increment("stripe_webhook_events_total", _EVENTS_HELP, outcome="skipped")
+            return "skipped"
+        query = self._get_supabase().rpc(
+            "record_stripe_event", {"p_id": event["id"], "p_type": event["type"], "p_payload": event}
+        )
+        with metrics.span("supabase"):
+            status = (await run_in_threadpool(query.execute)).data
+        if status != "pending":
+            metrics.increment("stripe_webhook_events_total", _EVENTS_HELP, outcome="duplicate")
+            return status
+        # A redelivery of an event still pending retries it here too; applying is idempotent.
+        task = asyncio.create_task(self._apply_logged(event["id"]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return status
+
+    async def _apply_logged(self, event_id: str) -> None:
+        try:
+            await self.apply(event_id)
+        except Exception as e:
+            # The apply is transactional: it either landed or the event is still pending for the sweep.
+            print(f"Stripe event {event_id} failed to apply: {e!r}")
+            metrics.increment("stripe_webhook_events_total", _EVENTS_HELP, outcome="failed")
+
+    async def apply(self, event_id: str) -> str:
+        """Apply one recorded event; returns its status afterwards."""
+        query = self._get_supabase().rpc("apply_stripe_event", {"p_id": event_id})
+        with metrics.span("webhook_apply"):
+            rows = (await run_in_threadpool(query.execute)).data or []
+        if not rows:
+            print(f"Stripe event {event_id} is not recorded")
+            return "pending"
+        row = rows[0]
+        if row["status"] == "pending":
+            print(f"Stripe event {event_id} failed to apply; it stays pending for a retry")
+            metrics.increment("stripe_webhook_events_total", _EVENTS_HELP, outcome="failed")
+        elif row["credits"] is not None:
+            metrics.increment("stripe_webhook_events_total", _EVENTS_HELP, outcome="applied")
+            if self._on_applied is not None:
+                self._on_applied(row["user_id"])
+        else:
+            metrics.increment("stripe_webhook_events_total", _EVENTS_HELP, outcome=row["status"])
+        return row["status"]
@@ -0,0 +1,156 @@
+"""
+Cold-start benchmark for the serverless entry point.
+
+Each run starts a fresh interpreter, imports `api.index` and serves one request to `/health`
+straight through the ASGI app (no server, no httpx), which is what a Vercel cold start pays
+before it can answer. Reports the median/worst import and first-response times, which heavy
+SDKs ended up loaded, and the slowest top-level imports from `python -X importtime`.
+
+    python -m benchmarks.bench_cold_start --runs 10
+    python -m benchmarks.bench_cold_start --save benchmarks/cold_start_baseline.json
+    python -m benchmarks.bench_cold_start --baseline '' --tolerance 1.25
+
+Every run is compared with the reference run checked in as benchmarks/cold_start_baseline.json
+(or --baseline; '' skips it), and the script exits non-zero if /health now loads a heavy module
+the baseline didn't or, on the machine the baseline was recorded on (see
+`load_test.machine_fingerprint`), the median first response regressed by more than --tolerance
+times the saved median. Record a baseline for your machine with --save.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from benchmarks.load_test import machine_fingerprint
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Reference run checked in next to this script; compared against by default.
+_BASELINE = os.path.join(_ROOT, "benchmarks", "cold_start_baseline.json")
+
+# Modules /health should never need; each one showing up here is a cold-start regression.
+_HEAVY_MODULES = ("stripe", "supabase", "jose", "PIL", "lxml", "bs4", "httpx", "uvicorn", "boto3")
+
+_CHILD = r"""
+import asyncio, json, sys, time
+start = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+
+async def health():
+    sent = []
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/health", "raw_path": b"/health", "root_path": "",
+             "query_string": b"", "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await api.index.app(scope, receive, send)
+    return sent[0]["status"]
+
+status = asyncio.run(health())
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (served - start) * 1000,
+    "status": status,
+    "heavy_modules": sorted({m.split(".")[0] for m in sys.modules} & set(HEAVY)),
+}))
+"""
+
+
+def _child_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = _ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def _cold_start() -> dict:
+    code = f"HEAVY = {list(_HEAVY_MODULES)!r}\n" + _CHILD
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=_ROOT, env=_child_env(), capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _importtime(top: int) -> list[tuple[str, float]]:
+    """Slowest modules imported directly by `api.index` (cumulative ms, from -X importtime)."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.index"],
+        cwd=_ROOT, env=_child_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        m = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)", line)
+        # Depth 0 and 1 only: api.index itself and what it imports directly.
+        if m and len(m.group(2)) <= 3:
+            rows.append((m.group(3), int(m.group(1)) / 1000))
+    return sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="How many imports to list from -X importtime")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=_BASELINE, help="Compare against a JSON file written by --save ('' to skip)")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    _cold_start()  # Warm the bytecode cache so the first run isn't an outlier.
+    runs = [_cold_start() for _ in range(args.runs)]
+    imports = [r["import_ms"] for r in runs]
+    first = [r["first_response_ms"] for r in runs]
+    result = {
+        "runs": args.runs,
+        "python": sys.version.split()[0],
+        "machine": machine_fingerprint(),
+        "import_ms_median": statistics.median(imports),
+        "first_response_ms_median": statistics.median(first),
+        "first_response_ms_max": max(first),
+        "heavy_modules": runs[-1]["heavy_modules"],
+        "status": runs[-1]["status"],
+    }
+
+    print(
+        f"cold start over {args.runs} runs: import median={result['import_ms_median']:.0f}ms, "
+        f"/health first response median={result['first_response_ms_median']:.0f}ms "
+        f"max={result['first_response_ms_max']:.0f}ms (status {result['status']})"
+    )
+    print(f"heavy modules loaded for /health: {', '.join(result['heavy_modules']) or 'none'}")
+    print("slowest top-level imports (cumulative):")
+    for name, ms in _importtime(args.top):
+        print(f"  {ms:8.1f}ms  {name}")
+
+    # Read the baseline before --save can overwrite it, so re-recording still shows the change.
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    if baseline:
+        added = sorted(set(result["heavy_modules"]) - set(baseline["heavy_modules"]))
+        if added:
+            print(f"newly loaded for /health: {', '.join(added)}")
+        slow = False
+        if baseline.get("machine") != result["machine"]:
+            print(f"baseline was recorded on another machine ({baseline.get('machine')}); not comparing timings")
+        else:
+            limit = baseline["first_response_ms_median"] * args.tolerance
+            slow = result["first_response_ms_median"] > limit
+            print(f"baseline median={baseline['first_response_ms_median']:.0f}ms, limit={limit:.0f}ms")
+        print(f"baseline comparison: {'REGRESSED' if added or slow else 'OK'}")
+        if added or slow:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
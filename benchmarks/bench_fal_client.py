@@ -0,0 +1,93 @@
+"""
+Fault-injection benchmark for `api.fal_client.FalClient` against the local stub Fal.
+
+Sends waves of requests while the stub injects 503s and a slow tail, then takes Fal "down"
+entirely, and reports success rate, latency percentiles and what the client did
+(retries, hedges, circuit-breaker rejections).
+
+    python -m benchmarks.bench_fal_client --requests 200 --error-rate 0.2 --slow-rate 0.05 --hedge
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import HTTPException
+
+from api.fal_client import FalClient
+from benchmarks import stub_fal
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] if ordered else 0.0
+
+
+async def _wave(client: FalClient, count: int, concurrency: int) -> tuple[list[float], int]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with sem:
+            start = time.perf_counter()
+            try:
+                await client.run("fal-ai/nano-banana-pro/edit", b'{"prompt": "bench", "image_urls": []}')
+                latencies.append(time.perf_counter() - start)
+            except (HTTPException, RuntimeError):
+                failures += 1
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies, failures
+
+
+async def _run(args, base_url: str):
+    client = FalClient(
+        base_url,
+        "stub:stub",
+        max_concurrency=args.concurrency,
+        retries=args.retries,
+        hedge=args.hedge,
+        failure_threshold=10,
+        reset_seconds=1.0,
+    )
+
+    latencies, failures = await _wave(client, args.requests, args.concurrency)
+    print(
+        f"faulty Fal: ok={len(latencies)} failed={failures} "
+        f"p50={_percentile(latencies, 0.5):.2f}s p95={_percentile(latencies, 0.95):.2f}s "
+        f"p99={_percentile(latencies, 0.99):.2f}s"
+    )
+
+    stub_fal.configure(args.latency, error_rate=1.0)
+    start = time.perf_counter()
+    _, failures = await _wave(client, 50, args.concurrency)
+    print(f"Fal down:   50 requests failed={failures} in {time.perf_counter() - start:.2f}s (breaker: {client.breaker.state})")
+
+    stub_fal.configure(args.latency)
+    await asyncio.sleep(1.1)
+    # One half-open probe closes the breaker, then normal traffic resumes.
+    await _wave(client, 1, 1)
+    latencies, failures = await _wave(client, 10, args.concurrency)
+    print(f"recovered:  ok={len(latencies)} failed={failures} (breaker: {client.breaker.state})")
+    print(f"client stats: {client.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--hedge", action="store_true")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    stub_fal.start_in_thread(args.port, args.latency, error_rate=args.error_rate, slow_rate=args.slow_rate)
+    asyncio.run(_run(args, f"http://127.0.0.1:{args.port}"))
+
+
+if __name__ == "__main__":
+    main()
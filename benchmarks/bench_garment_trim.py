@@ -0,0 +1,136 @@
+"""
+CPU-cost and payload benchmark for garment trimming (`_trim_garment` in api/tryon.py).
+
+For each garment image, times `_normalize_for_edit_api` with and without trimming, the
+detection step on its own, and reports the output size and how much of the frame the garment
+fills afterwards. Point it at real product shots, or let it synthesize retailer-style ones
+(a garment on a plain canvas, two views side by side, a transparent cut-out, a lifestyle scene
+that must be left alone):
+
+    python -m benchmarks.bench_garment_trim --corpus ~/Pictures/garments
+    python -m benchmarks.bench_garment_trim --repeat 5
+"""
+import argparse
+import glob
+import io
+import os
+import statistics
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from api.tryon import _GARMENT_ASPECT, _garment_bbox, _normalize_for_edit_api, np
+
+_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png", "*.webp")
+
+
+def _shirt(draw: ImageDraw.ImageDraw, x: int, y: int, scale: float, colour) -> None:
+    # Body plus sleeves; crude, but it has the silhouette and the empty canvas around it.
+    s = lambda v: int(v * scale)
+    draw.rectangle((x + s(200), y + s(100), x + s(800), y + s(1100)), fill=colour)
+    draw.polygon([(x + s(200), y + s(100)), (x, y + s(450)), (x + s(120), y + s(520)), (x + s(200), y + s(350))], fill=colour)
+    draw.polygon([(x + s(800), y + s(100)), (x + s(1000), y + s(450)), (x + s(880), y + s(520)), (x + s(800), y + s(350))], fill=colour)
+    draw.ellipse((x + s(400), y + s(60), x + s(600), y + s(180)), fill=(250, 250, 250))
+
+
+def _encode(im: Image.Image, fmt: str) -> bytes:
+    out = io.BytesIO()
+    im.save(out, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return out.getvalue()
+
+
+def _synthetic() -> list[tuple[str, bytes]]:
+    canvas = Image.new("RGB", (2000, 2000), (255, 255, 255))
+    _shirt(ImageDraw.Draw(canvas), 700, 700, 0.6, (40, 70, 160))
+    single = _encode(canvas.filter(ImageFilter.GaussianBlur(1)), "JPEG")
+
+    views = Image.new("RGB", (3000, 2000), (242, 242, 242))
+    draw = ImageDraw.Draw(views)
+    _shirt(draw, 150, 400, 1.2, (180, 40, 40))
+    _shirt(draw, 1900, 700, 0.8, (180, 40, 40))
+    multi = _encode(views, "JPEG")
+
+    cutout = Image.new("RGBA", (1600, 2400), (0, 0, 0, 0))
+    _shirt(ImageDraw.Draw(cutout), 300, 600, 1.0, (20, 120, 60, 255))
+    transparent = _encode(cutout, "PNG")
+
+    scene = Image.blend(
+        Image.linear_gradient("L").resize((2000, 2600)).convert("RGB"),
+        Image.effect_noise((2000, 2600), 60).convert("RGB"),
+        0.5,
+    )
+    _shirt(ImageDraw.Draw(scene), 500, 700, 1.0, (40, 70, 160))
+    lifestyle = _encode(scene, "JPEG")
+
+    return [
+        ("white canvas", single),
+        ("two views, grey", multi),
+        ("transparent png", transparent),
+        ("lifestyle (no trim)", lifestyle),
+    ]
+
+
+def _load_corpus(args) -> list[tuple[str, bytes]]:
+    if args.corpus:
+        paths = sorted(p for ext in _EXTENSIONS for p in glob.glob(os.path.join(args.corpus, ext)))
+        return [(os.path.basename(p), open(p, "rb").read()) for p in paths]
+    return _synthetic()
+
+
+def _cpu(fn, repeat: int) -> tuple[float, object]:
+    """Median thread CPU seconds of `fn()` over `repeat` runs, and its last result."""
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.thread_time()
+        result = fn()
+        times.append(time.thread_time() - start)
+    return statistics.median(times), result
+
+
+def _encoded(raw: bytes, trim: bool) -> bytes:
+    out = io.BytesIO()
+    _normalize_for_edit_api(raw, out, trim)
+    return out.getvalue()
+
+
+def _decoded(raw: bytes) -> Image.Image:
+    with Image.open(io.BytesIO(raw)) as im:
+        im.load()
+        return im.convert("RGBA" if "A" in im.mode else "RGB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of garment images")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if np is None:
+        raise SystemExit("garment trimming needs numpy: pip install numpy")
+    corpus = _load_corpus(args)
+    if not corpus:
+        parser.error("no images found")
+
+    print(f"aspect={_GARMENT_ASPECT[0]}:{_GARMENT_ASPECT[1]}, median CPU over {args.repeat} runs")
+    print(f"{'image':<22}{'size':>11}{'detect ms':>11}{'plain ms':>10}{'trim ms':>9}{'plain KB':>10}{'trim KB':>9}  crop")
+    overhead = []
+    for name, raw in corpus:
+        im = _decoded(raw)
+        detect_s, found = _cpu(lambda: _garment_bbox(im), args.repeat)
+        plain_s, plain = _cpu(lambda: _encoded(raw, False), args.repeat)
+        trim_s, trimmed = _cpu(lambda: _encoded(raw, True), args.repeat)
+        overhead.append(trim_s - plain_s)
+        if found:
+            left, top, right, bottom = found[0]
+            crop = f"{right - left}x{bottom - top} ({(right - left) * (bottom - top) / (im.width * im.height):.0%} of frame)"
+        else:
+            crop = "untouched"
+        print(
+            f"{name[:21]:<22}{f'{im.width}x{im.height}':>11}{detect_s * 1000:11.1f}{plain_s * 1000:10.1f}"
+            f"{trim_s * 1000:9.1f}{len(plain) / 1024:10.0f}{len(trimmed) / 1024:9.0f}  {crop}"
+        )
+    print(f"trimming overhead per image: median {statistics.median(overhead) * 1000:.1f}ms CPU (once per garment; cached after)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Concurrent-throughput benchmark for the try-on pipeline against the local stub Fal.
+
+Runs N generations concurrently on ONE event loop (like a single uvicorn worker) in two modes:
+- blocking: the pre-async pipeline (Pillow + base64 + a blocking HTTP POST inline on the loop)
+- async:    `api.tryon.generate_tryon_image`
+
+    python -m benchmarks.bench_generate --concurrency 32 --latency 2.0
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+import urllib.request
+
+from PIL import Image
+
+from benchmarks import stub_fal
+
+
+def _make_sample(path: str, size: tuple[int, int], color: tuple[int, int, int]) -> str:
+    Image.new("RGB", size, color).save(path, format="JPEG", quality=90)
+    return path
+
+
+async def _blocking_generate(base_path: str, garment_path: str, fal_url: str) -> str:
+    # Mirrors the baseline implementation: every step runs synchronously on the event loop.
+    payload = []
+    for p in (base_path, garment_path):
+        out = p + ".norm.png"
+        with Image.open(p) as im:
+            im.convert("RGB").save(out, format="PNG")
+        with open(out, "rb") as f:
+            payload.append("data:image/png;base64," + base64.b64encode(f.read()).decode("utf-8"))
+        os.remove(out)
+    req = urllib.request.Request(
+        f"{fal_url}/fal-ai/nano-banana-pro/edit",
+        data=json.dumps({"prompt": "bench", "image_urls": payload}).encode("utf-8"),
+        headers={"Authorization": "Key stub:stub", "Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=180) as resp:
+        return json.loads(resp.read())["images"][0]["url"]
+
+
+async def _run(mode: str, concurrency: int, base_path: str, garment_path: str, fal_url: str) -> float:
+    from api.tryon import generate_tryon_image
+
+    async def one():
+        if mode == "blocking":
+            return await _blocking_generate(base_path, garment_path, fal_url)
+        return await generate_tryon_image(base_path, garment_path, garment_category="tops")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    assert all(results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--size", type=int, default=1536, help="long edge of the synthetic photos")
+    args = parser.parse_args()
+
+    fal_url = f"http://127.0.0.1:{args.port}"
+    os.environ["FAL_BASE_URL"] = fal_url
+    os.environ.setdefault("FAL_KEY", "stub:stub")
+    # Every request here is identical; measure the pipeline, not the caches.
+    os.environ.setdefault("TRYON_RESULT_CACHE", "off")
+    os.environ.setdefault("TRYON_NORMALIZED_CACHE", "off")
+    stub_fal.start_in_thread(args.port, args.latency)
+
+    tmp = tempfile.mkdtemp(prefix="bench_generate_")
+    base = _make_sample(os.path.join(tmp, "base.jpg"), (args.size * 3 // 4, args.size), (180, 140, 120))
+    garment = _make_sample(os.path.join(tmp, "garment.jpg"), (args.size, args.size), (20, 60, 200))
+
+    print(f"concurrency={args.concurrency} fal_latency={args.latency}s image={args.size}px")
+    for mode in ("blocking", "async"):
+        elapsed = asyncio.run(_run(mode, args.concurrency, base, garment, fal_url))
+        print(f"{mode:>9}: {elapsed:7.2f}s total  {args.concurrency / elapsed:6.2f} generations/s")
+
+
+if __name__ == "__main__":
+    main()
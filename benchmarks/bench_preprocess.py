@@ -0,0 +1,94 @@
+"""
+Encode-time and payload-size benchmark for the image preprocessing stage.
+
+Compares the old path (full-resolution lossless PNG) with `_normalize_for_edit_api` over a
+corpus of photos. Point it at a directory of real phone/retailer photos, or let it synthesize
+12 MP photo-like images:
+
+    python -m benchmarks.bench_preprocess --corpus ~/Pictures/tryon-samples
+    python -m benchmarks.bench_preprocess --synthetic 6
+"""
+import argparse
+import glob
+import io
+import os
+import time
+
+from PIL import Image, ImageFilter, ImageOps
+
+from api.tryon import _MAX_EDGE, _ENCODE_FORMAT, _ENCODE_QUALITY, _normalize_for_edit_api
+
+_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png", "*.webp")
+
+
+def _baseline_png(raw: bytes) -> bytes:
+    # The pre-preprocessing behaviour: EXIF transpose, then a full-resolution PNG.
+    with Image.open(io.BytesIO(raw)) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "A" in im.mode else "RGB")
+        out = io.BytesIO()
+        im.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _synthetic_photo(seed: int, size=(3024, 4032)) -> bytes:
+    # Smooth gradients plus sensor-like noise compress roughly like a real phone photo.
+    noise = Image.effect_noise(size, 24 + seed).convert("RGB")
+    gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+    im = Image.blend(gradient, noise, 0.35).filter(ImageFilter.GaussianBlur(1))
+    out = io.BytesIO()
+    im.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _load_corpus(args) -> list[tuple[str, bytes]]:
+    if args.corpus:
+        paths = sorted(p for ext in _EXTENSIONS for p in glob.glob(os.path.join(args.corpus, ext)))
+        return [(os.path.basename(p), open(p, "rb").read()) for p in paths]
+    return [(f"synthetic_{i}.jpg", _synthetic_photo(i)) for i in range(args.synthetic)]
+
+
+def _preprocess(raw: bytes) -> bytes:
+    out = io.BytesIO()
+    _normalize_for_edit_api(raw, out)
+    return out.getvalue()
+
+
+def _timed(fn, raw: bytes) -> tuple[float, int]:
+    start = time.perf_counter()
+    out = fn(raw)
+    return time.perf_counter() - start, len(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of sample photos")
+    parser.add_argument("--synthetic", type=int, default=4, help="number of synthetic 12 MP photos if no corpus")
+    args = parser.parse_args()
+
+    corpus = _load_corpus(args)
+    if not corpus:
+        parser.error("no images found")
+
+    print(f"max_edge={_MAX_EDGE} format={_ENCODE_FORMAT} quality={_ENCODE_QUALITY}")
+    print(f"{'image':<28}{'raw MB':>8}{'png s':>8}{'png MB':>8}{'new s':>8}{'new MB':>8}")
+    totals = [0.0, 0, 0.0, 0, 0]
+    for name, raw in corpus:
+        old_s, old_bytes = _timed(_baseline_png, raw)
+        new_s, new_bytes = _timed(_preprocess, raw)
+        print(f"{name[:27]:<28}{len(raw) / 1e6:8.2f}{old_s:8.2f}{old_bytes / 1e6:8.2f}{new_s:8.2f}{new_bytes / 1e6:8.2f}")
+        for i, v in enumerate((old_s, old_bytes, new_s, new_bytes, len(raw))):
+            totals[i] += v
+
+    old_s, old_bytes, new_s, new_bytes, _ = totals
+    # Fal receives base64 inside JSON, i.e. ~4/3 of the encoded size.
+    print(
+        f"\ntotal encode: {old_s:.2f}s -> {new_s:.2f}s   "
+        f"base64 payload: {old_bytes * 4 / 3 / 1e6:.1f} MB -> {new_bytes * 4 / 3 / 1e6:.1f} MB "
+        f"({old_bytes / max(new_bytes, 1):.1f}x smaller)"
+    )
+
+
+if __name__ == "__main__":
+    main()
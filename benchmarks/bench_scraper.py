@@ -0,0 +1,328 @@
+"""
+Benchmark for the product-image scraper over saved retailer pages.
+
+`benchmarks/fixtures/*.html.gz` are trimmed replicas of an Amazon product page (main image in
+`#landingImage` a third of the way into ~900 KB of markup), a Next product page (og:image plus
+`itemimages` picture sources, no JSON-LD) and a Shopify product page (JSON-LD ProductGroup
+mid-page). For each page it compares the previous BeautifulSoup/html.parser engine with the
+streaming engine on both parser backends, and reports how much of the page was parsed before
+early termination. Finally it serves the pages from a local HTTP server with simulated latency
+and compares sequential extraction with `extract_images_from_urls`, then fires concurrent
+lookups of one URL to show they share a single fetch. The result cache is switched off
+(SCRAPE_CACHE=off) so every page is really fetched, and probing is left to its own section
+(the fixtures point at real CDNs): there, `rank_candidates` ranks locally served photos of
+different sizes and shapes, against downloading each one in full.
+
+    python -m benchmarks.bench_scraper --repeat 20 --latency 0.3 --pages 24
+
+The legacy engine needs beautifulsoup4, which the app no longer uses; it's listed in
+benchmarks/requirements.txt and skipped when missing.
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import io
+import json
+import random
+import re
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+
+from PIL import Image
+
+os.environ.setdefault("SCRAPE_CACHE", "off")
+os.environ.setdefault("SCRAPE_PROBE", "false")
+
+from api import scraper  # noqa: E402
+from api.scraper import (  # noqa: E402
+    clean_image_url,
+    extract_image_candidates,
+    extract_images_from_html,
+    extract_images_from_url,
+    extract_images_from_urls,
+    rank_candidates,
+)
+
+_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# The engines key site-specific rules off the URL.
+_PAGE_URLS = {
+    "amazon_product": "https://www.amazon.com/Amazon-Essentials-Slim-Fit-V-Neck/dp/B07F2KW7T5",
+    "next_product": "https://www.next.co.il/en/style/su819458/h85970",
+    "shopify_product": "https://shop.example-apparel.com/products/linen-camp-shirt",
+}
+
+
+def _legacy_extract(url, html):
+    # The pre-rewrite engine, verbatim: BeautifulSoup/html.parser, several find_all passes, O(n^2) dedup.
+    from bs4 import BeautifulSoup
+    try:
+        soup = BeautifulSoup(html, 'html.parser')
+
+        images = []
+        
+        # 1. Specialized Amazon Logic (Dynamic Images)
+        if 'amazon' in url.lower():
+            # ... existing amazon logic ...
+            img = soup.find('img', {'id': 'landingImage'}) or soup.find('img', {'id': 'main-image'})
+            if img:
+                dynamic_data = img.get('data-a-dynamic-image')
+                if dynamic_data:
+                    try:
+                        # Format is {"url": [w,h], "url2": [w,h]}
+                        data = json.loads(dynamic_data)
+                        # Sort by width*height descending
+                        sorted_urls = sorted(data.items(), key=lambda x: x[1][0] * x[1][1], reverse=True)
+                        if sorted_urls:
+                            images.append(sorted_urls[0][0])
+                    except:
+                        pass
+                
+                if not images and img.get('data-old-hires'):
+                    images.append(img.get('data-old-hires'))
+                if not images and img.get('src'):
+                    images.append(img.get('src'))
+
+        # 2. Specialized Next.co.il Logic
+        if 'next.co.il' in url.lower() or 'next.co.uk' in url.lower():
+            # Look for picture sources or high-res looking URLs
+            for source in soup.find_all(['source', 'img']):
+                srcset = source.get('srcset')
+                if srcset:
+                    # srcset often looks like "url1 1x, url2 2x" or "url1 480w, url2 640w"
+                    parts = srcset.split(',')
+                    for part in parts:
+                        img_url = part.strip().split(' ')[0]
+                        if 'itemimages' in img_url.lower():
+                            images.append(img_url)
+                
+                src = source.get('src')
+                if src and 'itemimages' in src.lower():
+                    images.append(src)
+
+        # 3. OpenGraph / Twitter Meta Tags (Often high res)
+        for tag in ['og:image', 'twitter:image']:
+            meta = soup.find('meta', property=tag) or soup.find('meta', attrs={'name': tag})
+            if meta and meta.get('content'):
+                images.append(meta.get('content'))
+
+        # 3. Main Product Image Heuristics
+        if not images:
+            # Look for images with 'product' or 'main' in ID/Class/Src
+            potential_imgs = soup.find_all('img', src=True)
+            for img in potential_imgs:
+                src = img.get('src')
+                img_id = str(img.get('id', '')).lower()
+                img_class = str(img.get('class', [])).lower()
+                
+                if 'product' in src.lower() or 'main' in src.lower() or 'product' in img_id or 'product' in img_class:
+                    images.append(urljoin(url, src))
+                    if len(images) > 2: break
+
+        # 4. Fallback to any large images
+        if not images:
+            all_imgs = soup.find_all('img', src=True)
+            for img in all_imgs:
+                src = img.get('src')
+                images.append(urljoin(url, src))
+                if len(images) > 5: break
+
+        # Cleanup, Deduplicate, and Upgrade to High Res
+        unique_images = []
+        for img_url in images:
+            cleaned = clean_image_url(img_url)
+            if cleaned not in unique_images:
+                unique_images.append(cleaned)
+        
+        return unique_images
+
+    except Exception as e:
+        print(f"Error extracting images: {e}")
+        return []
+
+
+def _load_fixtures() -> dict[str, str]:
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(_FIXTURES, "*.html.gz"))):
+        name = os.path.basename(path)[: -len(".html.gz")]
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            pages[name] = f.read()
+    return pages
+
+
+def _time(fn, repeat: int) -> tuple[float, object]:
+    result = fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def _parsed_fraction(url: str, html: str) -> float:
+    """Share of the page fed to the parser before the collector stopped it."""
+    collector = scraper._CandidateCollector(url)
+    parser = scraper._make_parser(collector)
+    fed = 0
+    for i in range(0, len(html), scraper._CHUNK_BYTES):
+        chunk = html[i:i + scraper._CHUNK_BYTES]
+        parser.feed(chunk)
+        fed += len(chunk)
+        if collector.done:
+            break
+    return fed / len(html)
+
+
+def _engines():
+    engines = []
+    try:
+        import bs4  # noqa: F401
+        engines.append(("legacy bs4/html.parser", _legacy_extract))
+    except ImportError:
+        print("beautifulsoup4 not installed (pip install -r benchmarks/requirements.txt): skipping the legacy engine")
+
+    def stdlib(url, html):
+        etree, scraper.etree = scraper.etree, None
+        try:
+            return extract_images_from_html(url, html)
+        finally:
+            scraper.etree = etree
+
+    if scraper.etree is not None:
+        engines.append(("streaming lxml", extract_images_from_html))
+    else:
+        print("lxml not installed: the streaming engine uses the standard library parser")
+    engines.append(("streaming stdlib", stdlib))
+    return engines
+
+
+def _photo(width: int, height: int) -> bytes:
+    # Noisy enough to compress like a real product photo.
+    rng = random.Random(width * height)
+    im = Image.frombytes("RGB", (width // 8, height // 8), rng.randbytes(width // 8 * (height // 8) * 3))
+    out = io.BytesIO()
+    im.resize((width, height), Image.BICUBIC).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _serve(pages: dict[str, str], latency: float) -> tuple[ThreadingHTTPServer, str]:
+    photos: dict[str, bytes] = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.hits += 1
+            time.sleep(latency)
+            name = self.path.split("?")[0].strip("/").split("/")[-1]
+            size = re.fullmatch(r"(\d+)x(\d+)\.jpg", name)
+            if size:
+                if name not in photos:
+                    photos[name] = _photo(int(size.group(1)), int(size.group(2)))
+                body, content_type = photos[name], "image/jpeg"
+            elif name in pages:
+                body, content_type = pages[name].encode("utf-8"), "text/html; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            status = 200
+            ranged = re.fullmatch(r"bytes=0-(\d+)", self.headers.get("Range", ""))
+            if ranged:
+                status, body = 206, body[: int(ranged.group(1)) + 1]
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+                server.bytes_sent += len(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The scraper hung up after early termination.
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.hits = 0
+    server.bytes_sent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+async def _probe(server: ThreadingHTTPServer, base_url: str) -> None:
+    # Page order as a scraper might find it: a thumbnail first, a dead link, a banner...
+    names = ["160x160.jpg", "missing.jpg", "2400x600.jpg", "800x800.jpg", "1500x2000.jpg", "1200x1200.jpg"]
+    candidates = [{"url": f"{base_url}/img/{n}", "width": None, "height": None, "format": None} for n in names]
+    await rank_candidates(candidates)  # Generate and warm the photos.
+
+    server.bytes_sent = 0
+    start = time.perf_counter()
+    ranked = await rank_candidates(candidates)
+    probe_time, probe_bytes = time.perf_counter() - start, server.bytes_sent
+
+    server.bytes_sent = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(scraper.http_client.request("retail", "GET", c["url"]) for c in candidates))
+    full_time, full_bytes = time.perf_counter() - start, server.bytes_sent
+
+    order = ", ".join(f"{c['width']}x{c['height']}" for c in ranked)
+    print(f"probe ranking of {len(candidates)} candidates: {order}")
+    print(
+        f"  probed {probe_bytes / 1024:.0f} KB in {probe_time * 1000:.0f} ms "
+        f"vs full downloads {full_bytes / 1024:.0f} KB in {full_time * 1000:.0f} ms"
+    )
+
+
+async def _single_flight(server: ThreadingHTTPServer, base_url: str, callers: int) -> None:
+    url = f"{base_url}/shop/popular/shopify_product"
+    before = server.hits
+    results = await asyncio.gather(*(extract_image_candidates(url) for _ in range(callers)))
+    same = all(r == results[0] for r in results)
+    print(f"{callers} concurrent lookups of one page: {server.hits - before} fetch(es), identical results: {same}")
+
+
+async def _batch(base_url: str, names: list[str], count: int) -> None:
+    # Keep the retailer hint in the path so the site rules still apply.
+    site = {"amazon_product": "amazon", "next_product": "next.co.il", "shopify_product": "shop"}
+    urls = [f"{base_url}/{site[names[i % len(names)]]}/{i}/{names[i % len(names)]}" for i in range(count)]
+
+    start = time.perf_counter()
+    for url in urls:
+        await extract_images_from_url(url)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await extract_images_from_urls(urls)
+    concurrent = time.perf_counter() - start
+    found = sum(bool(images) for images in results)
+    print(f"batch of {count} pages: sequential={sequential:.2f}s concurrent={concurrent:.2f}s ({found}/{count} with images)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3, help="Simulated server latency per page (s)")
+    parser.add_argument("--pages", type=int, default=24, help="Pages in the batch comparison")
+    args = parser.parse_args()
+
+    pages = _load_fixtures()
+    engines = _engines()
+    for name, html in pages.items():
+        url = _PAGE_URLS[name]
+        print(f"{name} ({len(html) / 1024:.0f} KB, parsed {_parsed_fraction(url, html):.0%} before stopping):")
+        for label, fn in engines:
+            ms, images = _time(lambda: fn(url, html), args.repeat)
+            top = images[0] if images else None
+            print(f"  {label:24s} {ms:8.1f} ms  {len(images)} image(s), first: {top}")
+
+    server, base_url = _serve(pages, args.latency)
+    try:
+        asyncio.run(_batch(base_url, list(pages), args.pages))
+        asyncio.run(_single_flight(server, base_url, 50))
+        asyncio.run(_probe(server, base_url))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
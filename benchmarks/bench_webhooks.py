@@ -0,0 +1,186 @@
+"""
+Replay synthetic signed Stripe events at the webhook and check each purchase is credited once.
+
+By default boots stub_supabase and `uvicorn api.index:app` in child processes (so the client
+doesn't compete with either for the GIL), seeds `--accounts` users, then fires `--events` checkout.session.completed
+events from `--concurrency` clients. `--duplicates` of the deliveries resend an event that was
+already sent (same id, fresh signature), as Stripe retries do. Reports acknowledgement latency
+(an event is acknowledged once recorded and credited right after) and, once crediting has
+caught up, whether every user's balance went up by exactly one grant per distinct event.
+
+    python -m benchmarks.bench_webhooks --events 5000 --concurrency 64 --duplicates 0.2
+    python -m benchmarks.bench_webhooks --supabase-latency 0.2    # slow database
+
+With --url it fires at an already running instance instead (signing with --secret, crediting
+--user-id), and only reports latencies; check the balances there yourself.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+from jose import jwt
+
+from benchmarks.load_test import _ROOT, _free_port, _percentile, _start_app
+
+_WEBHOOK_SECRET = "whsec_bench"
+_CREDITS_PER_EVENT = 25
+
+
+def signed_event(user_id: str, secret: str, event_id: str | None = None) -> tuple[bytes, str]:
+    """A checkout.session.completed payload and its Stripe-Signature header."""
+    payload = json.dumps({
+        "id": event_id or f"evt_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {
+            "client_reference_id": user_id,
+            "metadata": {"plan": "starter", "credits": str(_CREDITS_PER_EVENT)},
+        }},
+    }).encode("utf-8")
+    timestamp = str(int(time.time()))
+    signature = hmac.new(secret.encode("utf-8"), timestamp.encode() + b"." + payload, hashlib.sha256).hexdigest()
+    return payload, f"t={timestamp},v1={signature}"
+
+
+async def _fire(url: str, secret: str, user_ids: list[str], events: int, concurrency: int, duplicates: float, seed: int):
+    """Send `events` deliveries; returns (latencies, failures, {event id: user id}, elapsed)."""
+    rng = random.Random(seed)
+    sent: dict[str, str] = {}
+    plan = []
+    for _ in range(events):
+        if sent and rng.random() < duplicates:
+            event_id = rng.choice(list(sent))
+            plan.append((event_id, sent[event_id]))
+        else:
+            event_id, user_id = f"evt_{uuid.uuid4().hex}", rng.choice(user_ids)
+            sent[event_id] = user_id
+            plan.append((event_id, user_id))
+    latencies, failures = [], 0
+    pending = iter(plan)
+
+    async def client(http: httpx.AsyncClient):
+        nonlocal failures
+        for event_id, user_id in pending:
+            payload, signature = signed_event(user_id, secret, event_id)
+            start = time.perf_counter()
+            try:
+                resp = await http.post("/webhook/stripe", content=payload,
+                                       headers={"Stripe-Signature": signature, "Content-Type": "application/json"})
+                ok = resp.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            failures += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=30, limits=limits) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, failures, sent, elapsed
+
+
+def _start_stub(port: int, latency: float) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_supabase", "--port", str(port), "--latency", str(latency)], cwd=_ROOT,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/rest/v1/profiles", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("stub_supabase did not come up")
+
+
+def _wait_for_balances(rest: httpx.Client, expected: dict, timeout: float = 60) -> dict:
+    """Balances once they match `expected`, or as they are after `timeout` seconds."""
+    deadline = time.time() + timeout
+    while True:
+        balances = {p["id"]: p["credits"] for p in rest.get("/profiles", params={"select": "id,credits"}).json()}
+        if all(balances.get(u) == credits for u, credits in expected.items()) or time.time() > deadline:
+            return balances
+        time.sleep(0.2)
+
+
+def _report(latencies: list[float], failures: int, sent: dict, elapsed: float):
+    print(f"{len(latencies)} deliveries ({len(sent)} distinct events) in {elapsed:.1f}s: "
+          f"{len(latencies) / elapsed:.0f}/s, {failures} failed")
+    print("ack latency: " + ", ".join(
+        f"p{int(q * 100)} {_percentile(latencies, q) * 1000:.1f} ms" for q in (0.5, 0.95, 0.99)
+    ) + f", max {max(latencies) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000, help="deliveries to send")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duplicates", type=float, default=0.1, help="fraction of deliveries that resend an event")
+    parser.add_argument("--accounts", type=int, default=50)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="fire at this running instance instead of booting one")
+    parser.add_argument("--secret", default=os.environ.get("STRIPE_WEBHOOK_SECRET", _WEBHOOK_SECRET))
+    parser.add_argument("--user-id", action="append", help="user to credit with --url (repeatable)")
+    args = parser.parse_args()
+
+    if args.url:
+        if not args.user_id:
+            raise SystemExit("--url needs at least one --user-id")
+        _report(*asyncio.run(_fire(args.url, args.secret, args.user_id, args.events, args.concurrency, args.duplicates, args.seed)))
+        return
+
+    supabase_port, app_port = _free_port(), _free_port()
+    stub = _start_stub(supabase_port, args.supabase_latency)
+    rest = httpx.Client(base_url=f"http://127.0.0.1:{supabase_port}/rest/v1", timeout=30)
+    user_ids = [str(uuid.uuid4()) for _ in range(args.accounts)]
+    rest.post("/profiles", json=[{"id": u, "email": f"{u}@bench.local", "credits": 0} for u in user_ids])
+
+    env = {
+        **os.environ,
+        "SUPABASE_URL": f"http://127.0.0.1:{supabase_port}",
+        "SUPABASE_SERVICE_ROLE_KEY": jwt.encode({"role": "service_role"}, "stub", algorithm="HS256"),
+        "STRIPE_WEBHOOK_SECRET": _WEBHOOK_SECRET,
+        "METRICS_TOKEN": "",
+    }
+    log_path = os.path.join(tempfile.mkdtemp(prefix="tryon-webhooks-"), "app.log")
+    try:
+        app = _start_app(env, app_port, log_path)
+        try:
+            latencies, failures, sent, elapsed = asyncio.run(_fire(
+                f"http://127.0.0.1:{app_port}", _WEBHOOK_SECRET, user_ids, args.events, args.concurrency, args.duplicates, args.seed
+            ))
+            expected = {user_id: 0 for user_id in user_ids}
+            for user_id in sent.values():
+                expected[user_id] += _CREDITS_PER_EVENT
+            # Credits land just after each acknowledgement; give the app's apply tasks time to finish.
+            balances = _wait_for_balances(rest, expected)
+        finally:
+            app.terminate()
+            app.wait(timeout=10)
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+
+    _report(latencies, failures, sent, elapsed)
+    print(f"app log: {log_path}")
+    wrong = [u for u in user_ids if balances.get(u) != expected[u]]
+    print(f"balances: {len(user_ids) - len(wrong)}/{len(user_ids)} credited exactly once per event")
+    if wrong or failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""
+Mixed-traffic load test for the API, against local stand-ins for everything it calls.
+
+Boots stub_fal (configurable latency), stub_supabase (PostgREST + Storage) and stub_retail
+(product pages and garment images) in this process, starts `uvicorn api.index:app` in a child
+process pointed at them, seeds users and gallery history, then runs `--users` virtual users for
+`--duration` seconds, each picking requests from a weighted mix:
+
+  generate   POST /generate with a garment URL, then poll /jobs/{id} until it finishes
+             (reported as `generate` for the submit and `generate_e2e` for the whole job)
+  gallery    GET /gallery, following next_cursor for up to three pages
+  extract    POST /extract-image for a product page
+  profile    GET /user/profile
+  webhook    POST /webhook/stripe with a signed checkout.session.completed event
+
+Reports throughput, p50/p95/p99 per operation, the app process's peak RSS and CPU time, and
+the per-stage breakdown from its /metrics (see api/metrics.py).
+
+    python -m benchmarks.load_test --users 32 --duration 60 --fal-latency 2.0
+    python -m benchmarks.load_test --save benchmarks/load_baseline.json
+    python -m benchmarks.load_test --mix generate=1,gallery=3 --baseline ''
+
+Every run is compared with the reference run checked in as benchmarks/load_baseline.json (or
+--baseline; '' skips it): the script exits non-zero if throughput fell, or any operation's p95
+rose, by more than --tolerance times the saved value. The comparison only happens when the run
+is comparable: same settings (users, mix, latencies, ...) and the same machine (CPU model and
+count, OS, Python; see `machine_fingerprint`). Otherwise it just says why it was skipped; record
+a baseline for your machine with --save. Extra environment (cache settings, concurrency
+limits, ...) is passed through to the app; the per-user rate limit is off unless
+TRYON_RATE_LIMIT_PER_MINUTE is set, since a few seeded accounts stand in for many users.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+from jose import jwt
+
+from benchmarks import stub_fal, stub_retail, stub_supabase
+from benchmarks.bench_preprocess import _synthetic_photo
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_JWT_SECRET = "bench-jwt-secret"
+_WEBHOOK_SECRET = "whsec_bench"
+# Reference run checked in next to this script; compared against by default.
+_BASELINE = os.path.join(_ROOT, "benchmarks", "load_baseline.json")
+_DEFAULT_MIX = "generate=2,gallery=4,extract=2,profile=3,webhook=1"
+_STAGE_RE = re.compile(r'^(tryon_stage_seconds|tryon_payload_bytes)_(sum|count)\{(.*)\} (\S+)$')
+
+
+def machine_fingerprint() -> str:
+    """What timings depend on: CPU model and count, OS and Python version."""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return f"{cpu or platform.machine()} x{os.cpu_count()}, {platform.system()}, Python {platform.python_version()}"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def _seed(users: int, gallery_rows: int) -> list[str]:
+    stub_supabase.reset()
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    start = time.time() - gallery_rows * 60
+    for user_id in user_ids:
+        stub_supabase.tables["profiles"].append({"id": user_id, "email": f"{user_id}@bench.local", "credits": 10 ** 6})
+        for i in range(gallery_rows):
+            stub_supabase.tables["generations"].append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(start + i * 60)),
+                "base_url": "seed",
+                "garment_url": "seed",
+                "result_url": "seed",
+                "thumbnail_url": None,
+            })
+    return user_ids
+
+
+def _start_app(env: dict, port: int, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.index:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"The app exited during startup; see {log_path}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f"The app did not come up; see {log_path}")
+
+
+def _process_usage(pid: int) -> dict:
+    """Peak/current RSS (MB) and CPU seconds of `pid`, from /proc (Linux only)."""
+    usage = {"peak_rss_mb": None, "rss_mb": None, "cpu_seconds": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    usage["peak_rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("VmRSS:"):
+                    usage["rss_mb"] = int(line.split()[1]) / 1024
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        usage["cpu_seconds"] = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        pass
+    return usage
+
+
+def _scrape_metrics(text: str) -> dict:
+    """{(family, labels): {"sum": .., "count": ..}} for stage timings and payload sizes."""
+    series = {}
+    for line in text.splitlines():
+        m = _STAGE_RE.match(line)
+        if m:
+            series.setdefault((m.group(1), m.group(3)), {})[m.group(2)] = float(m.group(4))
+    return series
+
+
+def _stage_breakdown(before: dict, after: dict) -> dict:
+    stages, payloads = {}, {}
+    for (family, labels), values in after.items():
+        prior = before.get((family, labels), {})
+        count = values.get("count", 0) - prior.get("count", 0)
+        total = values.get("sum", 0) - prior.get("sum", 0)
+        if count <= 0:
+            continue
+        label = dict(re.findall(r'(\w+)="([^"]*)"', labels))
+        if family == "tryon_stage_seconds":
+            name = label["stage"] + ("" if label.get("outcome") == "ok" else f" ({label.get('outcome')})")
+            stages[name] = {"count": int(count), "mean_ms": total / count * 1000, "total_s": total}
+        else:
+            payloads[label["kind"]] = {"count": int(count), "mean_kb": total / count / 1024}
+    return {"stages": stages, "payloads": payloads}
+
+
+class _Traffic:
+    def __init__(self, client: httpx.AsyncClient, args, user_ids: list[str], retail_url: str, fixtures: list[str]):
+        self.client = client
+        self.args = args
+        self.tokens = {u: jwt.encode({"sub": u, "aud": "authenticated", "email": f"{u}@bench.local"}, _JWT_SECRET, algorithm="HS256") for u in user_ids}
+        self.user_ids = user_ids
+        self.retail_url = retail_url
+        self.fixtures = fixtures
+        self.bases = [_synthetic_photo(i, size=(1536, 2048)) for i in range(4)]
+        self.samples: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def _headers(self, user_id: str) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def _product(self, rng: random.Random) -> int:
+        # A few popular products and a long tail, so caches see realistic reuse.
+        return int(rng.paretovariate(1.2)) % self.args.products
+
+    def _record(self, op: str, seconds: float, ok: bool) -> None:
+        self.samples.setdefault(op, []).append(seconds)
+        if not ok:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    async def generate(self, rng, user_id):
+        files = {"base_image": ("base.jpg", rng.choice(self.bases), "image/jpeg")}
+        data = {"garment_url": f"{self.retail_url}/img/{self._product(rng)}/garment.jpg", "garment_category": "tops"}
+        start = time.perf_counter()
+        resp = await self.client.post("/generate", files=files, data=data, headers=self._headers(user_id))
+        self._record("generate", time.perf_counter() - start, resp.status_code == 202)
+        if resp.status_code != 202:
+            return
+        job_url = resp.json()["status_url"]
+        while True:
+            await asyncio.sleep(0.25)
+            job = (await self.client.get(job_url, headers=self._headers(user_id))).json()
+            if job.get("status") in ("succeeded", "failed"):
+                break
+        self._record("generate_e2e", time.perf_counter() - start, job["status"] == "succeeded")
+
+    async def gallery(self, rng, user_id):
+        cursor = None
+        for _ in range(rng.randint(1, 3)):
+            start = time.perf_counter()
+            resp = await self.client.get("/gallery", params={"cursor": cursor} if cursor else {}, headers=self._headers(user_id))
+            self._record("gallery", time.perf_counter() - start, resp.status_code == 200)
+            cursor = resp.json().get("next_cursor") if resp.status_code == 200 else None
+            if not cursor:
+                break
+
+    async def extract(self, rng, user_id):
+        url = f"{self.retail_url}/p/{self._product(rng)}/{rng.choice(self.fixtures)}.html"
+        start = time.perf_counter()
+        resp = await self.client.post("/extract-image", data={"url": url})
+        self._record("extract", time.perf_counter() - start, resp.status_code == 200)
+
+    async def profile(self, rng, user_id):
+        start = time.perf_counter()
+        resp = await self.client.get("/user/profile", headers=self._headers(user_id))
+        self._record("profile", time.perf_counter() - start, resp.status_code == 200)
+
+    async def webhook(self, rng, user_id):
+        payload = json.dumps({
+            "id": f"evt_{uuid.uuid4().hex}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "data": {"object": {"client_reference_id": user_id, "metadata": {"plan": "starter", "credits": "25"}}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(_WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        start = time.perf_counter()
+        resp = await self.client.post(
+            "/webhook/stripe", content=payload,
+            headers={"Stripe-Signature": f"t={timestamp},v1={signature}", "Content-Type": "application/json"},
+        )
+        self._record("webhook", time.perf_counter() - start, resp.status_code == 200)
+
+    async def user(self, seed: int, mix: dict[str, float], deadline: float):
+        rng = random.Random(seed)
+        ops, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights)[0]
+            try:
+                await getattr(self, op)(rng, rng.choice(self.user_ids))
+            except httpx.HTTPError:
+                self._record(op, 0.0, False)
+
+
+def _parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("generate", "gallery", "extract", "profile", "webhook"):
+            raise SystemExit(f"unknown operation in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def _run(args, app_url: str, traffic_args: tuple) -> tuple[dict, float, dict, dict]:
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=app_url, timeout=300, limits=limits) as client:
+        traffic = _Traffic(client, args, *traffic_args)
+        # One of each first, so imports, pools and caches aren't billed to the measured run.
+        warm = random.Random(-1)
+        for op in _parse_mix(args.mix):
+            await getattr(traffic, op)(warm, traffic.user_ids[0])
+        traffic.samples.clear()
+        traffic.errors.clear()
+
+        before = _scrape_metrics((await client.get("/metrics")).text)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(traffic.user(i, _parse_mix(args.mix), deadline) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+        after = _scrape_metrics((await client.get("/metrics")).text)
+    return traffic.samples, elapsed, traffic.errors, _stage_breakdown(before, after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured traffic")
+    parser.add_argument("--mix", default=_DEFAULT_MIX, help="operation weights, e.g. generate=2,gallery=4")
+    parser.add_argument("--fal-latency", type=float, default=2.0)
+    parser.add_argument("--fal-error-rate", type=float, default=0.0)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    parser.add_argument("--retail-latency", type=float, default=0.05)
+    parser.add_argument("--accounts", type=int, default=50, help="seeded users")
+    parser.add_argument("--gallery-rows", type=int, default=60, help="seeded generations per user")
+    parser.add_argument("--products", type=int, default=200, help="distinct retailer products")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=_BASELINE, help="Compare against a JSON file written by --save ('' to skip)")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+    _parse_mix(args.mix)
+
+    fal_port, supabase_port, app_port = _free_port(), _free_port(), _free_port()
+    stub_fal.start_in_thread(fal_port, args.fal_latency, error_rate=args.fal_error_rate)
+    stub_supabase.start_in_thread(supabase_port, args.supabase_latency)
+    retail, retail_url = stub_retail.start_in_thread(0, args.retail_latency)
+    user_ids = _seed(args.accounts, args.gallery_rows)
+
+    workdir = tempfile.mkdtemp(prefix="tryon-load-")
+    env = {
+        "TRYON_RATE_LIMIT_PER_MINUTE": "0",
+        **os.environ,
+        "PYTHONPATH": _ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "FAL_BASE_URL": f"http://127.0.0.1:{fal_port}",
+        "FAL_KEY": "stub:stub",
+        "SUPABASE_URL": f"http://127.0.0.1:{supabase_port}",
+        "SUPABASE_SERVICE_ROLE_KEY": jwt.encode({"role": "service_role"}, "stub", algorithm="HS256"),
+        "SUPABASE_JWT_SECRET": _JWT_SECRET,
+        "STRIPE_API_KEY": "sk_test_stub",
+        "STRIPE_WEBHOOK_SECRET": _WEBHOOK_SECRET,
+        "STORAGE_BACKEND": "supabase",
+        "TRYON_GARMENT_CACHE_DIR": os.path.join(workdir, "garments"),
+        "METRICS_TOKEN": "",
+    }
+    log_path = os.path.join(workdir, "app.log")
+    app = _start_app(env, app_port, log_path)
+    try:
+        cpu_before = _process_usage(app.pid)["cpu_seconds"]
+        samples, elapsed, errors, breakdown = asyncio.run(
+            _run(args, f"http://127.0.0.1:{app_port}", (user_ids, retail_url, retail.fixtures))
+        )
+        usage = _process_usage(app.pid)
+    finally:
+        app.terminate()
+        app.wait(timeout=10)
+
+    operations = {}
+    for op, values in sorted(samples.items()):
+        operations[op] = {
+            "count": len(values),
+            "errors": errors.get(op, 0),
+            "rate_per_s": len(values) / elapsed,
+            "p50_ms": _percentile(values, 0.50) * 1000,
+            "p95_ms": _percentile(values, 0.95) * 1000,
+            "p99_ms": _percentile(values, 0.99) * 1000,
+        }
+    requests_done = sum(o["count"] for name, o in operations.items() if name != "generate_e2e")
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "baseline", "tolerance")},
+        "machine": machine_fingerprint(),
+        "throughput_per_s": requests_done / elapsed,
+        "operations": operations,
+        "app_peak_rss_mb": usage["peak_rss_mb"],
+        "app_cpu_seconds": (usage["cpu_seconds"] - cpu_before) if usage["cpu_seconds"] is not None and cpu_before is not None else None,
+        **breakdown,
+    }
+
+    print(f"{args.users} users for {elapsed:.1f}s, Fal latency {args.fal_latency}s, mix {args.mix}")
+    print(f"throughput: {result['throughput_per_s']:.1f} requests/s")
+    print(f"{'operation':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, o in operations.items():
+        print(f"{op:<14}{o['count']:>7}{o['errors']:>8}{o['p50_ms']:10.1f}{o['p95_ms']:10.1f}{o['p99_ms']:10.1f}")
+    peak = f"{result['app_peak_rss_mb']:.0f} MB" if result["app_peak_rss_mb"] else "n/a"
+    cpu = f"{result['app_cpu_seconds']:.1f}s" if result["app_cpu_seconds"] is not None else "n/a"
+    print(f"app process: peak RSS {peak}, CPU {cpu} (log: {log_path})")
+    print("per-stage breakdown (from /metrics):")
+    for stage, s in sorted(breakdown["stages"].items(), key=lambda i: -i[1]["total_s"]):
+        print(f"  {stage:<22}{s['count']:>7} x {s['mean_ms']:9.1f} ms  = {s['total_s']:8.1f}s")
+    for kind, p in sorted(breakdown["payloads"].items()):
+        print(f"  {kind + ' bytes':<22}{p['count']:>7} x {p['mean_kb']:9.1f} KB")
+
+    # Read the baseline before --save can overwrite it, so re-recording still shows the change.
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    if baseline:
+        if baseline.get("machine") != result["machine"]:
+            print(f"baseline was recorded on another machine ({baseline.get('machine')}); not comparing")
+            return
+        changed = sorted(k for k, v in result["config"].items() if baseline["config"].get(k) != v)
+        if changed:
+            print(f"baseline was recorded with different settings ({', '.join(changed)}); not comparing")
+            return
+        regressions = []
+        if result["throughput_per_s"] * args.tolerance < baseline["throughput_per_s"]:
+            regressions.append(f"throughput {result['throughput_per_s']:.1f}/s vs {baseline['throughput_per_s']:.1f}/s")
+        for op, o in operations.items():
+            saved = baseline["operations"].get(op)
+            if saved and o["p95_ms"] > saved["p95_ms"] * args.tolerance:
+                regressions.append(f"{op} p95 {o['p95_ms']:.0f}ms vs {saved['p95_ms']:.0f}ms")
+        print(f"baseline comparison (tolerance {args.tolerance}x): {'; '.join(regressions) or 'OK'}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
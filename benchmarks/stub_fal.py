@@ -0,0 +1,83 @@
+"""
+Local stand-in for the Fal REST API, used by the benchmarks.
+
+Accepts any `POST /<model_path>` and answers like nano-banana-pro/edit after a
+configurable delay, so we can measure our own overhead without paying for inference.
+It can also inject faults: random 503s, and a slow tail of requests.
+
+    python -m benchmarks.stub_fal --port 8765 --latency 2.0 --error-rate 0.1 --slow-rate 0.05
+    FAL_BASE_URL=http://127.0.0.1:8765 FAL_KEY=stub:stub python -m benchmarks.bench_generate
+"""
+import argparse
+import asyncio
+import io
+import random
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+
+app = FastAPI()
+app.state.latency = 2.0
+app.state.error_rate = 0.0
+app.state.slow_rate = 0.0
+app.state.slow_factor = 5.0
+app.state.requests = 0
+
+_result_png = io.BytesIO()
+Image.new("RGB", (768, 1024), (120, 90, 160)).save(_result_png, format="PNG")
+
+
+def configure(latency: float = 2.0, error_rate: float = 0.0, slow_rate: float = 0.0, slow_factor: float = 5.0):
+    app.state.latency = latency
+    app.state.error_rate = error_rate
+    app.state.slow_rate = slow_rate
+    app.state.slow_factor = slow_factor
+
+
+@app.get("/results/{name}")
+async def result_image(name: str):
+    # The "generated" image, so result URLs can actually be downloaded.
+    return Response(_result_png.getvalue(), media_type="image/png")
+
+
+@app.post("/{model_path:path}")
+async def run_model(model_path: str, request: Request):
+    body = await request.body()
+    app.state.requests += 1
+    if random.random() < app.state.error_rate:
+        await asyncio.sleep(app.state.latency * 0.1)
+        return JSONResponse(status_code=503, content={"detail": "stub: injected failure"})
+    latency = app.state.latency
+    if random.random() < app.state.slow_rate:
+        latency *= app.state.slow_factor
+    await asyncio.sleep(latency)
+    return {
+        "images": [{"url": f"{str(request.base_url).rstrip('/')}/results/{len(body)}.png"}],
+        "description": "stub",
+    }
+
+
+def start_in_thread(port: int = 8765, latency: float = 2.0, **faults) -> uvicorn.Server:
+    """Boot the stub on a background thread and wait until it accepts requests."""
+    configure(latency, **faults)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds to sleep per inference")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that are slow")
+    parser.add_argument("--slow-factor", type=float, default=5.0, help="latency multiplier for slow requests")
+    args = parser.parse_args()
+    configure(args.latency, args.error_rate, args.slow_rate, args.slow_factor)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
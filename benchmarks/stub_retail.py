@@ -0,0 +1,104 @@
+"""
+Local stand-in for retailer sites, used by the benchmarks.
+
+Serves the product-page fixtures under `/p/<product>/<fixture>.html` with every image URL
+rewritten to `/img/<product>/...` on this server, so scraping, probing and garment downloads
+all stay local. Any `/img/...` path returns a garment-on-white-canvas JPEG (honouring
+`Range: bytes=0-N` like a CDN); `<product>` just keeps pages and images distinct per product.
+
+    python -m benchmarks.stub_retail --port 8767 --latency 0.05
+"""
+import argparse
+import gzip
+import io
+import os
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageDraw
+
+_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+_IMAGE_URL_RE = re.compile(r"https?://[^/\"'\s<>]+(/[^\"'\s<>]*?\.(?:jpg|jpeg|png|webp))", re.IGNORECASE)
+_COLOURS = [(40, 70, 160), (180, 40, 40), (20, 120, 60), (30, 30, 30), (200, 160, 60), (120, 60, 140)]
+
+
+def _load_pages() -> dict[str, str]:
+    pages = {}
+    for name in sorted(os.listdir(_FIXTURES)):
+        if name.endswith(".html.gz"):
+            with gzip.open(os.path.join(_FIXTURES, name), "rt", encoding="utf-8") as f:
+                pages[name[: -len(".html.gz")]] = f.read()
+    return pages
+
+
+def _garment_jpeg(colour: tuple[int, int, int], size=(1000, 1250)) -> bytes:
+    im = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(im)
+    w, h = size
+    draw.rectangle((w * 0.3, h * 0.2, w * 0.7, h * 0.85), fill=colour)
+    draw.polygon([(w * 0.3, h * 0.2), (w * 0.12, h * 0.45), (w * 0.2, h * 0.5), (w * 0.3, h * 0.35)], fill=colour)
+    draw.polygon([(w * 0.7, h * 0.2), (w * 0.88, h * 0.45), (w * 0.8, h * 0.5), (w * 0.7, h * 0.35)], fill=colour)
+    out = io.BytesIO()
+    im.save(out, format="JPEG", quality=88)
+    return out.getvalue()
+
+
+def start_in_thread(port: int = 0, latency: float = 0.05) -> tuple[ThreadingHTTPServer, str]:
+    """Boot the stub on a background thread; returns the server and its base URL."""
+    templates = _load_pages()
+    images = [_garment_jpeg(c) for c in _COLOURS]
+    pages: dict[str, bytes] = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.hits += 1
+            time.sleep(server.latency)
+            path = self.path.split("?")[0]
+            page = re.fullmatch(r"/p/(\w+)/(\w+)\.html", path)
+            if path.startswith("/img/"):
+                body, content_type = images[zlib.crc32(path.encode("utf-8")) % len(images)], "image/jpeg"
+            elif page and page.group(2) in templates:
+                if path not in pages:
+                    local = f"{server.base_url}/img/{page.group(1)}"
+                    pages[path] = _IMAGE_URL_RE.sub(lambda m: local + m.group(1), templates[page.group(2)]).encode("utf-8")
+                body, content_type = pages[path], "text/html; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            status = 200
+            ranged = re.fullmatch(r"bytes=0-(\d+)", self.headers.get("Range", ""))
+            if ranged:
+                status, body = 206, body[: int(ranged.group(1)) + 1]
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The scraper hung up once it had the product image.
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.hits = 0
+    server.latency = latency
+    server.fixtures = sorted(templates)
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds to sleep per request")
+    args = parser.parse_args()
+    server, base_url = start_in_thread(args.port, args.latency)
+    print(f"serving {', '.join(server.fixtures)} at {base_url}/p/<product>/<fixture>.html")
+    threading.Event().wait()
@@ -0,0 +1,342 @@
+"""
+Local stand-in for the parts of Supabase the API talks to, used by the benchmarks.
+
+Speaks enough PostgREST for the real supabase-py client (select with eq/or/order/limit,
+single(), insert, update) plus the RPCs from the atomic_credits, rate_limits and stripe_events
+migrations, and enough Storage for `SupabaseStorage` (upload, HEAD, public download, signed
+URLs; tokens aren't checked).
+Everything lives in memory; each request sleeps `latency` seconds to stand in for the network
+round trip.
+
+    python -m benchmarks.stub_supabase --port 8766 --latency 0.01
+    SUPABASE_URL=http://127.0.0.1:8766 SUPABASE_SERVICE_ROLE_KEY=<any JWT> uvicorn api.index:app
+"""
+import argparse
+import asyncio
+import datetime
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+app = FastAPI()
+app.state.latency = 0.01
+app.state.requests = 0
+
+# table name -> rows; storage key -> (content type, bytes); reservation id -> row
+tables: dict[str, list[dict]] = {"profiles": [], "generations": [], "stripe_events": []}
+objects: dict[str, tuple[str, bytes]] = {}
+reservations: dict[str, dict] = {}
+# rate-limit key -> (tokens, time of last update)
+buckets: dict[str, tuple[float, float]] = {}
+
+
+def configure(latency: float = 0.01):
+    app.state.latency = latency
+
+
+def reset():
+    for rows in tables.values():
+        rows.clear()
+    objects.clear()
+    reservations.clear()
+    buckets.clear()
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _profile(user_id: str) -> dict | None:
+    return next((p for p in tables["profiles"] if p["id"] == user_id), None)
+
+
+def _split_top_level(text: str) -> list[str]:
+    """Split a PostgREST logic expression on commas outside parentheses and quotes."""
+    parts, depth, quoted, current = [], 0, False, ""
+    for ch in text:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(current)
+            current = ""
+            continue
+        current += ch
+    return parts + [current] if current else parts
+
+
+_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+}
+
+
+def _compare(row: dict, column: str, op: str, value: str) -> bool:
+    actual = row.get(column)
+    if actual is None:
+        return False
+    value = value.strip('"')
+    if isinstance(actual, bool):
+        value = value == "true"
+    elif isinstance(actual, (int, float)):
+        value = type(actual)(value)
+    else:
+        actual = str(actual)
+    return _OPS[op](actual, value)
+
+
+def _condition(expr: str):
+    """Predicate for `col.op.value`, `and(...)` or `or(...)`."""
+    for logic, combine in (("and(", all), ("or(", any)):
+        if expr.startswith(logic):
+            parts = [_condition(p) for p in _split_top_level(expr[len(logic):-1])]
+            return lambda row: combine(p(row) for p in parts)
+    column, op, value = expr.split(".", 2)
+    return lambda row: _compare(row, column, op, value)
+
+
+def _filters(request: Request) -> list:
+    predicates = []
+    for key, value in request.query_params.multi_items():
+        if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+            continue
+        if key in ("or", "and"):
+            predicates.append(_condition(f"{key}{value}"))
+        else:
+            op, _, operand = value.partition(".")
+            predicates.append(lambda row, c=key, o=op, v=operand: _compare(row, c, o, v))
+    return predicates
+
+
+def _matching(request: Request, table: str) -> list[dict]:
+    predicates = _filters(request)
+    return [row for row in tables.setdefault(table, []) if all(p(row) for p in predicates)]
+
+
+def _project(rows: list[dict], select: str | None) -> list[dict]:
+    if not select or select == "*":
+        return [dict(r) for r in rows]
+    columns = [c.strip() for c in select.split(",")]
+    return [{c: r.get(c) for c in columns} for r in rows]
+
+
+def _reply(request: Request, rows: list[dict]):
+    if "vnd.pgrst.object" in request.headers.get("accept", ""):
+        if len(rows) != 1:
+            return JSONResponse(status_code=406, content={"code": "PGRST116", "message": f"{len(rows)} rows returned"})
+        return rows[0]
+    return rows
+
+
+@app.middleware("http")
+async def _latency(request: Request, call_next):
+    app.state.requests += 1
+    if app.state.latency:
+        await asyncio.sleep(app.state.latency)
+    return await call_next(request)
+
+
+@app.get("/rest/v1/{table}")
+async def select(table: str, request: Request):
+    rows = _matching(request, table)
+    orders = [o for value in request.query_params.getlist("order") for o in value.split(",")]
+    for order in reversed(orders):
+        column, _, direction = order.partition(".")
+        rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction.startswith("desc"))
+    offset = int(request.query_params.get("offset", 0))
+    limit = request.query_params.get("limit")
+    rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+    return _reply(request, _project(rows, request.query_params.get("select")))
+
+
+@app.post("/rest/v1/{table}")
+async def insert(table: str, request: Request):
+    body = await request.json()
+    rows = body if isinstance(body, list) else [body]
+    inserted = []
+    for row in rows:
+        row = {"id": str(uuid.uuid4()), "created_at": _now(), **row}
+        tables.setdefault(table, []).append(row)
+        inserted.append(dict(row))
+    return JSONResponse(status_code=201, content=inserted)
+
+
+@app.patch("/rest/v1/{table}")
+async def update(table: str, request: Request):
+    changes = await request.json()
+    rows = _matching(request, table)
+    for row in rows:
+        row.update(changes)
+    return [dict(r) for r in rows]
+
+
+# Credit functions, with the semantics of supabase/migrations/*_atomic_credits.sql.
+
+def _reserve_credits(p_user_id, p_amount, p_email=None):
+    profile = _profile(p_user_id)
+    if profile is None:
+        profile = {"id": p_user_id, "email": p_email, "credits": 3, "created_at": _now()}
+        tables["profiles"].append(profile)
+    if profile["credits"] < p_amount:
+        return []
+    profile["credits"] -= p_amount
+    reservation_id = str(uuid.uuid4())
+    reservations[reservation_id] = {"user_id": p_user_id, "amount": p_amount, "status": "reserved"}
+    return [{"reservation_id": reservation_id, "credits": profile["credits"]}]
+
+
+def _commit_credits(p_reservation_id, p_used=None):
+    reservation = reservations.get(p_reservation_id)
+    if reservation is None:
+        return None
+    profile = _profile(reservation["user_id"])
+    if reservation["status"] == "reserved":
+        used = reservation["amount"] if p_used is None else min(max(p_used, 0), reservation["amount"])
+        profile["credits"] += reservation["amount"] - used
+        reservation["status"] = "committed"
+    return profile["credits"]
+
+
+def _refund_credits(p_reservation_id):
+    return _commit_credits(p_reservation_id, 0)
+
+
+def _add_credits(p_user_id, p_amount):
+    profile = _profile(p_user_id)
+    if profile is None:
+        return None
+    profile["credits"] += p_amount
+    return profile["credits"]
+
+
+def _take_rate_limit_tokens(p_key, p_cost, p_rate, p_burst):
+    # As in the rate_limits migration.
+    now = time.monotonic()
+    tokens, updated = buckets.get(p_key, (p_burst, now))
+    tokens = min(p_burst, tokens + (now - updated) * p_rate)
+    needed = min(p_cost, p_burst)
+    if tokens >= needed:
+        buckets[p_key] = (min(p_burst, tokens - p_cost), now)
+        return 0
+    buckets[p_key] = (tokens, now)
+    return (needed - tokens) / p_rate
+
+
+def _stripe_event(p_id):
+    return next((e for e in tables["stripe_events"] if e["id"] == p_id), None)
+
+
+def _record_stripe_event(p_id, p_type, p_payload):
+    # As in the stripe_events migration.
+    event = _stripe_event(p_id)
+    if event is None:
+        event = {"id": p_id, "type": p_type, "payload": p_payload, "status": "pending", "attempts": 0,
+                 "last_error": None, "received_at": _now(), "processed_at": None}
+        tables["stripe_events"].append(event)
+    return event["status"]
+
+
+def _apply_stripe_event(p_id):
+    event = _stripe_event(p_id)
+    if event is None:
+        return []
+    if event["status"] != "pending":
+        return [{"status": event["status"], "user_id": None, "credits": None}]
+    event["attempts"] += 1
+    if event["type"] != "checkout.session.completed":
+        event.update(status="ignored", processed_at=_now())
+        return [{"status": "ignored", "user_id": None, "credits": None}]
+    session = event["payload"]["data"]["object"]
+    user_id = session.get("client_reference_id")
+    credits = _add_credits(user_id, int(session["metadata"]["credits"]))
+    if credits is None:
+        event["last_error"] = f"no profile for user {user_id}"
+        return [{"status": "pending", "user_id": user_id, "credits": None}]
+    event.update(status="processed", last_error=None, processed_at=_now())
+    return [{"status": "processed", "user_id": user_id, "credits": credits}]
+
+
+_RPCS = {
+    "reserve_credits": _reserve_credits,
+    "commit_credits": _commit_credits,
+    "refund_credits": _refund_credits,
+    "add_credits": _add_credits,
+    "take_rate_limit_tokens": _take_rate_limit_tokens,
+    "record_stripe_event": _record_stripe_event,
+    "apply_stripe_event": _apply_stripe_event,
+}
+
+
+@app.post("/rest/v1/rpc/{fn}")
+async def rpc(fn: str, request: Request):
+    if fn not in _RPCS:
+        return JSONResponse(status_code=404, content={"code": "PGRST202", "message": f"function {fn} not found"})
+    return _RPCS[fn](**(await request.json()))
+
+
+# Registered before the upload route, which would otherwise take "sign" for a bucket name.
+@app.post("/storage/v1/object/sign/{bucket}")
+async def sign_objects(bucket: str, request: Request):
+    body = await request.json()
+    return [
+        {
+            "path": key,
+            "signedURL": f"/object/sign/{bucket}/{key}?token={uuid.uuid4().hex}" if f"{bucket}/{key}" in objects else None,
+            "error": None if f"{bucket}/{key}" in objects else "Object not found",
+        }
+        for key in body["paths"]
+    ]
+
+
+@app.get("/storage/v1/object/sign/{bucket}/{key:path}")
+async def download_signed_object(bucket: str, key: str):
+    return await download_object(bucket, key)
+
+
+@app.post("/storage/v1/object/{bucket}/{key:path}")
+async def upload_object(bucket: str, key: str, request: Request):
+    objects[f"{bucket}/{key}"] = (request.headers.get("content-type", "application/octet-stream"), await request.body())
+    return {"Key": f"{bucket}/{key}"}
+
+
+@app.head("/storage/v1/object/{bucket}/{key:path}")
+async def head_object(bucket: str, key: str):
+    return Response(status_code=200 if f"{bucket}/{key}" in objects else 404)
+
+
+@app.get("/storage/v1/object/public/{bucket}/{key:path}")
+async def download_object(bucket: str, key: str):
+    found = objects.get(f"{bucket}/{key}")
+    if found is None:
+        return Response(status_code=404)
+    return Response(found[1], media_type=found[0])
+
+
+def start_in_thread(port: int = 8766, latency: float = 0.01) -> uvicorn.Server:
+    """Boot the stub on a background thread and wait until it accepts requests."""
+    configure(latency)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds to sleep per request")
+    args = parser.parse_args()
+    configure(args.latency)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -102,22 +102,31 @@ document.getElementById('sendMagicLink').addEventListener('click', async () => {
 });
 
 // Gallery Loading
-async function loadGallery() {
+let galleryCursor = null;
+
+async function loadGallery(more = false) {
     const { data: { session } } = await supabaseClient.auth.getSession();
     if (!session) return openAuthModal('signin');
 
     const grid = document.getElementById('galleryGrid');
     const empty = document.getElementById('galleryEmpty');
-    grid.innerHTML = '<div class="col-span-full text-center py-10"><div class="inline-block animate-spin rounded-full h-8 w-8 border-4 border-indigo-600 border-t-transparent"></div></div>';
+    const moreBtn = document.getElementById('galleryMore');
+    if (!more) {
+        galleryCursor = null;
+        grid.innerHTML = '<div class="col-span-full text-center py-10"><div class="inline-block animate-spin rounded-full h-8 w-8 border-4 border-indigo-600 border-t-transparent"></div></div>';
+    }
+    moreBtn.disabled = true;
 
     try {
-        const resp = await fetch('/gallery', {
+        const url = galleryCursor ? `/gallery?cursor=${encodeURIComponent(galleryCursor)}` : '/gallery';
+        const resp = await fetch(url, {
             headers: { 'Authorization': `Bearer ${session.access_token}` }
         });
-        const items = await resp.json();
+        const page = await resp.json();
+        const items = page.items || [];
 
-        grid.innerHTML = '';
-        if (!items || items.length === 0) {
+        if (!more) grid.innerHTML = '';
+        if (!more && items.length === 0) {
             empty.classList.remove('hidden');
         } else {
             empty.classList.add('hidden');
@@ -125,7 +134,7 @@ async function loadGallery() {
                 const div = document.createElement('div');
                 div.className = 'group relative aspect-[3/4] rounded-2xl overflow-hidden premium-shadow bg-white';
                 div.innerHTML = `
-                    <img src="${item.result_url}" class="w-full h-full object-cover transition-transform duration-500 group-hover:scale-110">
+                    <img src="${item.thumbnail_url || item.result_url}" loading="lazy" class="w-full h-full object-cover transition-transform duration-500 group-hover:scale-110">
                     <div class="absolute inset-0 bg-gradient-to-t from-black/60 to-transparent opacity-0 group-hover:opacity-100 transition-opacity flex items-end p-4">
                         <a href="${item.result_url}" download class="text-white text-xs font-bold uppercase tracking-wider">Download</a>
                     </div>
@@ -133,8 +142,13 @@ async function loadGallery() {
                 grid.appendChild(div);
             });
         }
+        galleryCursor = page.next_cursor;
+        moreBtn.classList.toggle('hidden', !galleryCursor);
     } catch (e) {
         grid.innerHTML = '<p class="col-span-full text-rose-500 text-center">Failed to load gallery</p>';
+        moreBtn.classList.add('hidden');
+    } finally {
+        moreBtn.disabled = false;
     }
 }
 
@@ -229,9 +243,14 @@ document.getElementById('fetchUrlBtn').addEventListener('click', async () => {
         const formData = new FormData();
         formData.append('url', url);
 
+        // Signed-in users get their own fetch allowance instead of sharing their address's.
+        const { data: { session } } = await supabaseClient.auth.getSession();
+        const headers = session ? { 'Authorization': `Bearer ${session.access_token}` } : {};
+
         const response = await fetch('/extract-image', {
             method: 'POST',
-            body: formData
+            body: formData,
+            headers: headers
         });
         const data = await response.json();
 
@@ -255,6 +274,17 @@ document.getElementById('fetchUrlBtn').addEventListener('click', async () => {
 document.getElementById('buyStarterBtn').addEventListener('click', () => buyCredits('starter'));
 document.getElementById('buyProBtn').addEventListener('click', () => buyCredits('pro'));
 
+// Generations run as background jobs; poll until the job finishes.
+async function waitForJob(statusUrl, headers) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 1500));
+        const resp = await fetch(statusUrl, { headers });
+        const job = await resp.json();
+        if (!resp.ok) throw new Error(job.detail || 'Lost track of the generation');
+        if (job.status === 'succeeded' || job.status === 'failed') return job;
+    }
+}
+
 document.getElementById('generateBtn').addEventListener('click', async () => {
     const { data: { session } } = await supabaseClient.auth.getSession();
     if (!session) return openAuthModal('signup');
@@ -298,7 +328,17 @@ document.getElementById('generateBtn').addEventListener('click', async () => {
             headers: headers
         });
 
-        const data = await response.json();
+        let data = await response.json();
+
+        if (response.ok && data.job_id) {
+            data = await waitForJob(data.status_url, headers);
+            if (data.status === 'failed') {
+                if (data.error && data.error.status_code === 402) {
+                    throw new Error("Insufficient credits. Please top up to continue styling!");
+                }
+                throw new Error((data.error && data.error.detail) || 'Generation failed');
+            }
+        }
 
         if (response.ok) {
             document.getElementById('resultImage').src = data.result_url;
@@ -0,0 +1,9 @@
+-- Results are copied from Fal into our own storage; keep a small thumbnail for the gallery.
+alter table public.generations
+add column if not exists thumbnail_url text;
+
+-- Public bucket for base, garment, result and thumbnail images.
+-- Keys are unguessable (content hashes / generation ids) and only the service role can write.
+insert into storage.buckets (id, name, public)
+values ('tryon', 'tryon', true)
+on conflict (id) do nothing;
@@ -0,0 +1,4 @@
+-- The gallery reads one user's generations newest first, a page at a time, seeking on (created_at, id).
+-- Matching the sort order lets each page be a single index range scan instead of a sort of the user's history.
+create index if not exists generations_user_created_at_idx
+on public.generations (user_id, created_at desc, id desc);
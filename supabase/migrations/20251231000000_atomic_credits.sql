@@ -0,0 +1,138 @@
+-- Atomic credit accounting.
+--
+-- Generations used to read `credits`, run for up to a minute, then write `credits - 1`, and the
+-- Stripe webhook did the same read-modify-write to add credits, so concurrent requests could
+-- double-spend or lose a top-up. Every balance change now happens in one statement:
+--
+--   reserve_credits(user, amount)       take `amount` up front, returns the reservation id + balance
+--   commit_credits(reservation, used)   keep `used` of the reservation (default all), refund the rest
+--   refund_credits(reservation)         give the whole reservation back (failed generation)
+--   add_credits(user, amount)           purchases
+--
+-- Commit and refund only act on a reservation that is still 'reserved', so retrying either is safe.
+
+create table if not exists public.credit_reservations (
+  id uuid default gen_random_uuid() primary key,
+  user_id uuid not null references public.profiles(id) on delete cascade,
+  amount int not null check (amount > 0),
+  used int,
+  status text not null default 'reserved' check (status in ('reserved', 'committed', 'refunded')),
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  settled_at timestamp with time zone
+);
+
+create index if not exists credit_reservations_open_idx
+on public.credit_reservations (created_at)
+where status = 'reserved';
+
+-- Only the API (service role) touches reservations.
+alter table public.credit_reservations enable row level security;
+
+create or replace function public.reserve_credits(p_user_id uuid, p_amount int, p_email text default null)
+returns table (reservation_id uuid, credits int)
+language plpgsql
+as $$
+declare
+  v_credits int;
+begin
+  if p_amount <= 0 then
+    raise exception 'reserve_credits: amount must be positive, got %', p_amount;
+  end if;
+
+  -- Safety fallback for users created before the signup trigger existed.
+  insert into public.profiles (id, email, credits)
+  values (p_user_id, p_email, 3)
+  on conflict (id) do nothing;
+
+  update public.profiles
+  set credits = public.profiles.credits - p_amount
+  where id = p_user_id and public.profiles.credits >= p_amount
+  returning public.profiles.credits into v_credits;
+
+  if not found then
+    -- Not enough credits: no reservation, nothing changed.
+    return;
+  end if;
+
+  return query
+  insert into public.credit_reservations (user_id, amount)
+  values (p_user_id, p_amount)
+  returning id, v_credits;
+end;
+$$;
+
+create or replace function public.commit_credits(p_reservation_id uuid, p_used int default null)
+returns int
+language plpgsql
+as $$
+declare
+  v_user_id uuid;
+  v_refund int;
+  v_credits int;
+begin
+  update public.credit_reservations r
+  set status = 'committed',
+      used = least(greatest(coalesce(p_used, r.amount), 0), r.amount),
+      settled_at = now()
+  where r.id = p_reservation_id and r.status = 'reserved'
+  returning r.user_id, r.amount - r.used into v_user_id, v_refund;
+
+  if not found then
+    -- Already settled (a retry); report the current balance.
+    select p.credits into v_credits
+    from public.profiles p join public.credit_reservations r on r.user_id = p.id
+    where r.id = p_reservation_id;
+    return v_credits;
+  end if;
+
+  update public.profiles
+  set credits = credits + v_refund
+  where id = v_user_id
+  returning credits into v_credits;
+  return v_credits;
+end;
+$$;
+
+create or replace function public.refund_credits(p_reservation_id uuid)
+returns int
+language sql
+as $$
+  select public.commit_credits(p_reservation_id, 0);
+$$;
+
+create or replace function public.add_credits(p_user_id uuid, p_amount int)
+returns int
+language sql
+as $$
+  update public.profiles
+  set credits = credits + p_amount
+  where id = p_user_id
+  returning credits;
+$$;
+
+-- Reservations left open by a worker that died mid-generation. Run periodically (e.g. pg_cron).
+create or replace function public.refund_stale_credit_reservations(p_older_than interval default interval '1 hour')
+returns int
+language plpgsql
+as $$
+declare
+  v_reservation uuid;
+  v_count int := 0;
+begin
+  for v_reservation in
+    select id from public.credit_reservations
+    where status = 'reserved' and created_at < now() - p_older_than
+  loop
+    perform public.refund_credits(v_reservation);
+    v_count := v_count + 1;
+  end loop;
+  return v_count;
+end;
+$$;
+
+-- These are exposed through PostgREST; only the service role may move credits.
+revoke execute on function public.reserve_credits(uuid, int, text) from public, anon, authenticated;
+revoke execute on function public.commit_credits(uuid, int) from public, anon, authenticated;
+revoke execute on function public.refund_credits(uuid) from public, anon, authenticated;
+revoke execute on function public.add_credits(uuid, int) from public, anon, authenticated;
+revoke execute on function public.refund_stale_credit_reservations(interval) from public, anon, authenticated;
@@ -0,0 +1,64 @@
+-- Shared token buckets for per-user rate limits (TRYON_RATE_LIMIT_BACKEND=supabase).
+--
+-- The in-process limiter only sees one instance's traffic; with several serverless instances
+-- a user could multiply their allowance. take_rate_limit_tokens refills and spends a bucket in
+-- one locked statement, so concurrent instances can't both spend the same tokens.
+
+create table if not exists public.rate_limit_buckets (
+  key text primary key,
+  tokens double precision not null,
+  updated_at timestamp with time zone not null default clock_timestamp()
+);
+
+-- Only the API (service role) touches buckets.
+alter table public.rate_limit_buckets enable row level security;
+
+-- Returns 0 when `p_cost` tokens were taken, otherwise the seconds until they would be (and
+-- takes nothing). Buckets refill at `p_rate` tokens per second up to `p_burst`. A cost above
+-- `p_burst` (a large batch) is granted on a full bucket and leaves it negative, to be waited
+-- off at `p_rate`. A negative `p_cost` gives tokens back, e.g. for a request turned away after
+-- it was counted.
+create or replace function public.take_rate_limit_tokens(
+  p_key text, p_cost double precision, p_rate double precision, p_burst double precision
+)
+returns double precision
+language plpgsql
+as $$
+declare
+  v_now timestamp with time zone := clock_timestamp();
+  v_tokens double precision;
+  v_needed double precision := least(p_cost, p_burst);
+begin
+  insert into public.rate_limit_buckets (key, tokens, updated_at)
+  values (p_key, p_burst, v_now)
+  on conflict (key) do nothing;
+
+  select least(p_burst, b.tokens + extract(epoch from v_now - b.updated_at) * p_rate)
+  into v_tokens
+  from public.rate_limit_buckets b
+  where b.key = p_key
+  for update;
+
+  if v_tokens >= v_needed then
+    update public.rate_limit_buckets set tokens = least(p_burst, v_tokens - p_cost), updated_at = v_now where key = p_key;
+    return 0;
+  end if;
+
+  update public.rate_limit_buckets set tokens = v_tokens, updated_at = v_now where key = p_key;
+  return (v_needed - v_tokens) / p_rate;
+end;
+$$;
+
+-- Buckets idle long enough to be full again carry no information. Run periodically (e.g. pg_cron).
+create or replace function public.prune_rate_limit_buckets(p_idle interval default interval '1 hour')
+returns int
+language sql
+as $$
+  with deleted as (
+    delete from public.rate_limit_buckets where updated_at < now() - p_idle returning 1
+  )
+  select count(*)::int from deleted;
+$$;
+
+revoke execute on function public.take_rate_limit_tokens(text, double precision, double precision, double precision) from public, anon, authenticated;
+revoke execute on function public.prune_rate_limit_buckets(interval) from public, anon, authenticated;
@@ -0,0 +1,129 @@
+-- Idempotent Stripe webhook processing.
+--
+-- The webhook used to add credits inline, so a Stripe retry (or a slow response that made
+-- Stripe retry) could credit the same purchase twice. Events are now recorded by their Stripe
+-- id when they arrive and applied once, right after the webhook is acknowledged:
+--
+--   record_stripe_event(id, type, payload)   store the event once; returns its status
+--   apply_stripe_event(id)                   add the credits and mark it processed, atomically
+--   apply_pending_stripe_events()            apply whatever the webhook didn't (stripe_event_sweep)
+--
+-- Recording an event that is already there changes nothing, and applying one that is no
+-- longer 'pending' is a no-op, so replays and duplicate deliveries can't double-credit.
+
+create table if not exists public.stripe_events (
+  id text primary key,
+  type text not null,
+  payload jsonb not null,
+  status text not null default 'pending' check (status in ('pending', 'processed', 'ignored')),
+  attempts int not null default 0,
+  last_error text,
+  received_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  processed_at timestamp with time zone
+);
+
+create index if not exists stripe_events_pending_idx
+on public.stripe_events (received_at)
+where status = 'pending';
+
+-- Only the API (service role) touches events.
+alter table public.stripe_events enable row level security;
+
+create or replace function public.record_stripe_event(p_id text, p_type text, p_payload jsonb)
+returns text
+language plpgsql
+as $$
+declare
+  v_status text;
+begin
+  insert into public.stripe_events (id, type, payload)
+  values (p_id, p_type, p_payload)
+  on conflict (id) do nothing
+  returning status into v_status;
+
+  if not found then
+    -- A duplicate delivery: report how far the first one got.
+    select e.status into v_status from public.stripe_events e where e.id = p_id;
+  end if;
+  return v_status;
+end;
+$$;
+
+-- Returns the event's status afterwards and, when this call added credits, the user and their
+-- new balance. A failure is recorded on the event (attempts, last_error) and leaves it pending.
+create or replace function public.apply_stripe_event(p_id text)
+returns table (status text, user_id uuid, credits int)
+language plpgsql
+as $$
+declare
+  v_event public.stripe_events%rowtype;
+  v_session jsonb;
+  v_user_id uuid;
+  v_credits int;
+begin
+  select * into v_event from public.stripe_events e where e.id = p_id for update;
+  if not found then
+    return;
+  end if;
+  if v_event.status <> 'pending' then
+    return query select v_event.status, null::uuid, null::int;
+    return;
+  end if;
+
+  if v_event.type <> 'checkout.session.completed' then
+    update public.stripe_events e
+    set status = 'ignored', attempts = e.attempts + 1, processed_at = now()
+    where e.id = p_id;
+    return query select 'ignored'::text, null::uuid, null::int;
+    return;
+  end if;
+
+  begin
+    v_session := v_event.payload -> 'data' -> 'object';
+    v_user_id := (v_session ->> 'client_reference_id')::uuid;
+    v_credits := public.add_credits(v_user_id, (v_session -> 'metadata' ->> 'credits')::int);
+    if v_credits is null then
+      raise exception 'no profile for user %', v_user_id;
+    end if;
+  exception when others then
+    update public.stripe_events e
+    set attempts = e.attempts + 1, last_error = sqlerrm
+    where e.id = p_id;
+    return query select 'pending'::text, v_user_id, null::int;
+    return;
+  end;
+
+  update public.stripe_events e
+  set status = 'processed', attempts = e.attempts + 1, last_error = null, processed_at = now()
+  where e.id = p_id;
+  return query select 'processed'::text, v_user_id, v_credits;
+end;
+$$;
+
+-- Events the webhook recorded but didn't get to apply (the apply failed, or the instance was
+-- frozen or died after answering). Scheduled every minute by the stripe_event_sweep migration.
+create or replace function public.apply_pending_stripe_events(
+  p_older_than interval default interval '5 minutes', p_max_attempts int default 10
+)
+returns int
+language plpgsql
+as $$
+declare
+  v_event text;
+  v_count int := 0;
+begin
+  for v_event in
+    select e.id from public.stripe_events e
+    where e.status = 'pending' and e.received_at < now() - p_older_than and e.attempts < p_max_attempts
+    order by e.received_at
+  loop
+    perform public.apply_stripe_event(v_event);
+    v_count := v_count + 1;
+  end loop;
+  return v_count;
+end;
+$$;
+
+revoke execute on function public.record_stripe_event(text, text, jsonb) from public, anon, authenticated;
+revoke execute on function public.apply_stripe_event(text) from public, anon, authenticated;
+revoke execute on function public.apply_pending_stripe_events(interval, int) from public, anon, authenticated;
@@ -0,0 +1,9 @@
+-- Make the image bucket private.
+--
+-- It holds people's base photos and try-on results, and a public bucket serves any object to
+-- anyone who has (or guesses, or finds in a log) its URL. The API now hands out signed URLs
+-- that expire (STORAGE_SIGNED_URL_TTL, see api/storage.py); stored URLs, including the
+-- /object/public/... ones already in generations, are only used to find the object's key.
+update storage.buckets
+set public = false
+where id = 'tryon';
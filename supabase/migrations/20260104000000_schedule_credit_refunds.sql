@@ -0,0 +1,26 @@
+-- Refund credit reservations left open by a generation that never settled them.
+--
+-- A worker that dies mid-generation (a crashed process, or a serverless function killed at its
+-- timeout) keeps the credit it reserved. refund_stale_credit_reservations (atomic_credits
+-- migration) gives those back; schedule it here rather than leaving it to operators. Jobs
+-- settle within minutes, so anything still reserved after an hour is abandoned.
+--
+-- Needs pg_cron (enabled under Database > Extensions on Supabase); without it this only
+-- reports a notice and the function has to be run some other way.
+do $$
+begin
+  if not exists (select 1 from pg_available_extensions where name = 'pg_cron') then
+    raise notice 'pg_cron is not available; schedule refund_stale_credit_reservations() yourself';
+    return;
+  end if;
+  create extension if not exists pg_cron;
+  -- Scheduling under an existing name replaces that job, so re-running this is harmless.
+  execute $cron$
+    select cron.schedule(
+      'refund-stale-credit-reservations',
+      '*/10 * * * *',
+      'select public.refund_stale_credit_reservations()'
+    )
+  $cron$;
+end;
+$$;
@@ -0,0 +1,26 @@
+-- Apply Stripe events the webhook recorded but didn't get to apply.
+--
+-- The webhook acknowledges an event once it's recorded and applies it in the background
+-- (api/webhooks.py). Stripe won't redeliver an acknowledged event, so this sweep is what
+-- guarantees a pending one is credited when that background step fails or never runs. Events
+-- younger than a minute are left to the webhook's own apply.
+--
+-- Needs pg_cron (enabled under Database > Extensions on Supabase); without it this only
+-- reports a notice and apply_pending_stripe_events() has to be run some other way.
+do $$
+begin
+  if not exists (select 1 from pg_available_extensions where name = 'pg_cron') then
+    raise notice 'pg_cron is not available; schedule apply_pending_stripe_events() yourself';
+    return;
+  end if;
+  create extension if not exists pg_cron;
+  -- Scheduling under an existing name replaces that job, so re-running this is harmless.
+  execute $cron$
+    select cron.schedule(
+      'apply-pending-stripe-events',
+      '* * * * *',
+      $sql$select public.apply_pending_stripe_events(interval '1 minute')$sql$
+    )
+  $cron$;
+end;
+$$;
@@ -0,0 +1,66 @@
+"""
+The atomic credit RPCs (atomic_credits migration) under concurrent load, against a real Postgres.
+
+Set TRYON_TEST_DATABASE_URL to a scratch database (it gets a profiles table and the credit
+functions); skipped otherwise, or when psycopg isn't installed.
+"""
+import os
+
+import pytest
+
+from benchmarks import bench_credits
+from benchmarks.bench_credits import _BOOTSTRAP, _MIGRATION, _balance, _create_user, _delete_user, _run_threads
+
+psycopg = pytest.importorskip("psycopg")
+DSN = os.getenv("TRYON_TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DSN, reason="TRYON_TEST_DATABASE_URL is not set")
+
+
+@pytest.fixture(scope="module")
+def admin():
+    try:
+        conn = psycopg.connect(DSN, autocommit=True)
+    except psycopg.OperationalError as e:
+        pytest.skip(f"database unavailable: {e}")
+    conn.execute(_BOOTSTRAP)
+    conn.execute(_MIGRATION.read_text())
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def user(admin):
+    created = []
+
+    def make(credits):
+        created.append(_create_user(admin, credits))
+        return created[-1]
+
+    yield make
+    for user_id in created:
+        _delete_user(admin, user_id)
+
+
+def test_concurrent_reserves_never_overspend(admin, user):
+    user_id = user(30)
+
+    def reserve(conn, _i):
+        return conn.execute("select * from public.reserve_credits(%s, 1)", (user_id,)).fetchone()
+
+    results, _ = _run_threads(DSN, 16, 120, reserve)
+    assert sum(r is not None for r in results) == 30
+    assert _balance(admin, user_id) == 0
+
+
+def test_concurrent_settlements_match_the_ledger(admin):
+    assert bench_credits._mixed(DSN, admin, 16, 400)
+
+
+def test_settling_a_reservation_twice_moves_the_balance_once(admin, user):
+    user_id = user(5)
+    reservation_id, remaining = admin.execute("select * from public.reserve_credits(%s, 3)", (user_id,)).fetchone()
+    assert remaining == 2
+    admin.execute("select public.refund_credits(%s)", (reservation_id,))
+    admin.execute("select public.refund_credits(%s)", (reservation_id,))
+    admin.execute("select public.commit_credits(%s)", (reservation_id,))
+    assert _balance(admin, user_id) == 5
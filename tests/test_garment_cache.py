@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+
+from api import garment_cache
+from api.garment_cache import GarmentCache, cache_url
+
+
+def _serve(monkeypatch):
+    """Answer every GET with a body naming the URL that was requested; returns the request log."""
+    requested = []
+
+    async def request(pool, method, url, headers=None, **kwargs):
+        requested.append(url)
+        return httpx.Response(
+            200, content=f"image at {url}".encode(), headers={"content-type": "image/jpeg"},
+            request=httpx.Request(method, url),
+        )
+
+    monkeypatch.setattr(garment_cache.http_client, "request", request)
+    return requested
+
+
+def test_size_variants_are_cached_separately(tmp_path, monkeypatch):
+    requested = _serve(monkeypatch)
+    cache = GarmentCache(str(tmp_path), max_bytes=10 ** 6, revalidate_after=3600)
+
+    async def run():
+        small = await cache.fetch("https://cdn.example.com/shirt.jpg?width=100")
+        large = await cache.fetch("https://cdn.example.com/shirt.jpg?width=2000")
+        return small, large
+
+    small, large = asyncio.run(run())
+    assert small == b"image at https://cdn.example.com/shirt.jpg?width=100"
+    assert large == b"image at https://cdn.example.com/shirt.jpg?width=2000"
+    assert len(requested) == 2
+
+
+def test_tracking_parameters_share_an_entry(tmp_path, monkeypatch):
+    requested = _serve(monkeypatch)
+    cache = GarmentCache(str(tmp_path), max_bytes=10 ** 6, revalidate_after=3600)
+
+    async def run():
+        await cache.fetch("https://cdn.example.com/shirt.jpg?width=100&utm_source=mail")
+        return await cache.fetch("https://cdn.example.com/shirt.jpg?width=100&fbclid=abc")
+
+    assert asyncio.run(run()) == b"image at https://cdn.example.com/shirt.jpg?width=100&utm_source=mail"
+    assert requested == ["https://cdn.example.com/shirt.jpg?width=100&utm_source=mail"]
+    assert cache.hits == 1
+
+
+def test_cache_url_keeps_everything_but_tracking():
+    assert cache_url("https://a.com/x.jpg?v=2&utm_medium=x&gclid=1#top") == "https://a.com/x.jpg?v=2"
+    assert cache_url("https://a.com/x._AC_SX679_.jpg?width=100") == "https://a.com/x._AC_SX679_.jpg?width=100"